@@ -1,10 +1,42 @@
 import React, { useEffect, useRef, useState } from 'react';
 import useStore from './store';
 
+// Binary audio frame header (see server/services/protocol.py)
+const AUDIO_HEADER_SIZE = 12;
+
+// Binary viseme frame: "EV", version, reserved, uint32 count, uint32 offset ms,
+// then uint16 durations (ms) and uint8 viseme ids
+const VISEME_FRAME_MAGIC = 0x5645; // "EV" read little-endian
+const VISEME_HEADER_SIZE = 12;
+
+const parseVisemeFrame = (buffer, table) => {
+    const view = new DataView(buffer);
+    const count = view.getUint32(4, true);
+    const ids = new Uint8Array(buffer, VISEME_HEADER_SIZE + 2 * count, count);
+    const visemes = new Array(count);
+    let start = 0;
+    for (let i = 0; i < count; i++) {
+        const duration = view.getUint16(VISEME_HEADER_SIZE + 2 * i, true);
+        visemes[i] = { value: table[ids[i]], time: start / 1000, duration: duration / 1000 };
+        start += duration;
+    }
+    return { visemes, offset: view.getUint32(8, true) / 1000 };
+};
+
+const parseAudioFrame = (buffer) => {
+    const view = new DataView(buffer);
+    return {
+        seq: view.getUint32(4, true),
+        sampleRate: view.getUint32(8, true),
+        format: view.getUint8(3),
+        payload: buffer.slice(AUDIO_HEADER_SIZE),
+    };
+};
+
 const AudioRecorder = () => {
     const wsRef = useRef(null);
-    const mediaRecorderRef = useRef(null);
-    const audioChunksRef = useRef([]);
+    const captureRef = useRef(null);
+    const visemeTableRef = useRef([]);
 
     const [isRecording, setIsRecording] = useState(false);
     const [isConnected, setIsConnected] = useState(false);
@@ -18,13 +50,29 @@ const AudioRecorder = () => {
     useEffect(() => {
         const connectWS = () => {
             wsRef.current = new WebSocket('ws://localhost:8000/ws/chat');
+            wsRef.current.binaryType = 'arraybuffer';
 
             wsRef.current.onopen = () => {
                 console.log('✅ WebSocket connected');
                 setIsConnected(true);
+                // Ask for audio as binary frames of raw PCM instead of base64 JSON
+                // and viseme tracks as compact binary frames
+                wsRef.current.send(JSON.stringify({
+                    type: 'hello', audio_transport: 'binary', audio_format: 'pcm16', viseme_format: 'columnar'
+                }));
             };
 
             wsRef.current.onmessage = (event) => {
+                if (event.data instanceof ArrayBuffer) {
+                    if (new DataView(event.data).getUint16(0, true) === VISEME_FRAME_MAGIC) {
+                        const { visemes, offset } = parseVisemeFrame(event.data, visemeTableRef.current);
+                        useStore.getState().addVisemes(visemes, offset);
+                        return;
+                    }
+                    useStore.getState().addStreamChunk(parseAudioFrame(event.data));
+                    return;
+                }
+
                 try {
                     const data = JSON.parse(event.data);
 
@@ -44,21 +92,42 @@ const AudioRecorder = () => {
                     }
 
                     switch (data.type) {
+                        case 'hello_ack':
+                            visemeTableRef.current = data.viseme_table || [];
+                            break;
                         case 'audio_start':
                             useStore.getState().startStream(data.text, []);
                             break;
                         case 'viseme_data':
-                            // Update the active stream with visemes
-                            useStore.getState().activeVisemes = data.visemes; // Direct mutation or action? 
-                            // Better use an action if we added one, currently startStream takes visemes
-                            // Let's add a setAction? Or just re-call startStream? 
-                            // We'll update state directly for perf or add a setter.
-                            // useStore.setState({ activeVisemes: data.visemes }); 
-                            useStore.setState(state => ({ activeVisemes: data.visemes }));
+                            // Each track covers the audio that follows it in the stream
+                            useStore.getState().addVisemes(data.visemes, data.offset || 0);
                             break;
                         case 'audio_chunk':
                             useStore.getState().addStreamChunk(data.audio);
                             break;
+                        case 'partial_transcript':
+                            useStore.getState().setSubtitle(data.text);
+                            break;
+                        case 'final_transcript':
+                            // Server detected end of speech (or we pressed stop)
+                            stopCapture();
+                            if (data.text && data.text.trim().length >= 2) {
+                                useStore.getState().setIsThinking(true);
+                                useStore.getState().setSubtitle(data.text);
+                            } else {
+                                useStore.getState().setSubtitle("");
+                            }
+                            break;
+                        case 'flush':
+                            useStore.getState().flushStream();
+                            break;
+                        case 'error':
+                            // e.g. speech recognition unavailable; text chat still works
+                            console.warn('Server error:', data.code, data.message);
+                            stopCapture();
+                            useStore.getState().setIsThinking(false);
+                            useStore.getState().setSubtitle(data.message);
+                            break;
                         case 'audio_end':
                             console.log('⚡ Stream Ended');
                             useStore.getState().endStream();
@@ -111,7 +180,19 @@ const AudioRecorder = () => {
         }
     }, [textQuery, setTextQuery]);
 
-    // Start Recording
+    // Stop capturing microphone audio (server may already have ended the utterance)
+    const stopCapture = () => {
+        const capture = captureRef.current;
+        if (!capture) return;
+        captureRef.current = null;
+        capture.processor.disconnect();
+        capture.source.disconnect();
+        capture.stream.getTracks().forEach(track => track.stop());
+        capture.context.close();
+        setIsRecording(false);
+    };
+
+    // Start Recording: stream 16 kHz PCM16 frames while the user speaks
     const startRecording = async () => {
         try {
             const stream = await navigator.mediaDevices.getUserMedia({
@@ -122,37 +203,28 @@ const AudioRecorder = () => {
                 }
             });
 
-            audioChunksRef.current = [];
-
-            mediaRecorderRef.current = new MediaRecorder(stream, {
-                mimeType: 'audio/webm;codecs=opus'
-            });
-
-            mediaRecorderRef.current.ondataavailable = (event) => {
-                if (event.data.size > 0) {
-                    audioChunksRef.current.push(event.data);
-                }
-            };
-
-            mediaRecorderRef.current.onstop = () => {
-                // Create blob and send
-                const audioBlob = new Blob(audioChunksRef.current, { type: 'audio/webm' });
-                console.log('🎤 Recording stopped, blob size:', audioBlob.size);
-
-                if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN && audioBlob.size > 0) {
-                    console.log('📤 Sending audio to server...');
-                    wsRef.current.send(audioBlob);
-                    useStore.getState().setIsThinking(true);
-                    useStore.getState().setSubtitle("Processing...");
-                } else {
-                    console.warn('⚠️ WebSocket not ready or empty audio');
+            const context = new AudioContext({ sampleRate: 16000 });
+            const source = context.createMediaStreamSource(stream);
+            const processor = context.createScriptProcessor(2048, 1, 1);
+            const ws = wsRef.current;
+
+            // The browser may not honour the requested rate; the server resamples
+            ws.send(JSON.stringify({ type: 'stt_start', sample_rate: context.sampleRate, format: 'pcm16' }));
+
+            processor.onaudioprocess = (event) => {
+                if (ws.readyState !== WebSocket.OPEN) return;
+                const input = event.inputBuffer.getChannelData(0);
+                const pcm = new Int16Array(input.length);
+                for (let i = 0; i < input.length; i++) {
+                    const s = Math.max(-1, Math.min(1, input[i]));
+                    pcm[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
                 }
-
-                // Stop all tracks
-                stream.getTracks().forEach(track => track.stop());
+                ws.send(pcm.buffer);
             };
+            source.connect(processor);
+            processor.connect(context.destination);
 
-            mediaRecorderRef.current.start(100); // Collect chunks every 100ms
+            captureRef.current = { stream, context, source, processor };
             setIsRecording(true);
             useStore.getState().setSubtitle("Listening...");
             console.log('🎙️ Recording started');
@@ -163,11 +235,14 @@ const AudioRecorder = () => {
         }
     };
 
-    // Stop Recording
+    // Stop Recording: the server transcribes what it has and replies with final_transcript
     const stopRecording = () => {
-        if (mediaRecorderRef.current && mediaRecorderRef.current.state !== 'inactive') {
-            mediaRecorderRef.current.stop();
-            setIsRecording(false);
+        if (captureRef.current) {
+            stopCapture();
+            if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+                wsRef.current.send(JSON.stringify({ type: 'stt_stop' }));
+            }
+            useStore.getState().setSubtitle("Processing...");
             console.log('⏹️ Recording stopped');
         }
     };
@@ -228,7 +303,7 @@ const AudioRecorder = () => {
                     'text-indigo-300'
                 }`}>
                 {isThinking ? '🤔 Thinking...' :
-                    isRecording ? '🎙️ Recording - Click to Send' :
+                    isRecording ? '🎙️ Listening - Click to Send' :
                         '👆 Tap to Speak'}
             </div>
 
@@ -3,6 +3,10 @@ import useStore from './store';
 import { useRef, useEffect } from 'react';
 import { useFrame } from '@react-three/fiber';
 
+// Binary audio frame formats (see server/services/protocol.py)
+const AUDIO_FORMAT_PCM16 = 1;
+const WAV_HEADER_SIZE = 44;
+
 // Map visemes to mouth opening intensity
 const VISEME_INTENSITY = {
   "sil": 0.0, "PP": 0.1, "FF": 0.2, "TH": 0.3,
@@ -21,8 +25,9 @@ export default function Avatar() {
   const audioStartTimeRef = useRef(0);
   const nextStartTimeRef = useRef(0);
   const processedChunksRef = useRef(0);
+  const sourcesRef = useRef([]);
 
-  const { streamQueue, isStreaming, activeVisemes } = useStore();
+  const { streamQueue, isStreaming, activeVisemes, flushCount } = useStore();
 
   // Initialize AudioContext
   useEffect(() => {
@@ -32,6 +37,15 @@ export default function Avatar() {
     };
   }, []);
 
+  // Barge-in: stop everything already scheduled
+  useEffect(() => {
+    sourcesRef.current.forEach(source => {
+      try { source.stop(); } catch (err) { /* already ended */ }
+    });
+    sourcesRef.current = [];
+    isPlayingRef.current = false;
+  }, [flushCount]);
+
   // Process Stream Queue (Sync with WS logic)
   useEffect(() => {
     if (!isStreaming) {
@@ -53,17 +67,37 @@ export default function Avatar() {
         }
 
         for (let i = processedChunksRef.current; i < streamQueue.length; i++) {
-          const chunkBase64 = streamQueue[i];
-          const binaryString = atob(chunkBase64);
-          const bytes = new Uint8Array(binaryString.length);
-          for (let j = 0; j < binaryString.length; j++) bytes[j] = binaryString.charCodeAt(j);
+          const chunk = streamQueue[i];
+          let audioBuffer;
 
           try {
-            const audioBuffer = await ctx.decodeAudioData(bytes.buffer.slice(0));
+            if (typeof chunk === 'string') {
+              // Legacy base64 JSON chunk (complete WAV)
+              const binaryString = atob(chunk);
+              const bytes = new Uint8Array(binaryString.length);
+              for (let j = 0; j < binaryString.length; j++) bytes[j] = binaryString.charCodeAt(j);
+              audioBuffer = await ctx.decodeAudioData(bytes.buffer);
+            } else if (chunk.format === AUDIO_FORMAT_PCM16) {
+              // Raw int16 PCM frame: no decode needed
+              const samples = new Int16Array(chunk.payload);
+              audioBuffer = ctx.createBuffer(1, samples.length, chunk.sampleRate);
+              const channel = audioBuffer.getChannelData(0);
+              for (let j = 0; j < samples.length; j++) channel[j] = samples[j] / 32768;
+            } else if (chunk.payload.byteLength > WAV_HEADER_SIZE) {
+              audioBuffer = await ctx.decodeAudioData(chunk.payload.slice(0));
+            } else {
+              // Streaming WAV header that precedes the PCM frames
+              continue;
+            }
+
             const source = ctx.createBufferSource();
             source.buffer = audioBuffer;
             source.connect(ctx.destination);
             source.start(nextStartTimeRef.current);
+            source.onended = () => {
+              sourcesRef.current = sourcesRef.current.filter(s => s !== source);
+            };
+            sourcesRef.current.push(source);
             nextStartTimeRef.current += audioBuffer.duration;
           } catch (err) {
             console.error("Error decoding chunk:", err);
@@ -6,7 +6,7 @@ const useStore = create((set) => ({
     audioQueue: [],
 
     // Streaming State
-    streamQueue: [],      // Array of base64 chunks
+    streamQueue: [],      // Base64 strings (JSON mode) or parsed binary audio frames
     isStreaming: false,
     activeVisemes: [],    // For current stream
     textQuery: null,      // For quick questions
@@ -23,8 +23,20 @@ const useStore = create((set) => ({
         subtitle: text,
         isThinking: false
     }),
+    // Tracks are timed from their own audio; offset places them on the stream clock
+    addVisemes: (visemes, offset = 0) => set((state) => ({
+        activeVisemes: [...state.activeVisemes, ...visemes.map(v => ({ ...v, time: v.time + offset }))]
+    })),
     addStreamChunk: (chunk) => set((state) => ({ streamQueue: [...state.streamQueue, chunk] })),
     endStream: () => set({ isStreaming: false }),
+    // Barge-in: the server dropped the answer, so drop its queued audio too
+    flushCount: 0,
+    flushStream: () => set((state) => ({
+        isStreaming: false,
+        streamQueue: [],
+        activeVisemes: [],
+        flushCount: state.flushCount + 1
+    })),
 
     setIsThinking: (thinking) => set({ isThinking: thinking }),
     setSubtitle: (text) => set({ subtitle: text }),
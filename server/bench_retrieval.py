@@ -0,0 +1,174 @@
+"""
+Retrieval backend benchmark: NumPy index vs Chroma.
+Builds each backend from synthetic unit embeddings, then, in a fresh process,
+opens it and measures single-query latency (p50/p99), batched query
+throughput and resident memory.
+
+    python bench_retrieval.py
+    python bench_retrieval.py --sizes 1000,100000 --dim 1536 --backends numpy,chroma --dtypes float32,int8
+
+1M chunks at the Qwen embedding size (1536) is ~6 GB of float32; the Chroma
+build at that size takes a long time.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BUILD_BATCH = 5000
+
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1e6
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+    return float("nan")
+
+
+def synthetic_rows(n, dim, seed=0):
+    """Yields (start, float32 unit rows) batches so large builds don't need all rows in memory."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, BUILD_BATCH):
+        rows = rng.standard_normal((min(BUILD_BATCH, n - start), dim)).astype(np.float32)
+        yield start, rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def build(backend, n, dim, directory, dtype):
+    if backend == "numpy":
+        from services.vector_index import NumpyVectorIndex
+        # Write the matrix in one go rather than through repeated add_vectors() rewrites
+        matrix = np.concatenate([rows for _, rows in synthetic_rows(n, dim)])
+        index = NumpyVectorIndex(directory, dtype=dtype)
+        index.add_vectors([str(i) for i in range(n)], [f"chunk {i}" for i in range(n)], [None] * n, matrix)
+    else:
+        import chromadb
+        collection = chromadb.PersistentClient(path=directory).get_or_create_collection(
+            "bench", metadata={"hnsw:space": "cosine"}
+        )
+        for start, rows in synthetic_rows(n, dim):
+            ids = [str(i) for i in range(start, start + len(rows))]
+            collection.add(ids=ids, embeddings=rows.tolist(), documents=[f"chunk {i}" for i in ids])
+
+
+def query(backend, n, dim, directory, dtype, queries, k):
+    rss_before = rss_mb()
+    t0 = time.perf_counter()
+    if backend == "numpy":
+        from services.vector_index import NumpyVectorIndex
+        index = NumpyVectorIndex(directory, dtype=dtype)
+        search = lambda vector: index.search(vector, k)
+        search_batch = lambda vectors: index.search_batch(vectors, k)
+    else:
+        import chromadb
+        collection = chromadb.PersistentClient(path=directory).get_collection("bench")
+        search = lambda vector: collection.query(query_embeddings=[vector.tolist()], n_results=k)
+        search_batch = lambda vectors: collection.query(query_embeddings=vectors.tolist(), n_results=k)
+    open_s = time.perf_counter() - t0
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+    search(vectors[0])  # first touch pages the index in
+
+    latencies = []
+    for vector in vectors:
+        t = time.perf_counter()
+        search(vector)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    t = time.perf_counter()
+    search_batch(vectors)
+    batch_ms = (time.perf_counter() - t) * 1000
+
+    return {
+        "backend": backend if backend == "chroma" else f"numpy-{dtype}",
+        "chunks": n,
+        "dim": dim,
+        "open_s": round(open_s, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "batch_qps": round(queries / (batch_ms / 1000), 1),
+        "rss_mb": round(rss_mb(), 1),
+        "rss_index_mb": round(rss_mb() - rss_before, 1),
+    }
+
+
+def run_worker(args):
+    if args.worker == "build":
+        build(args.backend, args.n, args.dim, args.dir, args.dtype)
+    else:
+        print(json.dumps(query(args.backend, args.n, args.dim, args.dir, args.dtype, args.queries, args.k)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--backends", default="numpy,chroma")
+    parser.add_argument("--dtypes", default="float32", help="numpy row precisions to test")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--worker", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--n", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    parser.add_argument("--dtype", default="float32", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    runs = []
+    for backend in args.backends.split(","):
+        dtypes = args.dtypes.split(",") if backend == "numpy" else ["float32"]
+        for dtype in dtypes:
+            for n in [int(size) for size in args.sizes.split(",")]:
+                runs.append((backend, dtype, n))
+
+    results = []
+    print(f"{'backend':<16}{'chunks':>10}{'p50 ms':>10}{'p99 ms':>10}{'batch q/s':>12}{'RSS MB':>10}{'index MB':>10}")
+    for backend, dtype, n in runs:
+        directory = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+        try:
+            common = [sys.executable, __file__, "--backend", backend, "--n", str(n), "--dim", str(args.dim),
+                      "--dir", directory, "--dtype", dtype]
+            t0 = time.perf_counter()
+            subprocess.run(common + ["--worker", "build"], check=True)
+            build_s = time.perf_counter() - t0
+            output = subprocess.run(
+                common + ["--worker", "query", "--queries", str(args.queries), "--k", str(args.k)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            result["build_s"] = round(build_s, 2)
+            results.append(result)
+            print(f"{result['backend']:<16}{n:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+                  f"{result['batch_qps']:>12}{result['rss_mb']:>10}{result['rss_index_mb']:>10}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
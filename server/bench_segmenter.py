@@ -0,0 +1,161 @@
+"""
+Segmenter policy benchmark.
+Replays sample answers as an LLM token stream and models a single TTS worker
+to compare chunking policies on:
+  - time to first audio
+  - total time until the last chunk is synthesized
+  - playback stalls (time the speaker waits for the next chunk)
+
+Synthesis time is modelled as overhead + per-character cost (tune with
+--tts-overhead-ms / --tts-char-ms), or measured with Kokoro via --kokoro.
+
+    python bench_segmenter.py
+    python bench_segmenter.py --tokens-per-s 20 --policy 24,100,80,300 --kokoro
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.segmenter import SegmenterPolicy, StreamingSegmenter
+
+SAMPLE_ANSWERS = [
+    "Sure! The registrar's office is in the Administration Building, first floor, Room 104. "
+    "It's open from 8 a.m. to 5 p.m., Monday to Friday.",
+    "Dr. Santos handles the enrollment for the College of Engineering, so you can visit her office "
+    "in Bldg. 3, or email her, or ask the department secretary for the forms you need. "
+    "Enrollment closes on Aug. 15.",
+    "The tuition is about 3.5 thousand pesos per unit for most programs, but laboratory fees, "
+    "miscellaneous fees and the student council fee are added on top, so check your assessment "
+    "form at the cashier before paying.",
+    "Hi there! I'm Este. How can I help you today?",
+    "To get your ID, first fill out the form at the Office of Student Affairs, then pay the fee at "
+    "the cashier, and finally have your photo taken at the ID section. It usually takes three days.",
+]
+
+# Roughly 15 characters of speech per second
+PLAYBACK_MS_PER_CHAR = 65.0
+
+
+class LegacySegmenter:
+    """The old boundary check: any token containing . ! ? or a newline, if the sentence is > 3 chars."""
+
+    def __init__(self, policy=None):
+        self.current = ""
+
+    def feed(self, token):
+        self.current += token
+        if any(punct in token for punct in [".", "!", "?", "\n"]) and len(self.current.strip()) > 3:
+            chunk, self.current = self.current.strip(), ""
+            return [chunk]
+        return []
+
+    def flush(self):
+        chunk, self.current = self.current.strip(), ""
+        return [chunk] if chunk else []
+
+
+def tokens(text):
+    return re.findall(r"\s*\S+", text)
+
+
+def simulate(segmenter, text, tokens_per_s, synth_ms):
+    token_ms = 1000.0 / tokens_per_s
+    emitted = []  # (ready time ms, chunk)
+    now = 0.0
+    for token in tokens(text):
+        now += token_ms
+        emitted += [(now, chunk) for chunk in segmenter.feed(token)]
+    emitted += [(now, chunk) for chunk in segmenter.flush()]
+
+    tts_free = 0.0
+    playback_end = None
+    first_audio = None
+    stall = 0.0
+    for ready, chunk in emitted:
+        done = max(tts_free, ready) + synth_ms(chunk)
+        tts_free = done
+        if first_audio is None:
+            first_audio = done
+            playback_end = done
+        elif done > playback_end:
+            stall += done - playback_end
+            playback_end = done
+        playback_end += len(chunk) * PLAYBACK_MS_PER_CHAR
+    return {
+        "first_audio_ms": first_audio or 0.0,
+        "total_ms": tts_free,
+        "stall_ms": stall,
+        "chunks": len(emitted),
+    }
+
+
+def kokoro_synth_ms():
+    from services.kokoro_tts import KokoroTTS
+    tts = KokoroTTS()
+    list(tts.synthesize_stream_raw("Warm up."))
+    cache = {}
+
+    def synth_ms(chunk):
+        if chunk not in cache:
+            t = time.perf_counter()
+            list(tts.synthesize_stream_raw(chunk))
+            cache[chunk] = (time.perf_counter() - t) * 1000
+        return cache[chunk]
+    return synth_ms
+
+
+def parse_policy(spec):
+    first_min, first_max, min_chars, max_chars = (int(v) for v in spec.split(","))
+    return SegmenterPolicy(first_min, first_max, min_chars, max_chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens-per-s", type=float, default=25.0, help="LLM decode speed")
+    parser.add_argument("--tts-overhead-ms", type=float, default=120.0, help="fixed cost per synthesis call")
+    parser.add_argument("--tts-char-ms", type=float, default=4.0, help="synthesis cost per character")
+    parser.add_argument("--kokoro", action="store_true", help="measure synthesis with Kokoro instead")
+    parser.add_argument("--policy", action="append", default=[],
+                        help="first_min,first_max,min,max (repeatable); the default policy is always included")
+    parser.add_argument("--text-file", help="one answer per line instead of the built-in samples")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    answers = SAMPLE_ANSWERS
+    if args.text_file:
+        with open(args.text_file, encoding="utf-8") as f:
+            answers = [line.strip() for line in f if line.strip()]
+
+    if args.kokoro:
+        synth_ms = kokoro_synth_ms()
+    else:
+        synth_ms = lambda chunk: args.tts_overhead_ms + args.tts_char_ms * len(chunk)
+
+    policies = [("legacy", None), ("default", SegmenterPolicy())]
+    policies += [(spec, parse_policy(spec)) for spec in args.policy]
+
+    results = []
+    print(f"{'policy':<20}{'first audio ms':>16}{'total ms':>12}{'stall ms':>12}{'chunks':>8}")
+    for name, policy in policies:
+        runs = []
+        for text in answers:
+            segmenter = LegacySegmenter() if policy is None else StreamingSegmenter(policy)
+            runs.append(simulate(segmenter, text, args.tokens_per_s, synth_ms))
+        row = {key: sum(run[key] for run in runs) / len(runs) for key in runs[0]}
+        row["policy"] = name
+        results.append(row)
+        print(f"{name:<20}{row['first_audio_ms']:>16.0f}{row['total_ms']:>12.0f}"
+              f"{row['stall_ms']:>12.0f}{row['chunks']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Server settings.
+Every value can be overridden with an environment variable of the same name
+prefixed with ESTE_ (e.g. ESTE_TTS_WORKERS=2).
+"""
+import os
+
+
+def _env_int(name, default):
+    value = os.getenv(f"ESTE_{name}")
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(f"ESTE_{name}")
+    return float(value) if value else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(f"ESTE_{name}")
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_str(name, default):
+    return os.getenv(f"ESTE_{name}") or default
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = _env_str("CACHE_DIR", os.path.join(BASE_DIR, "cache"))
+
+
+# Executors: threads dedicated to each kind of blocking model work.
+# Whisper and Kokoro are CPU/GPU bound, so one worker each keeps them from
+# oversubscribing cores; RAG is mostly waiting on Ollama embeddings. LLM
+# streaming is async and needs no threads.
+STT_WORKERS = _env_int("STT_WORKERS", 1)
+RAG_WORKERS = _env_int("RAG_WORKERS", 2)
+TTS_WORKERS = _env_int("TTS_WORKERS", 1)
+
+# Streaming STT: partial transcript cadence, trailing silence that ends an
+# utterance, and the longest utterance kept in the ring buffer
+STT_STREAM_PARTIAL_INTERVAL = _env_float("STT_STREAM_PARTIAL_INTERVAL", 0.6)
+STT_STREAM_SILENCE_MS = _env_int("STT_STREAM_SILENCE_MS", 400)
+STT_STREAM_MAX_SECONDS = _env_int("STT_STREAM_MAX_SECONDS", 30)
+
+# STT micro-batching across sessions: most utterances per Whisper call and
+# how long (ms) an utterance waits for others when the model is idle
+STT_BATCH_MAX_SIZE = _env_int("STT_BATCH_MAX_SIZE", 8)
+STT_BATCH_MAX_WAIT_MS = _env_int("STT_BATCH_MAX_WAIT_MS", 30)
+
+# Ollama server for chat and embeddings (loadtest.py points it at a stub)
+OLLAMA_HOST = _env_str("OLLAMA_HOST", "http://localhost:11434")
+
+# LLM: pooled connections to Ollama and chat turns kept per session (older
+# turns are reused from Ollama's KV cache instead of being prefilled again)
+LLM_MAX_CONNECTIONS = _env_int("LLM_MAX_CONNECTIONS", 8)
+LLM_HISTORY_TURNS = _env_int("LLM_HISTORY_TURNS", 4)
+# Characters of history (turns include their retrieved context). ~1000 tokens
+# leaves room for the system prompt, this turn's context and the answer in
+# Ollama's default 2048-token window; raise it together with num_ctx.
+LLM_HISTORY_CHARS = _env_int("LLM_HISTORY_CHARS", 4000)
+
+# Speculative retrieval (and LLM prefill) on stable partial transcripts. The
+# threshold is the edit similarity the final transcript needs to keep it.
+SPECULATION_ENABLED = _env_bool("SPECULATION_ENABLED", True)
+SPECULATION_THRESHOLD = _env_float("SPECULATION_THRESHOLD", 0.85)
+SPECULATIVE_PREFILL = _env_bool("SPECULATIVE_PREFILL", True)
+
+# LLM -> TTS segmenter chunk sizes (characters): a short first chunk for fast
+# first audio, then longer chunks that synthesize more efficiently
+SEGMENT_FIRST_MIN_CHARS = _env_int("SEGMENT_FIRST_MIN_CHARS", 16)
+SEGMENT_FIRST_MAX_CHARS = _env_int("SEGMENT_FIRST_MAX_CHARS", 80)
+SEGMENT_MIN_CHARS = _env_int("SEGMENT_MIN_CHARS", 60)
+SEGMENT_MAX_CHARS = _env_int("SEGMENT_MAX_CHARS", 240)
+
+# Visemes: precompiled CMUdict lexicon (built on first start) and an LRU for
+# words that need the neural G2P fallback
+VISEME_LEXICON_PATH = _env_str("VISEME_LEXICON_PATH", os.path.join(CACHE_DIR, "viseme_lexicon.bin"))
+VISEME_WORD_CACHE_SIZE = _env_int("VISEME_WORD_CACHE_SIZE", 4096)
+# Drive visemes from the phonemes Kokoro synthesized, timed to the real audio
+VISEMES_FROM_TTS = _env_bool("VISEMES_FROM_TTS", True)
+
+# Processes: with WORKERS > 1, serve.py starts one model host that owns
+# Whisper, Kokoro, G2P and the knowledge base, and the uvicorn workers connect
+# to it at MODEL_HOST ("host:port"). Empty MODEL_HOST loads models in-process.
+WORKERS = _env_int("WORKERS", 1)
+MODEL_HOST = _env_str("MODEL_HOST", "")
+MODEL_HOST_ADDRESS = _env_str("MODEL_HOST_ADDRESS", "127.0.0.1:8765")
+# Shared secret for the host connection; serve.py generates one per run when
+# empty. Required when the host and workers are started separately.
+MODEL_HOST_AUTHKEY = _env_str("MODEL_HOST_AUTHKEY", "")
+# Seconds a worker waits for the host to finish loading its models
+MODEL_HOST_TIMEOUT = _env_float("MODEL_HOST_TIMEOUT", 300.0)
+
+# Sessions
+SESSION_MAX_PENDING_TURNS = _env_int("SESSION_MAX_PENDING_TURNS", 4)
+PIPELINE_QUEUE_SIZE = _env_int("PIPELINE_QUEUE_SIZE", 4)
+
+# TTS cache: in-memory LRU in front of a sqlite store under CACHE_DIR
+TTS_CACHE_ENABLED = _env_bool("TTS_CACHE_ENABLED", True)
+TTS_CACHE_PATH = _env_str("TTS_CACHE_PATH", os.path.join(CACHE_DIR, "tts_cache.sqlite3"))
+TTS_CACHE_MEMORY_MB = _env_int("TTS_CACHE_MEMORY_MB", 64)
+TTS_CACHE_DISK_MB = _env_int("TTS_CACHE_DISK_MB", 512)
+
+# RAG: retrieval backend ("chroma" or "numpy") and numpy index row precision
+# ("float32", "float16" or "int8")
+RAG_BACKEND = _env_str("RAG_BACKEND", "chroma")
+RAG_INDEX_DTYPE = _env_str("RAG_INDEX_DTYPE", "float32")
+# RAG: hybrid BM25 + vector ranking. The lexical fast path skips the
+# embedding call when the best BM25 match clearly wins.
+RAG_HYBRID = _env_bool("RAG_HYBRID", True)
+RAG_VECTOR_WEIGHT = _env_float("RAG_VECTOR_WEIGHT", 1.0)
+RAG_LEXICAL_WEIGHT = _env_float("RAG_LEXICAL_WEIGHT", 1.0)
+RAG_LEXICAL_FAST_PATH = _env_bool("RAG_LEXICAL_FAST_PATH", True)
+RAG_FAST_PATH_MIN_SCORE = _env_float("RAG_FAST_PATH_MIN_SCORE", 3.0)
+RAG_FAST_PATH_DOMINANCE = _env_float("RAG_FAST_PATH_DOMINANCE", 2.0)
+# RAG: where the index is persisted ("" keeps it next to rag_service.py)
+RAG_INDEX_DIR = _env_str("RAG_INDEX_DIR", "")
+# RAG: seconds between checks of the data file for edits (0 disables hot reload)
+RAG_WATCH_INTERVAL = _env_float("RAG_WATCH_INTERVAL", 5.0)
+
+# RAG query caches
+QUERY_EMBEDDING_CACHE_SIZE = _env_int("QUERY_EMBEDDING_CACHE_SIZE", 1024)
+QUERY_EMBEDDING_CACHE_TTL = _env_float("QUERY_EMBEDDING_CACHE_TTL", 3600.0)
+# Off by default: the threshold has to be calibrated for the embedding model
+# first. Embed pairs of questions that must not share a context ("When does
+# the library open?" / "close?") and set the threshold above their highest
+# cosine similarity.
+SEMANTIC_CACHE_ENABLED = _env_bool("SEMANTIC_CACHE_ENABLED", False)
+SEMANTIC_CACHE_THRESHOLD = _env_float("SEMANTIC_CACHE_THRESHOLD", 0.97)
+SEMANTIC_CACHE_SIZE = _env_int("SEMANTIC_CACHE_SIZE", 256)
+SEMANTIC_CACHE_TTL = _env_float("SEMANTIC_CACHE_TTL", 600.0)
+# Also reuse full LLM answers, for repeats of the same question only
+SEMANTIC_ANSWER_CACHE = _env_bool("SEMANTIC_ANSWER_CACHE", False)
+
+# Metrics: latency histograms and gauges at /metrics (Prometheus text format).
+# Session labels give one series per connected kiosk; closed sessions are
+# folded into session="closed".
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+METRICS_SESSION_LABELS = _env_bool("METRICS_SESSION_LABELS", True)
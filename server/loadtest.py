@@ -0,0 +1,527 @@
+"""
+End-to-end load test: many kiosks talking to /ws/chat at once.
+Starts a stub Ollama (deterministic answers at a fixed time to first token
+and token rate, plus hashed bag-of-words embeddings), starts the server
+against it with cold caches and a scratch index, then opens --clients
+WebSocket sessions. Sessions arrive at --arrival-rate per second; each asks
+--turns questions, waiting an exponential think time (mean --think seconds)
+after each answer. Questions are text_query messages or, with --audio,
+recorded utterances (WebM or any container Whisper can decode) sent as one
+binary upload.
+
+Everything random is seeded, so two runs with the same arguments send the
+same workload; --compare prints the change against an earlier --json result.
+
+    python loadtest.py --clients 8 --turns 5
+    python loadtest.py --clients 32 --arrival-rate 4 --audio recordings/ --json after.json --compare before.json
+
+To test a server you started yourself, run the stub where it can reach it
+and point the server at it (ESTE_OLLAMA_HOST), then pass --url:
+
+    python loadtest.py --ollama-stub-only --ollama-port 11435
+    python loadtest.py --url ws://kiosk-server:8000/ws/chat
+
+Time to first audio runs from sending the question to the first audio frame;
+turn latency runs to audio_end. Whisper and Kokoro are the real models, so
+the server machine needs them; only the LLM and embeddings are stubbed.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUESTIONS = [
+    "Where is the registrar's office?",
+    "What time does the library close?",
+    "How do I get my student ID?",
+    "Who is the dean of the College of Engineering?",
+    "How much is the tuition per unit?",
+    "Where can I pay my fees?",
+    "When does enrollment start?",
+    "Is there a clinic on campus?",
+]
+
+STUB_ANSWERS = [
+    "The registrar's office is in the Administration Building, first floor, Room 104. "
+    "It's open from 8 a.m. to 5 p.m., Monday to Friday.",
+    "Sure! You can get your ID at the Office of Student Affairs. Fill out the form, pay the fee at "
+    "the cashier, and have your photo taken at the ID section.",
+    "The library is open until 7 p.m. on weekdays and until noon on Saturdays.",
+    "Tuition is about 3.5 thousand pesos per unit for most programs, with laboratory and "
+    "miscellaneous fees added on top. Check your assessment form at the cashier.",
+    "Hi there! I'm Este. How can I help you today?",
+]
+
+EMBEDDING_DIM = 256
+
+
+# --- Stub Ollama -------------------------------------------------------------
+
+def stub_embedding(text):
+    """Unit bag-of-words vector from hashed tokens, so similar texts land close."""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+        index = int.from_bytes(digest, "little")
+        vector[index % EMBEDDING_DIM] += 1.0 if index & 0x80000000 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class StubOllama:
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.15, tokens_per_s=40.0):
+        """
+        Answers /api/chat with one of STUB_ANSWERS (picked by a hash of the
+        last message), its first token after ttft seconds and the rest at
+        tokens_per_s. Prefill-only requests (num_predict 1) take ttft.
+        """
+        self.ttft = ttft
+        self.tokens_per_s = tokens_per_s
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, messages):
+        last = messages[-1]["content"] if messages else ""
+        return STUB_ANSWERS[zlib.crc32(last.encode("utf-8")) % len(STUB_ANSWERS)]
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/api/version":
+                    self._json({"version": "0.0.0-stub"})
+                elif self.path == "/api/tags":
+                    self._json({"models": []})
+                else:
+                    self._json({"status": "Ollama is running"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                if self.path == "/api/chat":
+                    self._chat(body)
+                elif self.path == "/api/generate":
+                    time.sleep(stub.ttft)
+                    self._json({"model": body.get("model"), "response": stub.answer([{"content": body.get("prompt", "")}]),
+                                "done": True})
+                elif self.path == "/api/embed":
+                    inputs = body.get("input", "")
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    self._json({"model": body.get("model"), "embeddings": [stub_embedding(text) for text in inputs]})
+                elif self.path == "/api/embeddings":
+                    self._json({"embedding": stub_embedding(body.get("prompt", ""))})
+                else:
+                    self._json({"error": f"stub has no {self.path}"}, status=404)
+
+            def _chat(self, body):
+                messages = body.get("messages", [])
+                prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+                done = {"model": body.get("model"), "done": True, "prompt_eval_count": prompt_tokens,
+                        "prompt_eval_duration": int(stub.ttft * 1e9)}
+                if not body.get("stream", True) or body.get("options", {}).get("num_predict") == 1:
+                    time.sleep(stub.ttft)
+                    self._json({**done, "message": {"role": "assistant", "content": "."}})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                tokens = re.findall(r"\s*\S+", stub.answer(messages))
+                start = time.perf_counter()
+                try:
+                    for i, token in enumerate(tokens):
+                        # Scheduled from the request start, so timing doesn't drift under load
+                        delay = start + stub.ttft + i / stub.tokens_per_s - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        self._chunk({"model": body.get("model"), "message": {"role": "assistant", "content": token},
+                                     "done": False})
+                    self._chunk({**done, "message": {"role": "assistant", "content": ""}, "eval_count": len(tokens)})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The server cancelled the turn (barge-in)
+                    pass
+
+            def _chunk(self, obj):
+                data = json.dumps(obj).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _json(self, obj, status=200):
+                data = json.dumps(obj).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+# --- Server under test -------------------------------------------------------
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http_json(url, timeout=5.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def start_server(args, ollama_url, scratch):
+    """Runs main.py (or serve.py with --workers) against the stub with cold caches."""
+    port = free_port()
+    env = {
+        **os.environ,
+        "ESTE_OLLAMA_HOST": ollama_url,
+        "ESTE_RAG_INDEX_DIR": os.path.join(scratch, "index"),
+        "ESTE_TTS_CACHE_PATH": os.path.join(scratch, "tts_cache.sqlite3"),
+        "ESTE_RAG_WATCH_INTERVAL": "0",
+    }
+    for assignment in args.server_env:
+        name, _, value = assignment.partition("=")
+        env[name] = value
+    if args.workers > 1:
+        env["ESTE_MODEL_HOST_ADDRESS"] = f"127.0.0.1:{free_port()}"
+        command = [sys.executable, "serve.py", "--workers", str(args.workers), "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--log-level", "warning"]
+    log = open(os.path.join(scratch, "server.log"), "wb")
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    print(f"🚀 Starting server on port {port} (log: {log.name})...")
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}, see {log.name}")
+        try:
+            status, body = http_json(f"{base}/ready", timeout=1.0)
+            # Audio turns also need Whisper
+            if status == 200 and (body.get("stt_ready") or not args.audio):
+                print(f"✅ Server ready in {body.get('elapsed_seconds', 0):.1f}s")
+                return process, base
+            if body.get("failed") or (args.audio and body.get("stt_failed")):
+                process.terminate()
+                raise RuntimeError(f"server failed to start, see {log.name}")
+        except OSError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"server not ready after {args.startup_timeout}s, see {log.name}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# --- Clients -----------------------------------------------------------------
+
+def load_utterances(path):
+    paths = sorted(glob.glob(os.path.join(path, "*"))) if os.path.isdir(path) else sorted(glob.glob(path))
+    utterances = []
+    for file_path in paths:
+        with open(file_path, "rb") as f:
+            utterances.append((os.path.basename(file_path), f.read()))
+    return utterances
+
+
+def build_workload(args, utterances):
+    """Per-client list of (start delay, [(kind, name, payload, think time)]), fixed by the seed."""
+    rng = random.Random(args.seed)
+    workload, arrival = [], 0.0
+    for _ in range(args.clients):
+        if args.arrival_rate > 0:
+            arrival += rng.expovariate(args.arrival_rate)
+        turns = []
+        for _ in range(args.turns):
+            think = rng.expovariate(1 / args.think) if args.think > 0 else 0.0
+            if utterances and rng.random() < args.audio_ratio:
+                name, payload = rng.choice(utterances)
+                turns.append(("audio", name, payload, think))
+            else:
+                question = rng.choice(QUESTIONS)
+                turns.append(("text", question, question, think))
+        workload.append((arrival, turns))
+    return workload
+
+
+AUDIO_HEADER = struct.Struct("<2sBBII")
+
+
+async def run_client(url, client_id, start_delay, turns, results, turn_timeout):
+    import websockets
+
+    await asyncio.sleep(start_delay)
+    try:
+        async with websockets.connect(url, max_size=None, open_timeout=30) as ws:
+            await ws.send(json.dumps({"type": "hello", "audio_transport": "binary", "viseme_format": "columnar"}))
+            await ws.recv()
+            for kind, name, payload, think in turns:
+                result = {"client": client_id, "kind": kind, "input": name}
+                sent = time.perf_counter()
+                if kind == "audio":
+                    await ws.send(payload)
+                else:
+                    await ws.send(json.dumps({"type": "text_query", "text": payload}))
+                try:
+                    await asyncio.wait_for(receive_turn(ws, sent, result), turn_timeout)
+                except asyncio.TimeoutError:
+                    result["error"] = "timeout"
+                results.append(result)
+                await asyncio.sleep(think)
+    except Exception as e:
+        results.append({"client": client_id, "kind": "connect", "error": f"{type(e).__name__}: {e}"})
+
+
+async def receive_turn(ws, sent, result):
+    """
+    Reads one turn's messages until its audio_end. Audio the server heard no
+    question in ends with a too-short final_transcript instead, and a failed
+    turn with an error event.
+    """
+    audio_bytes = 0
+    while True:
+        message = await ws.recv()
+        if isinstance(message, bytes):
+            if message[:2] != b"EA":
+                continue  # viseme frame
+            if "ttfa" not in result:
+                result["ttfa"] = time.perf_counter() - sent
+            audio_bytes += len(message) - AUDIO_HEADER.size
+            continue
+        data = json.loads(message)
+        if data.get("type") == "audio_chunk" and "ttfa" not in result:
+            result["ttfa"] = time.perf_counter() - sent
+        elif data.get("type") == "audio_end":
+            result["turn"] = time.perf_counter() - sent
+            result["audio_bytes"] = audio_bytes
+            return
+        elif data.get("type") == "final_transcript" and len(data.get("text", "").strip()) < 2:
+            result["skipped"] = True
+            return
+        elif data.get("type") == "error":
+            result["error"] = f"{data.get('code')}: {data.get('message')}"
+            return
+
+
+async def run_load(url, workload, turn_timeout):
+    results = []
+    await asyncio.gather(*(
+        run_client(url, client_id, start, turns, results, turn_timeout)
+        for client_id, (start, turns) in enumerate(workload)
+    ))
+    return results
+
+
+# --- Report ------------------------------------------------------------------
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0..100) of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50_ms": round(1000 * percentile(values, 50), 1),
+        "p95_ms": round(1000 * percentile(values, 95), 1),
+        "p99_ms": round(1000 * percentile(values, 99), 1),
+        "mean_ms": round(1000 * sum(values) / len(values), 1),
+        "max_ms": round(1000 * max(values), 1),
+    }
+
+
+def report(results, wall_seconds):
+    completed = [r for r in results if "turn" in r]
+    summary = {
+        "turns": len(completed),
+        "errors": len([r for r in results if "error" in r]),
+        "skipped": len([r for r in results if r.get("skipped")]),
+        "turns_without_audio": len([r for r in completed if "ttfa" not in r]),
+        "wall_seconds": round(wall_seconds, 2),
+        "turns_per_second": round(len(completed) / wall_seconds, 3) if wall_seconds else 0.0,
+        "time_to_first_audio": summarize([r["ttfa"] for r in completed if "ttfa" in r]),
+        "turn_latency": summarize([r["turn"] for r in completed]),
+        "by_kind": {},
+    }
+    for kind in sorted({r["kind"] for r in completed}):
+        of_kind = [r for r in completed if r["kind"] == kind]
+        summary["by_kind"][kind] = {
+            "turns": len(of_kind),
+            "time_to_first_audio": summarize([r["ttfa"] for r in of_kind if "ttfa" in r]),
+            "turn_latency": summarize([r["turn"] for r in of_kind]),
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n📊 {summary['turns']} turns in {summary['wall_seconds']}s "
+          f"({summary['turns_per_second']} turns/s), {summary['errors']} errors, "
+          f"{summary['skipped']} skipped as silence, {summary['turns_without_audio']} without audio")
+    print(f"{'':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [("time to first audio", summary["time_to_first_audio"]), ("turn latency", summary["turn_latency"])]
+    for kind, by_kind in summary["by_kind"].items():
+        rows.append((f"  {kind} first audio", by_kind["time_to_first_audio"]))
+        rows.append((f"  {kind} turn", by_kind["turn_latency"]))
+    for label, stats in rows:
+        if stats:
+            print(f"{label:<26}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+
+def print_comparison(summary, baseline):
+    base = baseline["summary"]
+    print(f"\n🔁 Against {baseline.get('git_commit') or 'baseline'}:")
+    for metric in ("time_to_first_audio", "turn_latency"):
+        for q in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = (base.get(metric) or {}).get(q), (summary.get(metric) or {}).get(q)
+            if old and new:
+                print(f"   {metric} {q}: {old} -> {new} ({100 * (new - old) / old:+.1f}%)")
+    old, new = base.get("turns_per_second"), summary.get("turns_per_second")
+    if old and new:
+        print(f"   turns_per_second: {old} -> {new} ({100 * (new - old) / old:+.1f}%)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="WebSocket sessions")
+    parser.add_argument("--turns", type=int, default=5, help="questions per session")
+    parser.add_argument("--arrival-rate", type=float, default=2.0, help="new sessions per second (0: all at once)")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between an answer and the next question")
+    parser.add_argument("--audio", help="directory or glob of recorded utterances")
+    parser.add_argument("--audio-ratio", type=float, default=0.5, help="fraction of turns sent as audio")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ttft-ms", type=float, default=150.0, help="stub LLM time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=40.0, help="stub LLM decode rate")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (>1 runs serve.py)")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the server, e.g. ESTE_RAG_BACKEND=numpy")
+    parser.add_argument("--url", help="test a running server at this ws:// URL instead of starting one")
+    parser.add_argument("--ollama-stub-only", action="store_true", help="only run the stub Ollama until interrupted")
+    parser.add_argument("--ollama-port", type=int, default=0, help="stub port (default: any free port)")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--turn-timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--compare", help="earlier --json result to compare against")
+    args = parser.parse_args()
+
+    stub = None
+    if args.ollama_stub_only or not args.url:
+        stub = StubOllama(port=args.ollama_port, ttft=args.ttft_ms / 1000, tokens_per_s=args.tokens_per_s).start()
+        print(f"🤖 Stub Ollama at {stub.url} (first token {args.ttft_ms:.0f}ms, {args.tokens_per_s:g} tokens/s)")
+    if args.ollama_stub_only:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    utterances = load_utterances(args.audio) if args.audio else []
+    if args.audio and not utterances:
+        parser.error(f"no utterances found at {args.audio}")
+    workload = build_workload(args, utterances)
+
+    scratch = tempfile.mkdtemp(prefix="este-loadtest-")
+    process = None
+    server_stats = None
+    try:
+        url = args.url
+        if not url:
+            process, base = start_server(args, stub.url, scratch)
+            url = base.replace("http://", "ws://") + "/ws/chat"
+        print(f"🧪 {args.clients} clients x {args.turns} turns against {url}")
+        t0 = time.perf_counter()
+        results = asyncio.run(run_load(url, workload, args.turn_timeout))
+        wall_seconds = time.perf_counter() - t0
+        try:
+            server_stats = http_json(url.replace("ws://", "http://").rsplit("/ws/", 1)[0] + "/stats")[1]
+        except OSError:
+            pass
+    finally:
+        if process:
+            stop_server(process)
+        if stub:
+            stub.stop()
+
+    summary = report(results, wall_seconds)
+    print_summary(summary)
+    for error in sorted({r["error"] for r in results if "error" in r})[:5]:
+        print(f"   ❌ {error}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(summary, json.load(f))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "git_commit": git_commit(),
+                "config": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+                "summary": summary,
+                "server_stats": server_stats,
+                "turns": results,
+            }, f, indent=2)
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
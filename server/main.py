@@ -2,18 +2,29 @@ from fastapi import FastAPI, WebSocket
 import time
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
-import base64
 import json
+from functools import partial
 import traceback
 
 # Services
-from rag_service import RAGService
-from services.stt import STTService
-from services.llm import LLMService
-from services.viseme_mapper import VisemeMapper
-# from services.tts import TTSService # Deprecated Piper
-from services.kokoro_tts import KokoroTTS
+from services.llm import LLMService, Conversation
+from services.prompt import PromptBuilder
+from services.segmenter import SegmenterPolicy
+from services.pipeline import ResponsePipeline
+from services.scheduler import ModelExecutors, SessionScheduler
+from services.protocol import ClientChannel, parse_sample_rate
+from services.audio import RAW_INPUT_FORMATS
+from services.stt_stream import StreamingRecognizer
+from services.stt_batcher import STTBatcher
+from services.speculation import Speculator, SpeculationStats
+from services.tts_cache import TTSCache
+from services.model_host import ModelHostClient
+from services.startup import Startup
+from services.metrics import Metrics
+import service_factory
+import config
 app = FastAPI()
 
 app.add_middleware(
@@ -25,122 +36,406 @@ app.add_middleware(
 )
 
 # Initialize Services
+# Models load in parallel background stages (services/startup.py) once the app
+# is up; each global below stays None until its stage is ready.
 print("Initializing Services...")
-rag_service = RAGService()
-rag_service.initialize()
-
-stt_service = STTService(model_size="tiny") 
-llm_service = LLMService(model="qwen2.5:1.5b")
-tts_service = KokoroTTS() 
-viseme_mapper = VisemeMapper()
-
-print("🔥 Warming up pipelines...")
-# Warmup RAG (loads ChromaDB)
-rag_service.query("warmup")
-# Warmup LLM (loads model to VRAM)
-print("   Warming up LLM...")
-llm_service.generate("hi") 
-# Warmup TTS (already handled in init, but one more check)
-print("   Warming up TTS...")
-list(tts_service.synthesize_stream_raw("Hello."))
-
-print("✅ All Services Initialized & Warmed Up.")
+model_host = None
+rag_service = None
+stt_service = None
+tts_service = None
+viseme_mapper = None
+stt_batcher = None
+pipeline = None
+
+llm_service = LLMService(model="qwen2.5:1.5b", host=config.OLLAMA_HOST, max_connections=config.LLM_MAX_CONNECTIONS)
+tts_cache = None
+if config.TTS_CACHE_ENABLED:
+    tts_cache = TTSCache(
+        config.TTS_CACHE_PATH,
+        max_memory_bytes=config.TTS_CACHE_MEMORY_MB * 1024 * 1024,
+        max_disk_bytes=config.TTS_CACHE_DISK_MB * 1024 * 1024,
+    )
+executors = ModelExecutors(
+    stt_workers=config.STT_WORKERS,
+    rag_workers=config.RAG_WORKERS,
+    tts_workers=config.TTS_WORKERS,
+)
+prompt_builder = PromptBuilder()
+speculation_stats = SpeculationStats()
+metrics = Metrics(enabled=config.METRICS_ENABLED, session_labels=config.METRICS_SESSION_LABELS)
+# Connected WebSocket sessions by id
+sessions = {}
+
+
+def create_stt_batcher():
+    global stt_batcher
+    stt_batcher = STTBatcher(
+        stt_service, executors,
+        max_batch=config.STT_BATCH_MAX_SIZE,
+        max_wait=config.STT_BATCH_MAX_WAIT_MS / 1000,
+        workers=config.STT_WORKERS,
+    )
+
+
+def load_model_host():
+    # Multi-worker mode (see serve.py): the models live in the shared host,
+    # which warms them itself
+    global model_host, rag_service, stt_service, tts_service, viseme_mapper
+    print(f"🧠 Using model host at {config.MODEL_HOST}")
+    if not config.MODEL_HOST_AUTHKEY:
+        raise RuntimeError("ESTE_MODEL_HOST is set but ESTE_MODEL_HOST_AUTHKEY is not")
+    model_host = ModelHostClient(config.MODEL_HOST, authkey=config.MODEL_HOST_AUTHKEY.encode())
+    model_host.wait_ready(timeout=config.MODEL_HOST_TIMEOUT)
+    rag_service = model_host.rag
+    stt_service = model_host.stt
+    tts_service = model_host.tts
+    viseme_mapper = service_factory.create_viseme_mapper(g2p=model_host.g2p)
+    create_stt_batcher()
+
+
+def load_rag():
+    global rag_service
+    rag_service = service_factory.create_rag_service(metrics=metrics)
+    # Warmup RAG (loads ChromaDB)
+    rag_service.query("warmup")
+
+
+def load_stt():
+    global stt_service
+    stt_service = service_factory.create_stt_service()
+    create_stt_batcher()
+
+
+def load_tts():
+    global tts_service
+    tts_service = service_factory.create_tts_service()
+    # Warmup TTS (already handled in init, but one more check)
+    list(tts_service.synthesize_stream_raw("Hello."))
+
+
+def load_visemes():
+    global viseme_mapper
+    viseme_mapper = service_factory.create_viseme_mapper()
+
+
+def warm_llm():
+    # Loads the model to VRAM and prefills the static system prompt
+    llm_service.warm_prefix(prompt_builder.system_prompt())
+
+
+def build_pipeline():
+    global pipeline
+    pipeline = ResponsePipeline(
+        rag_service, llm_service, tts_service, viseme_mapper, executors,
+        queue_size=config.PIPELINE_QUEUE_SIZE,
+        tts_cache=tts_cache,
+        reuse_answers=config.SEMANTIC_CACHE_ENABLED and config.SEMANTIC_ANSWER_CACHE,
+        prompt_builder=prompt_builder,
+        segmenter_policy=SegmenterPolicy(
+            first_min_chars=config.SEGMENT_FIRST_MIN_CHARS,
+            first_max_chars=config.SEGMENT_FIRST_MAX_CHARS,
+            min_chars=config.SEGMENT_MIN_CHARS,
+            max_chars=config.SEGMENT_MAX_CHARS,
+        ),
+        visemes_from_tts=config.VISEMES_FROM_TTS,
+        metrics=metrics,
+    )
+
+
+def cache_hit_ratios():
+    ratios = {}
+    if tts_cache:
+        ratios["tts"] = tts_cache.stats()["hit_rate"]
+    for name, cache_stats in (rag_service.cache_stats() if rag_service else {}).items():
+        if isinstance(cache_stats, dict):
+            ratios[name.replace("_cache", "")] = cache_stats["hit_rate"]
+    ratios["speculation"] = speculation_stats.stats()["hit_rate"]
+    return ratios
+
+
+# Read only when /metrics is scraped
+metrics.gauge("active_sessions", "Connected WebSocket sessions", lambda: len(sessions))
+metrics.gauge("session_pending_turns", "Turns queued behind the running one, all sessions",
+              lambda: sum(session.inbox.qsize() for session in list(sessions.values())))
+metrics.gauge("pipeline_queue_depth", "Items waiting between pipeline stages",
+              lambda: pipeline.queue_depths() if pipeline else None, labelname="stage")
+metrics.gauge("stt_batch_queue_depth", "Utterances waiting for the next Whisper batch",
+              lambda: stt_batcher.pending.qsize() if stt_batcher and stt_batcher.pending else 0)
+metrics.gauge("executor_busy_workers", "Threads running model work",
+              lambda: {kind: pool["busy"] for kind, pool in executors.stats().items()}, labelname="pool")
+metrics.gauge("executor_queued_jobs", "Model work waiting for a thread",
+              lambda: {kind: pool["queued"] for kind, pool in executors.stats().items()}, labelname="pool")
+metrics.gauge("executor_utilization", "Fraction of each pool's threads that are busy",
+              lambda: {kind: pool["busy"] / pool["workers"] for kind, pool in executors.stats().items()},
+              labelname="pool")
+metrics.gauge("cache_hit_ratio", "Hit rate since startup", cache_hit_ratios, labelname="cache")
+
+
+startup = Startup()
+if config.MODEL_HOST:
+    startup.add("model_host", load_model_host)
+    PIPELINE_NEEDS = ("model_host",)
+    STT_STAGES = ("model_host",)
+else:
+    startup.add("rag", load_rag)
+    startup.add("stt", load_stt)
+    startup.add("tts", load_tts)
+    startup.add("visemes", load_visemes)
+    PIPELINE_NEEDS = ("rag", "tts", "visemes")
+    STT_STAGES = ("stt",)
+# The LLM warmup only saves the first answer some prefill; nothing waits on it
+startup.add("llm", warm_llm)
+startup.add("pipeline", build_pipeline, after=PIPELINE_NEEDS)
+# WebSockets are accepted once these are ready; audio also waits for STT_STAGES
+CHAT_STAGES = ("pipeline",)
+
+
+@app.on_event("startup")
+async def start_services():
+    # Not awaited, so /ready answers while the models load
+    app.state.startup_task = asyncio.create_task(startup.run())
+
+@app.get("/ready")
+async def ready():
+    """
+    Per-stage startup status and timings; 503 until WebSockets are accepted.
+    *_failed means that part will not come up without a restart.
+    """
+    is_ready = startup.ready(*CHAT_STAGES)
+    body = {
+        "ready": is_ready,
+        "failed": startup.failed(*CHAT_STAGES),
+        "stt_ready": startup.ready(*STT_STAGES),
+        "stt_failed": startup.failed(*STT_STAGES),
+        **startup.report(),
+    }
+    return JSONResponse(body, status_code=200 if is_ready else 503)
 
 @app.get("/")
 async def root():
     return {"message": "Este Server Running"}
 
+@app.get("/stats")
+async def stats():
+    rag_stats = {}
+    if rag_service:
+        # An IPC round-trip in model-host mode, so off the event loop
+        try:
+            rag_stats = await executors.run("rag", rag_service.cache_stats)
+        except Exception as e:
+            rag_stats = {"rag_caches_unavailable": f"{type(e).__name__}: {e}"}
+    return {
+        "tts_cache": tts_cache.stats() if tts_cache else None,
+        "stt_batches": stt_batcher.stats() if stt_batcher else None,
+        "llm": llm_service.stats(),
+        "speculation": speculation_stats.stats(),
+        "visemes": viseme_mapper.stats() if viseme_mapper else None,
+        "interrupts": pipeline.interrupt_stats.stats() if pipeline else None,
+        **rag_stats,
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of the latency histograms and gauges."""
+    if not metrics.enabled:
+        return PlainTextResponse("metrics disabled (ESTE_METRICS_ENABLED=0)\n", status_code=404)
+    # Gauges may call the model host (RAG cache stats), so render off the event loop
+    text = await asyncio.to_thread(metrics.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/rag/reload")
+async def reload_knowledge_base():
+    """Re-syncs the knowledge base with the data file, embedding only changed chunks."""
+    if not rag_service or not rag_service.vector_store:
+        return {"status": "error", "message": "Knowledge base not initialized."}
+    result = await executors.run("rag", rag_service.sync)
+    return {"status": "ok", **result}
+
+@app.on_event("shutdown")
+async def shutdown_services():
+    if stt_batcher:
+        await stt_batcher.close()
+    await llm_service.aclose()
+    executors.shutdown()
+    if rag_service:
+        rag_service.stop_watching()
+    if tts_cache:
+        tts_cache.close()
+    if model_host:
+        model_host.close()
+
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
+    if not startup.ready(*CHAT_STAGES):
+        # Still starting up: "try again later"; the kiosk client reconnects.
+        # A failed stage won't recover, so that is reported as a server error.
+        await websocket.close(code=1011 if startup.failed(*CHAT_STAGES) else 1013)
+        return
     await websocket.accept()
-    print("Client connected to WS")
-    
-    async def process_text(text: str):
-        # 3. RAG: Retrieve Context
-        t1 = time.time()
-        context = rag_service.query(text)
-        print(f"[TIMING] RAG (Retrieval): {time.time() - t1:.2f}s")
-
-        # 4. LLM Streaming & Sentence Processing
-        system_prompt = f"""You are Este, the friendly AI student companion for USTP. 
-        Speak naturally and casually. Keep answers SHORT (max 1-3 sentences).
-        Context: {context}"""
-        
-        print(f"[TIMING] Starting LLM & TTS Pipeline...")
-        
-        # Signal start of response
-        await websocket.send_json({
-            "type": "audio_start",
-            "text": "...", # Text will be updated as we get it
-            "sampleRate": tts_service.sample_rate
-        })
-
-        full_response = ""
-        current_sentence = ""
-        t_llm_start = time.time()
-        
-        # Iterate through LLM stream
-        for token in llm_service.stream_generate(text, system_prompt=system_prompt):
-            full_response += token
-            current_sentence += token
-            
-            # If we hit a sentence boundary, synthesize right away
-            if any(punct in token for punct in [".", "!", "?", "\n"]):
-                sentence_to_play = current_sentence.strip()
-                if len(sentence_to_play) > 3:
-                    # Send visemes and audio
-                    visemes = viseme_mapper.map_text_to_visemes(sentence_to_play)
-                    await websocket.send_json({"type": "viseme_data", "visemes": visemes})
-                    for chunk in tts_service.synthesize_stream_raw(sentence_to_play):
-                        await websocket.send_json({
-                            "type": "audio_chunk",
-                            "audio": base64.b64encode(chunk).decode('utf-8')
-                        })
-                    current_sentence = ""
-        
-        # Final cleanup
-        if current_sentence.strip():
-            visemes = viseme_mapper.map_text_to_visemes(current_sentence)
-            await websocket.send_json({"type": "viseme_data", "visemes": visemes})
-            for chunk in tts_service.synthesize_stream_raw(current_sentence):
-                await websocket.send_json({
-                    "type": "audio_chunk",
-                    "audio": base64.b64encode(chunk).decode('utf-8')
-                })
-        
-        # Update UI & End
-        await websocket.send_json({"type": "audio_response", "text": full_response})
-        await websocket.send_json({"type": "audio_end"})
-        print(f"[TIMING] Total Response Cycle: {time.time() - t_llm_start:.2f}s")
+    channel = ClientChannel(websocket)
+    session = SessionScheduler(max_pending=config.SESSION_MAX_PENDING_TURNS)
+    session.start()
+    sessions[session.session_id] = session
+    conversation = Conversation(max_turns=config.LLM_HISTORY_TURNS, max_chars=config.LLM_HISTORY_CHARS)
+    print(f"Client connected to WS (session {session.session_id})")
+
+    async def transcribe(audio):
+        t0 = time.perf_counter()
+        transcript = await stt_batcher.transcribe(audio)
+        metrics.stt_seconds.observe(
+            time.perf_counter() - t0,
+            session=metrics.session_label(session.session_id), backend=stt_service.backend,
+        )
+        return transcript
+
+    async def send_error(code, message):
+        print(f"⚠️ {message}")
+        await channel.send_json({"type": "error", "code": code, "message": message})
+
+    async def wait_for_stt():
+        """Waits for speech recognition to load; sends an error event and returns False if it failed."""
+        try:
+            await startup.wait(*STT_STAGES)
+            return True
+        except RuntimeError as e:
+            await send_error("stt_unavailable", f"Speech recognition is unavailable: {e}")
+            return False
+
+    async def handle_audio(audio_bytes, received):
+        if not await wait_for_stt():
+            return
+        # 2. STT: Transcribe
+        t0 = time.time()
+        try:
+            if channel.input_format in RAW_INPUT_FORMATS:
+                # Raw PCM is only viewed as samples, cheap enough to do inline
+                audio = stt_service.load_audio(audio_bytes, channel.input_format, channel.input_sample_rate)
+            else:
+                audio = await executors.run("stt", stt_service.load_audio, audio_bytes)
+        except Exception as e:
+            await send_error("bad_audio", f"Could not decode audio: {e}")
+            return
+        # Too short to hold a question: still tell the client the turn is over
+        transcript = await transcribe(audio) if audio is not None else ""
+        print(f"[TIMING] STT (Transcribe): {time.time() - t0:.2f}s")
+        print(f"User (Audio): {transcript}")
+        await channel.send_json({"type": "final_transcript", "text": transcript or ""})
+
+        if transcript and len(transcript.strip()) >= 2:
+            await pipeline.run(channel, transcript, conversation, session=session.session_id, started=received)
+
+    speculator = None
+    if config.SPECULATION_ENABLED:
+        speculator = Speculator(
+            rag_service, llm_service, executors, prompt_builder, speculation_stats,
+            threshold=config.SPECULATION_THRESHOLD,
+            prefill=config.SPECULATIVE_PREFILL,
+        )
+
+    def on_partial(transcript):
+        if speculator:
+            speculator.on_partial(transcript, conversation)
+
+    async def answer_transcript(transcript, received):
+        context = await speculator.take(transcript) if speculator else None
+        await pipeline.run(channel, transcript, conversation, context, session=session.session_id, started=received)
+
+    async def submit_transcript(transcript):
+        print(f"User (Stream): {transcript}")
+        await session.submit(partial(answer_transcript, transcript, time.perf_counter()))
+
+    async def barge_in(reason):
+        # Stop the answer in flight (and any queued ones) and tell the client
+        # to drop the audio it has buffered
+        interrupted = await session.interrupt()
+        if interrupted:
+            print(f"✋ Barge-in ({reason}): cancelled {interrupted} turn(s)")
+        await channel.send_json({"type": "flush", "reason": reason, "interrupted": interrupted})
+
+    recognizer = None
+    # Set after an stt_start that was refused; its PCM frames are dropped until stt_stop
+    stream_refused = False
+    # Final passes of stopped recognizers
+    final_tasks = []
 
     try:
         while True:
             # Handle both bytes (audio) and text (json)
             message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
             
-            if "bytes" in message:
+            if message.get("bytes") is not None:
                 audio_bytes = message["bytes"]
+                if recognizer:
+                    # Streaming mode: raw PCM16 frames while the user speaks.
+                    # Frames still in flight after the utterance ended are dropped.
+                    await recognizer.feed(audio_bytes)
+                    continue
+                if stream_refused:
+                    continue
                 print(f"\n[TIMING] Audio received: {len(audio_bytes)} bytes")
-                
-                # 2. STT: Transcribe
-                t0 = time.time()
-                transcript = stt_service.transcribe(audio_bytes)
-                print(f"[TIMING] STT (Transcribe): {time.time() - t0:.2f}s")
-                print(f"User (Audio): {transcript}")
-                
-                if transcript and len(transcript.strip()) >= 2:
-                    await process_text(transcript)
+                await barge_in("audio")
+                await session.submit(partial(handle_audio, audio_bytes, time.perf_counter()))
                     
-            elif "text" in message:
+            elif message.get("text") is not None:
                 data = json.loads(message["text"])
-                if data.get("type") == "text_query":
+                if data.get("type") == "hello":
+                    await channel.send_json(channel.negotiate(data))
+                    for error in channel.errors:
+                        await send_error("bad_hello", error)
+                elif data.get("type") == "stt_start":
+                    await barge_in("audio")
+                    if recognizer:
+                        recognizer.cancel()
+                        recognizer = None
+                    stream_refused = not await wait_for_stt()
+                    if stream_refused:
+                        continue
+                    stream_format = data.get("format", "pcm16")
+                    sample_rate, error = parse_sample_rate(data.get("sample_rate"), channel.input_sample_rate)
+                    if error:
+                        await send_error("bad_sample_rate", error)
+                    recognizer = StreamingRecognizer(
+                        transcribe, channel.send_json, submit_transcript,
+                        sample_rate=sample_rate,
+                        audio_format=stream_format if stream_format in RAW_INPUT_FORMATS else "pcm16",
+                        partial_interval=config.STT_STREAM_PARTIAL_INTERVAL,
+                        silence_ms=config.STT_STREAM_SILENCE_MS,
+                        max_seconds=config.STT_STREAM_MAX_SECONDS,
+                        on_partial=on_partial,
+                    )
+                elif data.get("type") == "stt_stop":
+                    stream_refused = False
+                    if recognizer:
+                        # The final pass runs as a task; later uploads are blobs again
+                        final_tasks = [task for task in final_tasks if not task.done()]
+                        final_tasks.append(recognizer.finish_soon())
+                        recognizer = None
+                elif data.get("type") == "cancel":
+                    await barge_in("cancel")
+                elif data.get("type") == "text_query":
                     query = data.get("text")
                     print(f"User (Text): {query}")
-                    await process_text(query)
+                    await barge_in("text_query")
+                    await session.submit(partial(
+                        pipeline.run, channel, query, conversation,
+                        session=session.session_id, started=time.perf_counter(),
+                    ))
 
     except Exception as e:
         print(f"Connection closed/Error: {e}")
         traceback.print_exc()
+    finally:
+        if recognizer:
+            recognizer.cancel()
+        for task in final_tasks:
+            task.cancel()
+        if speculator:
+            speculator.cancel()
+        await session.close()
+        sessions.pop(session.session_id, None)
+        metrics.forget_session(session.session_id)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
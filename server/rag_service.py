@@ -1,75 +1,260 @@
-from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-try:
-    from langchain_ollama import OllamaEmbeddings
-except ImportError:
-    from langchain_community.embeddings import OllamaEmbeddings
+import hashlib
+import threading
+import time
 import traceback
 import os
+from services.vector_index import ChromaIndex, NumpyVectorIndex
+from services.lexical_index import BM25Index, fuse_rankings
+from services.metrics import Metrics
+
+EMBEDDING_MODEL = "qwen2.5:1.5b"
+# Candidates taken from each ranking before hybrid fusion
+HYBRID_CANDIDATES = 10
 
 class RAGService:
-    def __init__(self, data_path: str = None):
+    def __init__(self, data_path: str = None, persist_directory: str = None,
+                 embedding_cache=None, semantic_cache=None,
+                 backend: str = "chroma", index_dtype: str = "float32",
+                 hybrid: bool = True, vector_weight: float = 1.0, lexical_weight: float = 1.0,
+                 lexical_fast_path: bool = True, fast_path_min_score: float = 3.0,
+                 fast_path_dominance: float = 2.0, metrics=None, ollama_host: str = None):
+        """
+        backend selects the retrieval index: "chroma" (default) or "numpy"
+        (see services.vector_index; index_dtype sets its row precision).
+        With hybrid, a BM25 index (services.lexical_index) is built next to it
+        and the two rankings are fused with the given weights. The lexical fast
+        path answers without embedding the question when the best BM25 match
+        scores at least fast_path_min_score and fast_path_dominance times the
+        runner-up.
+        embedding_cache (services.query_cache.EmbeddingCache) and semantic_cache
+        (services.query_cache.SemanticCache) are optional layers in front of query().
+        metrics (services.metrics.Metrics) records embedding latency.
+        ollama_host overrides the Ollama server used for embeddings.
+        """
+        base_dir = os.path.dirname(os.path.abspath(__file__))
         if data_path is None:
             # Default to ustp_data.txt in the same directory as this file
-            base_dir = os.path.dirname(os.path.abspath(__file__))
             self.data_path = os.path.join(base_dir, "ustp_data.txt")
         else:
             self.data_path = data_path
+        if backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown RAG backend {backend!r}")
+        self.backend = backend
+        self.index_dtype = index_dtype
+        default_directory = "chroma_db" if backend == "chroma" else "numpy_index"
+        self.persist_directory = persist_directory or os.path.join(base_dir, default_directory)
             
+        # Imported here: LangChain takes seconds to import (see test_import_time.py)
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        try:
+            from langchain_ollama import OllamaEmbeddings
+        except ImportError:
+            from langchain_community.embeddings import OllamaEmbeddings
+
         self.vector_store = None
-        self.embeddings = OllamaEmbeddings(model="qwen2.5:1.5b") # Using local Ollama model for embeddings
+        embedding_options = {"base_url": ollama_host} if ollama_host else {}
+        self.embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, **embedding_options) # Using local Ollama model for embeddings
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=500, 
+            chunk_overlap=100,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+        self.hybrid = hybrid
+        self.vector_weight = vector_weight
+        self.lexical_weight = lexical_weight
+        self.lexical_fast_path = lexical_fast_path
+        self.fast_path_min_score = fast_path_min_score
+        self.fast_path_dominance = fast_path_dominance
+        self.lexical_index = None
+        self.lexical_fast_path_hits = 0
+        self.embedding_cache = embedding_cache
+        self.semantic_cache = semantic_cache
+        self._sync_lock = threading.Lock()
+        self._data_mtime = None
+        self._watcher = None
+        self.metrics = metrics or Metrics(enabled=False)
 
     def initialize(self):
-        """Ingests data and builds the vector store."""
+        """Opens the persisted vector store and embeds only new or changed chunks."""
         try:
             if not os.path.exists(self.data_path):
                 print(f"Error: Data file {self.data_path} not found.")
                 return
 
-            loader = TextLoader(self.data_path)
-            documents = loader.load()
-            
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=500, 
-                chunk_overlap=100,
-                separators=["\n\n", "\n", ". ", " ", ""]
-            )
-            docs = text_splitter.split_documents(documents)
-            
-            # Persist directory for Chroma
-            persist_directory = "./chroma_db"
-            
-            # Clear existing Chroma DB to ensure fresh ingestion of expanded data
-            if os.path.exists(persist_directory):
-                import shutil
-                shutil.rmtree(persist_directory)
-                
-            print("    RAG: Ingesting documents...")
-            self.vector_store = Chroma.from_documents(
-                documents=docs, 
-                embedding=self.embeddings,
-                persist_directory=persist_directory
-            )
-            print("    RAG: Vector store created.")
+            if self.backend == "numpy":
+                self.vector_store = NumpyVectorIndex(self.persist_directory, self.embeddings, dtype=self.index_dtype)
+            else:
+                self.vector_store = ChromaIndex(self.persist_directory, self.embeddings)
+            if self.hybrid:
+                os.makedirs(self.persist_directory, exist_ok=True)
+                self.lexical_index = BM25Index(os.path.join(self.persist_directory, "lexical_index.json"))
+            self.sync()
             print("RAG Service Initialized & Data Ingested")
             
         except Exception as e:
             print(f"Failed to initialize RAG Service: {e}")
             traceback.print_exc()
 
+    def sync(self):
+        """
+        Brings the vector store in line with the data file. Chunks are keyed by
+        a hash of their content and the embedding model, so unchanged chunks
+        are reused, edited or new ones are embedded and removed ones deleted.
+        Returns {"added": n, "removed": n, "unchanged": n}.
+        """
+        with self._sync_lock:
+            self._data_mtime = os.path.getmtime(self.data_path)
+            chunks = self._load_chunks()
+
+            existing_ids = self.vector_store.ids()
+            new_ids = [chunk_id for chunk_id in chunks if chunk_id not in existing_ids]
+            stale_ids = [chunk_id for chunk_id in existing_ids if chunk_id not in chunks]
+
+            if stale_ids:
+                self.vector_store.delete(stale_ids)
+            if new_ids:
+                print(f"    RAG: Embedding {len(new_ids)} new/changed chunks...")
+                self.vector_store.add(
+                    new_ids,
+                    [chunks[chunk_id].page_content for chunk_id in new_ids],
+                    [chunks[chunk_id].metadata for chunk_id in new_ids]
+                )
+
+            if self.lexical_index is not None and self.lexical_index.ids() != set(chunks):
+                self.lexical_index.build({chunk_id: doc.page_content for chunk_id, doc in chunks.items()})
+
+            if (new_ids or stale_ids) and self.semantic_cache:
+                # Cached contexts and answers may quote outdated chunks
+                self.semantic_cache.clear()
+
+            result = {
+                "added": len(new_ids),
+                "removed": len(stale_ids),
+                "unchanged": len(chunks) - len(new_ids),
+            }
+            print(f"    RAG: Vector store synced ({result['added']} added, "
+                  f"{result['removed']} removed, {result['unchanged']} reused).")
+            return result
+
+    def _load_chunks(self):
+        """Splits the data file into chunks keyed by content hash."""
+        from langchain_community.document_loaders import TextLoader
+
+        documents = TextLoader(self.data_path).load()
+        chunks = {}
+        for doc in self.text_splitter.split_documents(documents):
+            digest = hashlib.sha256(
+                f"{EMBEDDING_MODEL}\0{doc.metadata.get('source', '')}\0{doc.page_content}".encode("utf-8")
+            ).hexdigest()
+            chunks[digest] = doc
+        return chunks
+
+    def reload_if_changed(self):
+        """Re-syncs if the data file was modified since the last sync. Returns the sync result or None."""
+        if not self.vector_store or not os.path.exists(self.data_path):
+            return None
+        if os.path.getmtime(self.data_path) == self._data_mtime:
+            return None
+        print("    RAG: Data file changed, reloading...")
+        return self.sync()
+
+    def start_watching(self, interval: float = 5.0):
+        """Polls the data file in a background thread and hot-reloads edits."""
+        if self._watcher:
+            return
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"RAG reload failed: {e}")
+
+        self._watcher = (threading.Thread(target=watch, name="rag-watcher", daemon=True), stop)
+        self._watcher[0].start()
+
+    def stop_watching(self):
+        if self._watcher:
+            self._watcher[1].set()
+            self._watcher = None
+
+    def embed_query(self, question: str):
+        """Embeds a question, reusing the embedding of an identical earlier question."""
+        if self.embedding_cache:
+            embedding = self.embedding_cache.get(question)
+            if embedding is not None:
+                return embedding
+        t0 = time.perf_counter()
+        embedding = self.embeddings.embed_query(question)
+        self.metrics.embedding_seconds.observe(time.perf_counter() - t0, backend=EMBEDDING_MODEL)
+        if self.embedding_cache:
+            self.embedding_cache.put(question, embedding)
+        return embedding
+
     def query(self, question: str, k: int = 3):
         """Retrieves relevant documents for a query."""
         if not self.vector_store:
             return "Knowledge base not initialized."
             
         try:
-            results = self.vector_store.similarity_search(question, k=k)
-            return "\n".join([doc.page_content for doc in results])
+            lexical = []
+            if self.lexical_index is not None:
+                matches = self.lexical_index.search(question, HYBRID_CANDIDATES)
+                if self.lexical_fast_path and self._is_decisive(matches):
+                    # Exact tokens settle it: skip the embedding call entirely
+                    self.lexical_fast_path_hits += 1
+                    return "\n".join(text for text, _ in matches[:k])
+                lexical = [text for text, _ in matches]
+
+            embedding = self.embed_query(question)
+            if self.semantic_cache:
+                hit = self.semantic_cache.lookup(embedding)
+                if hit:
+                    return hit["context"]
+
+            if self.lexical_index is not None:
+                vector = self.vector_store.search(embedding, HYBRID_CANDIDATES)
+                texts = fuse_rankings([vector, lexical], [self.vector_weight, self.lexical_weight], k)
+            else:
+                texts = self.vector_store.search(embedding, k)
+            context = "\n".join(texts)
+            if self.semantic_cache:
+                self.semantic_cache.put(embedding, question, context)
+            return context
         except Exception as e:
             print(f"Error querying RAG: {e}")
             return "Error retrieving information."
 
+    def _is_decisive(self, matches):
+        """True when the best BM25 match clearly beats the rest."""
+        if not matches or matches[0][1] < self.fast_path_min_score:
+            return False
+        runner_up = matches[1][1] if len(matches) > 1 else 0.0
+        return matches[0][1] >= self.fast_path_dominance * runner_up
+
+    def lookup_answer(self, question: str):
+        """Returns a cached LLM answer to the same question, or None."""
+        if not self.semantic_cache or not self.vector_store:
+            return None
+        try:
+            return self.semantic_cache.lookup_answer(question)
+        except Exception as e:
+            print(f"Error looking up cached answer: {e}")
+            return None
+
+    def store_answer(self, question: str, answer: str):
+        """Remembers the LLM answer for the question's semantic cache entry."""
+        if self.semantic_cache and answer.strip():
+            self.semantic_cache.set_answer(question, answer)
+
+    def cache_stats(self):
+        return {
+            "embedding_cache": self.embedding_cache.stats() if self.embedding_cache else None,
+            "semantic_cache": self.semantic_cache.stats() if self.semantic_cache else None,
+            "lexical_fast_path_hits": self.lexical_fast_path_hits,
+        }
+
 if __name__ == "__main__":
     # Simple test
     rag = RAGService()
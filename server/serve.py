@@ -0,0 +1,93 @@
+"""
+Multi-worker launcher.
+Starts one model-host process that loads Whisper, Kokoro, the G2P fallback
+and the knowledge base once, then runs several uvicorn workers that serve
+the WebSockets and share it (see services/model_host.py).
+
+    python serve.py --workers 4
+    python serve.py --host-only    # just the model host, e.g. under its own supervisor
+
+Workers reach the host at ESTE_MODEL_HOST_ADDRESS. If ESTE_MODEL_HOST is
+already set, that host is used and none is started.
+
+The host and workers authenticate with ESTE_MODEL_HOST_AUTHKEY. When it isn't
+set, a random key is generated for this run and handed to the host and the
+workers through the environment. --host-only and an external ESTE_MODEL_HOST
+need it set explicitly, since the other side has to know it too.
+"""
+import argparse
+import multiprocessing
+import os
+import secrets
+import sys
+
+import uvicorn
+
+import config
+
+
+def run_model_host(address, authkey):
+    import service_factory
+    from services.model_host import ModelHost
+
+    print("🧠 Loading models for the model host...")
+    rag_service = service_factory.create_rag_service()
+    stt_service = service_factory.create_stt_service()
+    tts_service = service_factory.create_tts_service()
+    viseme_mapper = service_factory.create_viseme_mapper()
+    rag_service.query("warmup")
+    list(tts_service.synthesize_stream_raw("Hello."))
+
+    host = ModelHost(
+        address, authkey.encode(),
+        rag_service=rag_service,
+        stt_service=stt_service,
+        tts_service=tts_service,
+        viseme_mapper=viseme_mapper,
+        stt_workers=config.STT_WORKERS,
+        tts_workers=config.TTS_WORKERS,
+    )
+    host.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max(config.WORKERS, 2), help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--host-only", action="store_true", help="run only the model host")
+    args = parser.parse_args()
+
+    address = config.MODEL_HOST or config.MODEL_HOST_ADDRESS
+    authkey = config.MODEL_HOST_AUTHKEY
+    if not authkey:
+        if args.host_only or config.MODEL_HOST:
+            sys.exit("❌ Set ESTE_MODEL_HOST_AUTHKEY to the key shared by the model host and the workers")
+        authkey = secrets.token_hex(32)
+    if args.host_only:
+        run_model_host(address, authkey)
+        return
+
+    from services.model_host import ModelHostClient
+
+    host_process = None
+    if not config.MODEL_HOST:
+        host_process = multiprocessing.Process(target=run_model_host, args=(address, authkey), name="este-model-host")
+        host_process.start()
+    try:
+        client = ModelHostClient(address, authkey=authkey.encode())
+        client.wait_ready(timeout=config.MODEL_HOST_TIMEOUT)
+        client.close()
+        print(f"✅ Model host ready at {address}, starting {args.workers} workers")
+
+        # Read by config.py in every worker
+        os.environ["ESTE_MODEL_HOST"] = address
+        os.environ["ESTE_MODEL_HOST_AUTHKEY"] = authkey
+        uvicorn.run("main:app", host="0.0.0.0", port=args.port, workers=args.workers)
+    finally:
+        if host_process:
+            host_process.terminate()
+            host_process.join()
+
+
+if __name__ == "__main__":
+    main()
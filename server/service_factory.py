@@ -0,0 +1,59 @@
+"""
+Builds the model-backed services from config.
+Used by main.py when the models run in-process, and by serve.py for the
+shared model-host process.
+Each backend is imported inside its factory, so a worker that talks to a
+model host never imports them.
+"""
+import config
+
+
+def create_rag_service(metrics=None):
+    from rag_service import RAGService
+    from services.query_cache import EmbeddingCache, SemanticCache
+
+    rag_service = RAGService(
+        backend=config.RAG_BACKEND,
+        persist_directory=config.RAG_INDEX_DIR or None,
+        ollama_host=config.OLLAMA_HOST,
+        index_dtype=config.RAG_INDEX_DTYPE,
+        hybrid=config.RAG_HYBRID,
+        vector_weight=config.RAG_VECTOR_WEIGHT,
+        lexical_weight=config.RAG_LEXICAL_WEIGHT,
+        lexical_fast_path=config.RAG_LEXICAL_FAST_PATH,
+        fast_path_min_score=config.RAG_FAST_PATH_MIN_SCORE,
+        fast_path_dominance=config.RAG_FAST_PATH_DOMINANCE,
+        embedding_cache=EmbeddingCache(
+            max_entries=config.QUERY_EMBEDDING_CACHE_SIZE,
+            ttl=config.QUERY_EMBEDDING_CACHE_TTL,
+        ),
+        semantic_cache=SemanticCache(
+            threshold=config.SEMANTIC_CACHE_THRESHOLD,
+            max_entries=config.SEMANTIC_CACHE_SIZE,
+            ttl=config.SEMANTIC_CACHE_TTL,
+        ) if config.SEMANTIC_CACHE_ENABLED else None,
+        metrics=metrics,
+    )
+    rag_service.initialize()
+    if config.RAG_WATCH_INTERVAL > 0:
+        rag_service.start_watching(config.RAG_WATCH_INTERVAL)
+    return rag_service
+
+
+def create_stt_service():
+    from services.stt import STTService
+    return STTService(model_size="tiny")
+
+
+def create_tts_service():
+    from services.kokoro_tts import KokoroTTS
+    return KokoroTTS()
+
+
+def create_viseme_mapper(g2p=None):
+    from services.viseme_mapper import VisemeMapper
+    return VisemeMapper(
+        lexicon_path=config.VISEME_LEXICON_PATH,
+        cache_size=config.VISEME_WORD_CACHE_SIZE,
+        g2p=g2p,
+    )
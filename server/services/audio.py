@@ -0,0 +1,68 @@
+"""
+Small PCM / WAV helpers shared by the TTS and STT paths.
+"""
+import struct
+
+import numpy as np
+
+# Size field value for WAV streams whose length is not known up front
+STREAMING_SIZE = 0xFFFFFFFF
+
+# Whisper's input rate
+STT_SAMPLE_RATE = 16000
+# Headerless input formats a client can negotiate for uploads and streaming
+RAW_INPUT_FORMATS = {"pcm16": "<i2", "float32": "<f4"}
+
+
+def float_to_pcm16(samples):
+    """Converts float samples in [-1, 1] to little-endian int16 PCM bytes."""
+    samples = np.asarray(samples, dtype=np.float32)
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def wav_header(sample_rate, data_size=None, channels=1, sample_width=2):
+    """
+    44-byte PCM WAV header. Without data_size the RIFF and data sizes are set
+    to 0xFFFFFFFF, which players treat as "read until the stream ends".
+    """
+    if data_size is None:
+        riff_size = data_size = STREAMING_SIZE
+    else:
+        riff_size = 36 + data_size
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+        b"data", data_size,
+    )
+
+
+def pcm16_to_wav(pcm, sample_rate):
+    """Wraps int16 PCM bytes in a complete WAV file."""
+    return b"".join((wav_header(sample_rate, len(pcm)), pcm))
+
+
+def pcm_to_float(data, audio_format="pcm16"):
+    """
+    Views raw little-endian mono PCM (bytes, bytearray or memoryview) as
+    float32 samples in [-1, 1]. float32 input is returned as a read-only view
+    of the buffer itself; int16 is widened in a single pass.
+    """
+    dtype = np.dtype(RAW_INPUT_FORMATS[audio_format])
+    view = memoryview(data).cast("B")
+    # A torn trailing sample would make frombuffer raise
+    view = view[:len(view) - len(view) % dtype.itemsize]
+    samples = np.frombuffer(view, dtype=dtype)
+    if audio_format == "float32":
+        return samples
+    return np.multiply(samples, 1.0 / 32768.0, dtype=np.float32)
+
+
+def resample(samples, source_rate, target_rate=STT_SAMPLE_RATE):
+    """Linear-interpolation resampler, enough for speech recognition input."""
+    if source_rate == target_rate or not len(samples):
+        return samples
+    duration = len(samples) / source_rate
+    target = np.linspace(0, duration, int(duration * target_rate), endpoint=False)
+    return np.interp(target, np.arange(len(samples)) / source_rate, samples).astype(np.float32)
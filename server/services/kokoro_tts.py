@@ -1,11 +1,17 @@
 
 import os
-import soundfile as sf
-import numpy as np
-from kokoro_onnx import Kokoro
-from huggingface_hub import hf_hub_download
+import re
+from services.audio import float_to_pcm16, pcm16_to_wav
+
+# Kokoro rejects inputs longer than this many phonemes
+MAX_PHONEME_LENGTH = 510
+# Clauses shorter than this are merged with the next one
+MIN_CLAUSE_CHARS = 24
+CLAUSE_BOUNDARY = re.compile(r"(?<=[,;:—])\s+|(?<=\s-)\s+")
 
 class KokoroTTS:
+    backend = "kokoro"
+
     def __init__(self, model_name="kokoro-v0_19.onnx", voices_file="voices.bin"):
         """
         Initialize Kokoro TTS with ONNX model.
@@ -15,12 +21,17 @@ class KokoroTTS:
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.model_path = os.path.join(self.base_dir, model_name)
         self.voices_path = os.path.join(self.base_dir, voices_file)
+        self.voice = "af_sarah"
+        self.speed = 1.0
         
         # Auto-download models if missing
         self._ensure_models()
+        # Identifies the model/voices pair in cache keys (see services.tts_cache)
+        self.model_version = f"{model_name}:{self._file_size(self.model_path)}:{voices_file}:{self._file_size(self.voices_path)}"
         
         print("🗣️ Loading Kokoro TTS (ONNX)...")
         try:
+            from kokoro_onnx import Kokoro
             self.kokoro = Kokoro(self.model_path, self.voices_path)
             # Warmup
             print("   Warming up Kokoro...")
@@ -30,11 +41,16 @@ class KokoroTTS:
             print(f"❌ Failed to load Kokoro: {e}")
             self.kokoro = None
 
+    @staticmethod
+    def _file_size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
     def _ensure_models(self):
         """Download model files from HuggingFace if they don't exist."""
         if not os.path.exists(self.model_path) or not os.path.exists(self.voices_path):
             print("⬇️ Downloading Kokoro models from HuggingFace...")
             try:
+                from huggingface_hub import hf_hub_download
                 # Download ONNX model (try hexgrad first, fallback if needed or keep thewh1teagle if tested)
                 # We stick with hexgrad for model if possible, or correct filename. 
                 # Step 429 said hexgrad has kokoro-v0_19.onnx.
@@ -69,27 +85,105 @@ class KokoroTTS:
             except Exception as e:
                 print(f"❌ Error downloading models: {e}")
 
-    def synthesize_stream_raw(self, text, voice="af_sarah", speed=1.0):
+    def synthesize_stream_raw(self, text, voice="af_sarah", speed=1.0, stream=False):
         """
-        Synthesize text to WAV audio bytes.
-        Yields the entire sentence audio as a single WAV file (byte stream).
+        Synthesize text to audio bytes.
+        By default yields the entire sentence audio as a single WAV file.
+        With stream=True yields raw int16 PCM (no header) clause by clause, as
+        soon as each piece is rendered; pair it with services.audio.wav_header()
+        sent once per response.
         """
         if not self.kokoro:
             print("❌ Kokoro not initialized")
             return
 
         try:
-            import io
-            # Kokoro.create returns (audio_samples, phonemes)
-            audio, _ = self.kokoro.create(text, voice=voice, speed=speed, lang="en-us")
-            
-            # Write to in-memory WAV file
-            buffer = io.BytesIO()
-            sf.write(buffer, audio, self.sample_rate, format='WAV')
-            wav_bytes = buffer.getvalue()
+            if stream:
+                for audio, _, _ in self._render_pieces(text, voice, speed):
+                    yield float_to_pcm16(audio)
+                return
+
+            pcm = b"".join(float_to_pcm16(audio) for audio, _, _ in self._render_pieces(text, voice, speed))
             
             # Yield the whole WAV file as one chunk (since we stream sentence-by-sentence)
-            yield wav_bytes
+            yield pcm16_to_wav(pcm, self.sample_rate)
                 
         except Exception as e:
             print(f"❌ TTS Synthesis Error: {e}")
+
+    def synthesize_pieces(self, text, voice="af_sarah", speed=1.0):
+        """
+        Like synthesize_stream_raw(stream=True), but yields (pcm, clause, phonemes)
+        so the phonemes Kokoro rendered can drive the viseme track. phonemes is
+        None on kokoro-onnx versions without tokenizer access.
+        """
+        if not self.kokoro:
+            print("❌ Kokoro not initialized")
+            return
+
+        try:
+            for audio, clause, phonemes in self._render_pieces(text, voice, speed):
+                yield float_to_pcm16(audio), clause, phonemes
+        except Exception as e:
+            print(f"❌ TTS Synthesis Error: {e}")
+
+    def _render_pieces(self, text, voice, speed):
+        """
+        Renders a sentence clause by clause, yielding (audio, clause, phonemes).
+        Clauses longer than Kokoro's phoneme limit are split further into
+        phoneme batches.
+        """
+        tokenizer = getattr(self.kokoro, "tokenizer", None)
+        for clause in split_clauses(text):
+            if tokenizer is None:
+                # Older kokoro-onnx: no phoneme access, let it handle the clause.
+                # Kokoro.create returns (audio_samples, sample_rate)
+                audio, _ = self.kokoro.create(clause, voice=voice, speed=speed, lang="en-us")
+                yield audio, clause, None
+                continue
+
+            phonemes = tokenizer.phonemize(clause, "en-us")
+            for batch in split_phonemes(phonemes):
+                audio, _ = self.kokoro.create(batch, voice=voice, speed=speed, lang="en-us", is_phonemes=True)
+                yield audio, clause, batch
+
+
+def split_clauses(text, min_chars=MIN_CLAUSE_CHARS):
+    """
+    Splits a sentence at clause punctuation (, ; : and dashes). Clauses shorter
+    than min_chars are merged into the next one so Kokoro isn't asked for
+    fragments too short to sound natural.
+    """
+    clauses = []
+    pending = ""
+    for part in CLAUSE_BOUNDARY.split(text.strip()):
+        pending = f"{pending} {part}".strip() if pending else part.strip()
+        if len(pending) >= min_chars:
+            clauses.append(pending)
+            pending = ""
+    if pending:
+        if clauses and len(pending) < min_chars:
+            clauses[-1] = f"{clauses[-1]} {pending}"
+        else:
+            clauses.append(pending)
+    return clauses
+
+
+def split_phonemes(phonemes, limit=MAX_PHONEME_LENGTH):
+    """Splits a phoneme string at word boundaries into batches under limit."""
+    if len(phonemes) <= limit:
+        return [phonemes]
+
+    batches = []
+    current = ""
+    for word in phonemes.split(" "):
+        candidate = f"{current} {word}" if current else word
+        if len(candidate) > limit and current:
+            batches.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        batches.append(current)
+    # A single "word" over the limit (no spaces) still has to be cut
+    return [batch[i:i + limit] for batch in batches for i in range(0, len(batch), limit)]
@@ -0,0 +1,130 @@
+"""
+BM25 inverted index for exact-token retrieval.
+Kiosk questions are full of room numbers, building codes and office names
+that embeddings match poorly. The index is built at ingest time next to the
+vector store and persisted as JSON, keyed by the same content-hash chunk ids.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "the their there to was what when where which who why will with you your".split()
+)
+
+# Bump when tokenization changes so persisted indexes are rebuilt
+INDEX_VERSION = 1
+# Reciprocal-rank fusion constant (dampens the weight of top ranks)
+RRF_K = 60
+
+# Light suffix stripping so "enroll" matches "enrollment" and "hours" matches "hour"
+SUFFIXES = ("ments", "ment", "ings", "ing", "ed", "es", "s")
+
+
+def _stem(token):
+    for suffix in SUFFIXES:
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    return [_stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.chunk_ids = []
+        self.texts = []
+        self.doc_lengths = []
+        self.postings = {}  # term -> [[row, term frequency], ...]
+        self.idf = {}
+        self.avg_length = 0.0
+        self._load()
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def ids(self):
+        return set(self.chunk_ids)
+
+    def build(self, chunks):
+        """Rebuilds the index from {chunk_id: text} and saves it."""
+        chunk_ids = sorted(chunks)
+        texts = [chunks[chunk_id] for chunk_id in chunk_ids]
+        postings = defaultdict(list)
+        doc_lengths = []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append([row, tf])
+
+        self.chunk_ids, self.texts, self.doc_lengths = chunk_ids, texts, doc_lengths
+        self.postings = dict(postings)
+        self._prepare()
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INDEX_VERSION, "k1": self.k1, "b": self.b, "ids": chunk_ids, "texts": texts,
+                "doc_lengths": doc_lengths, "postings": self.postings,
+            }, f)
+        os.replace(tmp, self.path)
+
+    def search(self, query, k):
+        """Returns [(text, score), ...] for the k best-scoring chunks, best first."""
+        if not self.chunk_ids:
+            return []
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for row, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[row] / self.avg_length)
+                scores[row] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.texts[row], score) for row, score in best]
+
+    def _prepare(self):
+        n = len(self.chunk_ids)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            for term, rows in self.postings.items()
+        }
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read lexical index, it will be rebuilt: {e}")
+            return
+        if (data.get("version"), data.get("k1"), data.get("b")) != (INDEX_VERSION, self.k1, self.b):
+            return
+        self.chunk_ids, self.texts = data["ids"], data["texts"]
+        self.doc_lengths, self.postings = data["doc_lengths"], data["postings"]
+        self._prepare()
+
+
+def fuse_rankings(rankings, weights, k):
+    """
+    Weighted reciprocal-rank fusion of several ranked text lists.
+    Returns the top k texts.
+    """
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, text in enumerate(ranking):
+            scores[text] += weight / (RRF_K + rank + 1)
+    return [text for text, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]]
@@ -1,18 +1,88 @@
-import requests
+"""
+Ollama client.
+Responses stream over /api/chat through one pooled httpx.AsyncClient, so
+turns reuse open connections instead of reconnecting. Each kiosk session keeps
+a Conversation. Its earlier turns, retrieved context included, are resent
+exactly as before, so Ollama finds them in the KV cache and only prefills the
+new turn. History is capped in turns and characters so it never pushes the
+system prompt out of the model's context window. The system prompt comes from
+services.prompt and never changes.
+"""
+import asyncio
 import json
+import time
+
+import httpx
+
+from services.prompt import PrefixCacheStats
+
+# Yielded by the streaming methods when Ollama fails
+STREAM_ERROR_TOKEN = "Error."
+
+DEFAULT_SYSTEM_PROMPT = "You are Este, a helpful kiosk assistant for USTP."
+
+
+class Conversation:
+    def __init__(self, max_turns=4, max_chars=4000):
+        """
+        Bounded chat history of one kiosk session: at most max_turns turns
+        and max_chars characters of messages. max_turns=0 keeps no history.
+        """
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.turns = []  # [(user message, assistant message), ...]
+
+    def messages(self, system_prompt, user_message):
+        """The /api/chat message list for the next turn."""
+        messages = [{"role": "system", "content": system_prompt}]
+        for user, assistant in self.turns:
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": assistant})
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def add_turn(self, user_message, answer):
+        if self.max_turns <= 0:
+            return
+        self.turns.append((user_message, answer))
+        if len(self.turns) > self.max_turns or self._chars() > self.max_chars:
+            # Every trim changes the prompt prefix and costs one full re-prefill,
+            # so drop the older half at once rather than one turn per request
+            keep = max(1, min(len(self.turns), self.max_turns) // 2)
+            del self.turns[:len(self.turns) - keep]
+            while self.turns and self._chars() > self.max_chars:
+                del self.turns[0]
+
+    def clear(self):
+        self.turns = []
+
+    def _chars(self):
+        return sum(len(user) + len(assistant) for user, assistant in self.turns)
+
 
 class LLMService:
-    def __init__(self, model="qwen2.5:7b", host="http://localhost:11434"):
+    def __init__(self, model="qwen2.5:7b", host="http://localhost:11434", max_connections=8, timeout=120.0):
         self.model = model
         self.host = host
         self.api_url = f"{host}/api/generate"
+        self.chat_url = f"{host}/api/chat"
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(timeout, connect=5.0)
+        # Blocking client for startup warmup; requests use the async one
+        self.client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        self._async_client = None
+        self._loop = None
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prefill_seconds = 0.0
+        self.prefix_stats = PrefixCacheStats()
 
-    def generate(self, prompt, system_prompt="You are Este, a helpful kiosk assistant for USTP."):
+    def generate(self, prompt, system_prompt=DEFAULT_SYSTEM_PROMPT):
         """
         Generates text from Ollama.
         """
         full_prompt = f"{system_prompt}\n\nUser: {prompt}\nAssistant:"
-        
+
         payload = {
             "model": self.model,
             "prompt": full_prompt,
@@ -21,7 +91,7 @@ class LLMService:
         }
 
         try:
-            response = requests.post(self.api_url, json=payload)
+            response = self.client.post(self.api_url, json=payload)
             response.raise_for_status()
             data = response.json()
             return data.get("response", "")
@@ -29,27 +99,112 @@ class LLMService:
             print(f"LLM Error: {e}")
             return "I apologize, but I am having trouble thinking right now."
 
-    def stream_generate(self, prompt, system_prompt="You are Este, a helpful kiosk assistant for USTP."):
+    def warm_prefix(self, system_prompt):
         """
-        Yields tokens for streaming response.
+        Prefills the static system prompt so the first real request finds it in
+        Ollama's cache, and calibrates the prefix-cache estimate.
         """
-        full_prompt = f"{system_prompt}\n\nUser: {prompt}\nAssistant:"
-        
         payload = {
             "model": self.model,
-            "prompt": full_prompt,
-            "stream": True,
-            "keep_alive": -1
+            "messages": [{"role": "system", "content": system_prompt}],
+            "stream": False,
+            "keep_alive": -1,
+            "options": {"num_predict": 1},
+        }
+        try:
+            response = self.client.post(self.chat_url, json=payload)
+            response.raise_for_status()
+            self.prefix_stats.calibrate(len(system_prompt), response.json().get("prompt_eval_count", 0))
+        except Exception as e:
+            print(f"LLM Error: {e}")
+
+    async def prefill(self, messages):
+        """
+        Has Ollama process messages (generating a single token) so a following
+        request that shares their prefix starts from the KV cache.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": -1,
+            "options": {"num_predict": 1},
         }
+        try:
+            response = await self._client().post(self.chat_url, json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"LLM Prefill Error: {e}")
 
+    async def stream_turn(self, conversation, system_prompt, user_message):
+        """
+        Yields the answer to user_message given the conversation so far, then
+        records the turn. Failed or cancelled turns are not recorded.
+        """
+        parts = []
         try:
-            with requests.post(self.api_url, json=payload, stream=True) as response:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        body = json.loads(line)
-                        if "response" in body:
-                            yield body["response"]
+            async for token in self._stream_chat(conversation.messages(system_prompt, user_message)):
+                parts.append(token)
+                yield token
         except Exception as e:
             print(f"LLM Stream Error: {e}")
-            yield "Error."
+            yield STREAM_ERROR_TOKEN
+            return
+        conversation.add_turn(user_message, "".join(parts))
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "avg_prompt_tokens_evaluated": self.prompt_tokens / self.requests if self.requests else 0.0,
+            "avg_prefill_ms": 1000 * self.prefill_seconds / self.requests if self.requests else 0.0,
+            **self.prefix_stats.stats(),
+        }
+
+    async def aclose(self):
+        if self._async_client:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.client.close()
+
+    async def _stream_chat(self, messages):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": -1
+        }
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        t0 = time.perf_counter()
+        first_token = None
+        # Leaving the block early (e.g. the turn was cancelled) closes the
+        # response, which makes Ollama stop generating
+        async with self._client().stream("POST", self.chat_url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                body = json.loads(line)
+                content = body.get("message", {}).get("content")
+                if content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - t0
+                    yield content
+                if body.get("done"):
+                    self._record(body, prompt_chars, first_token or time.perf_counter() - t0)
+
+    def _client(self):
+        # Connection pools belong to one event loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._async_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._async_client
+
+    def _record(self, body, prompt_chars, first_token_seconds):
+        # prompt_eval_count only counts tokens Ollama actually had to prefill,
+        # so it drops when the KV cache is reused
+        evaluated = body.get("prompt_eval_count", 0)
+        self.requests += 1
+        self.prompt_tokens += evaluated
+        self.prefill_seconds += body.get("prompt_eval_duration", 0) / 1e9
+        self.prefix_stats.record(prompt_chars, evaluated, first_token_seconds)
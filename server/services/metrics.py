@@ -0,0 +1,180 @@
+"""
+Latency histograms and gauges, exported in the Prometheus text format at /metrics.
+Histograms are recorded where the work happens (pipeline stages, RAG, STT);
+gauges are callbacks read only when /metrics is scraped, so they cost nothing
+in between. With Metrics(enabled=False) every histogram is a no-op.
+
+Series labelled by session are folded into session="closed" when the session
+ends (forget_session), so the number of series stays bounded by the active
+sessions while totals keep counting up.
+"""
+import bisect
+import threading
+
+# Seconds; covers a cached retrieval (~1ms) up to a long spoken answer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)
+# TTS seconds of compute per second of audio; below 1 is faster than real time
+RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0)
+
+CLOSED_SESSION = "closed"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def forget_session(self, session):
+        """Merges the session's series into session="closed"."""
+        if "session" not in self.labelnames:
+            return
+        position = self.labelnames.index("session")
+        session = str(session)
+        with self._lock:
+            for key in [key for key in self._series if key[position] == session]:
+                counts, total = self._series.pop(key)
+                closed_key = key[:position] + (CLOSED_SESSION,) + key[position + 1:]
+                closed = self._series.setdefault(closed_key, [[0] * len(counts), 0.0])
+                closed[0] = [a + b for a, b in zip(closed[0], counts)]
+                closed[1] += total
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class _NullHistogram:
+    def observe(self, value, **labels):
+        pass
+
+    def forget_session(self, session):
+        pass
+
+    def render(self):
+        return []
+
+
+class Gauge:
+    def __init__(self, name, help, read, labelname=None):
+        """
+        read() is called at scrape time and returns a number, or, with
+        labelname, a {label value: number} dict.
+        """
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelname = labelname
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            return [f"# {self.name} unavailable: {_escape(e)}"]
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.labelname is None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        else:
+            for label, number in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels([(self.labelname, label)])} {_format_value(number)}")
+        return lines
+
+
+class Metrics:
+    def __init__(self, enabled=True, session_labels=True, prefix="este"):
+        """
+        session_labels=False records every histogram under session="" for
+        deployments that don't want a series per kiosk.
+        """
+        self.enabled = enabled
+        self.session_labels = session_labels
+        self.prefix = prefix
+        self._histograms = []
+        self._gauges = []
+
+        session_backend = ("session", "backend")
+        self.stt_seconds = self.histogram("stt_seconds", "Speech-to-text time per utterance", session_backend)
+        self.embedding_seconds = self.histogram("embedding_seconds", "Query embedding time (cache misses)", ("backend",))
+        self.retrieval_seconds = self.histogram("retrieval_seconds", "Knowledge base retrieval time per turn", session_backend)
+        self.llm_ttft_seconds = self.histogram("llm_time_to_first_token_seconds", "LLM time to first token", session_backend)
+        self.llm_tokens_per_second = self.histogram(
+            "llm_tokens_per_second", "LLM decode rate after the first token", session_backend, RATE_BUCKETS
+        )
+        self.tts_rtf = self.histogram(
+            "tts_real_time_factor", "TTS compute seconds per second of audio, per sentence", session_backend, RTF_BUCKETS
+        )
+        self.first_audio_seconds = self.histogram(
+            "time_to_first_audio_seconds", "From the end of the question to the first audio frame sent", session_backend
+        )
+        self.turn_seconds = self.histogram(
+            "turn_seconds", "From the end of the question to the end of the answer", session_backend
+        )
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        if not self.enabled:
+            return _NullHistogram()
+        histogram = Histogram(f"{self.prefix}_{name}", help, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def gauge(self, name, help, read, labelname=None):
+        """Registers a gauge read at scrape time (see Gauge)."""
+        if self.enabled:
+            self._gauges.append(Gauge(f"{self.prefix}_{name}", help, read, labelname))
+
+    def session_label(self, session):
+        return session if self.session_labels and session is not None else ""
+
+    def forget_session(self, session):
+        for histogram in self._histograms:
+            histogram.forget_session(session)
+
+    def render(self):
+        """The Prometheus text exposition of every metric."""
+        lines = []
+        for metric in self._histograms + self._gauges:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,418 @@
+"""
+Shared model host.
+One process owns the heavy models (Whisper, Kokoro, the G2P fallback) and the
+knowledge base, so several uvicorn workers can serve WebSockets without each
+loading its own copy of the weights. Workers talk to it over
+multiprocessing.connection, and audio crosses through shared memory instead
+of being pickled down the socket.
+
+multiprocessing.connection unpickles what it receives, so the authkey is what
+keeps anyone else on the machine from running code in the host: serve.py
+makes a fresh random one per run unless ESTE_MODEL_HOST_AUTHKEY is set.
+
+Each worker connection owns up to two shared-memory buffers: "in" (audio the
+worker writes for the host) and "out" (audio the host writes back). Requests
+are (method, args) tuples; replies are ("ok", result) or ("error", message).
+Streaming TTS replies ("piece", size, inline, clause, phonemes) per rendered
+piece, and the worker answers "next" once it has copied the piece out (or
+"stop"); the stream ends with ("end",).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from services.audio import STT_SAMPLE_RATE
+
+DEFAULT_BUFFER_BYTES = 4 * 1024 * 1024
+
+
+class ModelHostError(RuntimeError):
+    """A request failed inside the model host."""
+
+
+def parse_address(address):
+    """"host:port" to a (host, port) tuple."""
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+class SharedBuffer:
+    def __init__(self, size=DEFAULT_BUFFER_BYTES):
+        """A growable shared-memory block, created (and unlinked) by the worker side."""
+        self.initial_size = size
+        self.shm = None
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def reserve(self, size=0):
+        """Returns the buffer, replacing it with a larger block if size does not fit."""
+        if self.shm is None or size > self.shm.size:
+            new_size = max(size, self.initial_size, 2 * self.shm.size if self.shm else 0)
+            self.close()
+            self.shm = SharedMemory(create=True, size=new_size)
+        return self.shm.buf
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class _Attachments:
+    def __init__(self):
+        """The host's handles on one connection's buffers, reattached when the worker grows them."""
+        self._open = {}
+
+    def get(self, role, name):
+        shm = self._open.get(role)
+        if shm is None or shm.name != name:
+            if shm is not None:
+                shm.close()
+            shm = SharedMemory(name=name)
+            # The worker owns the block; keep this process's resource tracker
+            # from unlinking it when the host exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self._open[role] = shm
+        return shm
+
+    def close(self):
+        for shm in self._open.values():
+            shm.close()
+        self._open.clear()
+
+
+class ModelHost:
+    def __init__(self, address, authkey, rag_service=None, stt_service=None, tts_service=None,
+                 viseme_mapper=None, stt_workers=1, tts_workers=1):
+        """
+        Serves already-loaded services to worker processes. stt_workers and
+        tts_workers cap concurrent Whisper and Kokoro calls across all workers,
+        like ModelExecutors does within one process.
+        """
+        self.address = address
+        self.rag_service = rag_service
+        self.stt_service = stt_service
+        self.tts_service = tts_service
+        self.viseme_mapper = viseme_mapper
+        self._stt_slots = threading.BoundedSemaphore(stt_workers)
+        self._tts_slots = threading.BoundedSemaphore(tts_workers)
+        self.connections = 0
+        self.handlers = {
+            "ping": lambda: True,
+            "stats": self.stats,
+            "tts.info": self._tts_info,
+            "g2p": lambda word: self.viseme_mapper.phonemize(word),
+            "rag.ready": lambda: self.rag_service.vector_store is not None,
+            "rag.query": lambda question, k=3: self.rag_service.query(question, k),
+            "rag.lookup_answer": lambda question: self.rag_service.lookup_answer(question),
+            "rag.store_answer": lambda question, answer: self.rag_service.store_answer(question, answer),
+            "rag.cache_stats": lambda: self.rag_service.cache_stats(),
+            "rag.sync": lambda: self.rag_service.sync(),
+        }
+        self.listener = Listener(parse_address(address), authkey=authkey)
+
+    def serve_forever(self):
+        print(f"🧠 Model host listening on {self.address}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                print(f"⚠️ Model host rejected a connection: {e}")
+                continue
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True, name="este-host-conn").start()
+
+    def stats(self):
+        return {"connections": self.connections, "address": self.address}
+
+    def _serve(self, conn):
+        buffers = _Attachments()
+        try:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    break
+                if method == "tts.synthesize_pieces":
+                    self._stream_pieces(conn, buffers, *args)
+                    continue
+                try:
+                    if method == "stt.transcribe_batch":
+                        result = self._transcribe_batch(buffers, *args)
+                    elif method == "stt.decode":
+                        result = self._decode(buffers, *args)
+                    else:
+                        result = self.handlers[method](*args)
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+                    continue
+                conn.send(("ok", result))
+        finally:
+            buffers.close()
+            conn.close()
+            self.connections -= 1
+
+    def _tts_info(self):
+        tts = self.tts_service
+        return {"sample_rate": tts.sample_rate, "voice": tts.voice, "speed": tts.speed,
+                "model_version": tts.model_version}
+
+    def _transcribe_batch(self, buffers, in_name, lengths):
+        shm = buffers.get("in", in_name)
+        audios, offset = [], 0
+        for length in lengths:
+            # Views straight onto the worker's buffer; Whisper reads them in place
+            audios.append(np.ndarray((length,), dtype=np.float32, buffer=shm.buf, offset=offset))
+            offset += 4 * length
+        with self._stt_slots:
+            return self.stt_service.transcribe_batch(audios)
+
+    def _decode(self, buffers, in_name, size, out_name):
+        data = bytes(buffers.get("in", in_name).buf[:size])
+        with self._stt_slots:
+            audio = self.stt_service.decode(data)
+        return self._put(buffers, out_name, np.ascontiguousarray(audio, dtype=np.float32))
+
+    def _stream_pieces(self, conn, buffers, out_name, text, voice, speed):
+        with self._tts_slots:
+            pieces = self.tts_service.synthesize_pieces(text, voice=voice, speed=speed)
+            try:
+                for pcm, clause, phonemes in pieces:
+                    size, inline = self._put(buffers, out_name, pcm)
+                    conn.send(("piece", size, inline, clause, phonemes))
+                    if conn.recv() != "next":
+                        break
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+                return
+            finally:
+                pieces.close()
+        conn.send(("end",))
+
+    @staticmethod
+    def _put(buffers, out_name, payload):
+        """Writes payload to the out buffer; returns (size, None), or (size, bytes) if it does not fit."""
+        data = memoryview(payload).cast("B")
+        out = buffers.get("out", out_name)
+        if data.nbytes > out.size:
+            return data.nbytes, bytes(data)
+        out.buf[:data.nbytes] = data
+        return data.nbytes, None
+
+
+class _HostChannel:
+    def __init__(self, address, authkey, buffer_bytes):
+        """One connection to the host and the shared buffers that go with it."""
+        self.conn = Client(address, authkey=authkey)
+        self.inbuf = SharedBuffer(buffer_bytes)
+        self.outbuf = SharedBuffer(buffer_bytes)
+
+    def request(self, method, *args):
+        self.conn.send((method, args))
+        status, result = self.conn.recv()
+        if status == "error":
+            raise ModelHostError(result)
+        return result
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            self.inbuf.close()
+            self.outbuf.close()
+
+
+class ModelHostClient:
+    def __init__(self, address, authkey, buffer_bytes=DEFAULT_BUFFER_BYTES):
+        """
+        Worker-side handle on a ModelHost. Connections are pooled, one per
+        thread using the host at a time. stt, tts and rag stand in for the
+        local services; g2p plugs into a local VisemeMapper, which keeps its
+        memory-mapped lexicon (shared through the page cache) in each worker.
+        """
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.buffer_bytes = buffer_bytes
+        self._idle = []
+        self._lock = threading.Lock()
+        self.stt = RemoteSTT(self)
+        self.rag = RemoteRAG(self)
+        self._tts = None
+
+    @property
+    def tts(self):
+        if self._tts is None:
+            self._tts = RemoteTTS(self)
+        return self._tts
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            channel = self._idle.pop() if self._idle else None
+        if channel is None:
+            channel = _HostChannel(self.address, self.authkey, self.buffer_bytes)
+        try:
+            yield channel
+        except (ModelHostError, GeneratorExit):
+            # Clean endings: the reply was read (or a stream drained) in full
+            self._release(channel)
+            raise
+        except BaseException:
+            # The conversation may be half-way through; start over on a new one
+            channel.close()
+            raise
+        self._release(channel)
+
+    def call(self, method, *args):
+        with self.connection() as channel:
+            return channel.request(method, *args)
+
+    def g2p(self, word):
+        return self.call("g2p", word)
+
+    def wait_ready(self, timeout=300.0):
+        """Blocks until the host answers (it only listens once its models are loaded)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.call("ping")
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def close(self):
+        with self._lock:
+            channels, self._idle = self._idle, []
+        for channel in channels:
+            channel.close()
+
+    def _release(self, channel):
+        with self._lock:
+            self._idle.append(channel)
+
+
+class RemoteSTT:
+    backend = "model_host"
+
+    def __init__(self, host):
+        """STTService on the model host. Raw PCM uploads are still converted locally."""
+        self.host = host
+
+    def load_audio(self, audio_bytes, audio_format="webm", sample_rate=STT_SAMPLE_RATE):
+        from services.stt import load_audio
+        return load_audio(audio_bytes, audio_format, sample_rate, self.decode)
+
+    def decode(self, audio_bytes):
+        with self.host.connection() as channel:
+            channel.inbuf.reserve(len(audio_bytes))[:len(audio_bytes)] = audio_bytes
+            channel.outbuf.reserve()
+            size, inline = channel.request("stt.decode", channel.inbuf.name, len(audio_bytes), channel.outbuf.name)
+            data = inline if inline is not None else channel.outbuf.shm.buf[:size]
+            return np.frombuffer(data, dtype=np.float32).copy()
+
+    def transcribe_array(self, audio, vad_filter=False):
+        return self.transcribe_batch([audio])[0]
+
+    def transcribe_batch(self, audios):
+        audios = [np.asarray(audio, dtype=np.float32) for audio in audios]
+        with self.host.connection() as channel:
+            buf = channel.inbuf.reserve(sum(audio.nbytes for audio in audios))
+            offset = 0
+            for audio in audios:
+                np.ndarray(audio.shape, dtype=np.float32, buffer=buf, offset=offset)[:] = audio
+                offset += audio.nbytes
+            del buf
+            return channel.request("stt.transcribe_batch", channel.inbuf.name, [len(audio) for audio in audios])
+
+
+class RemoteTTS:
+    backend = "model_host"
+
+    def __init__(self, host):
+        """KokoroTTS on the model host."""
+        self.host = host
+        info = host.call("tts.info")
+        self.sample_rate = info["sample_rate"]
+        self.voice = info["voice"]
+        self.speed = info["speed"]
+        self.model_version = info["model_version"]
+
+    def synthesize_stream_raw(self, text, voice="af_sarah", speed=1.0, stream=False):
+        from services.audio import pcm16_to_wav
+        pieces = (pcm for pcm, _, _ in self.synthesize_pieces(text, voice, speed))
+        if stream:
+            yield from pieces
+        else:
+            yield pcm16_to_wav(b"".join(pieces), self.sample_rate)
+
+    def synthesize_pieces(self, text, voice="af_sarah", speed=1.0):
+        with self.host.connection() as channel:
+            channel.outbuf.reserve()
+            channel.conn.send(("tts.synthesize_pieces", (channel.outbuf.name, text, voice, speed)))
+            finished = False
+            try:
+                while True:
+                    reply = channel.conn.recv()
+                    if reply[0] == "end":
+                        finished = True
+                        return
+                    if reply[0] == "error":
+                        finished = True
+                        raise ModelHostError(reply[1])
+                    _, size, inline, clause, phonemes = reply
+                    pcm = inline if inline is not None else bytes(channel.outbuf.shm.buf[:size])
+                    # Let the host render the next piece while this one is sent
+                    channel.conn.send("next")
+                    yield pcm, clause, phonemes
+            finally:
+                if not finished:
+                    self._stop(channel)
+
+    @staticmethod
+    def _stop(channel):
+        """Abandons a stream (e.g. barge-in) and reads up to its end so the connection can be reused."""
+        while True:
+            reply = channel.conn.recv()
+            if reply[0] == "piece":
+                channel.conn.send("stop")
+            elif reply[0] in ("end", "error"):
+                return
+
+
+class RemoteRAG:
+    backend = "model_host"
+
+    def __init__(self, host):
+        """RAGService on the model host, which also runs the file watcher."""
+        self.host = host
+
+    @property
+    def vector_store(self):
+        return self.host.call("rag.ready")
+
+    def query(self, question, k=3):
+        return self.host.call("rag.query", question, k)
+
+    def lookup_answer(self, question):
+        return self.host.call("rag.lookup_answer", question)
+
+    def store_answer(self, question, answer):
+        return self.host.call("rag.store_answer", question, answer)
+
+    def cache_stats(self):
+        return self.host.call("rag.cache_stats")
+
+    def sync(self):
+        return self.host.call("rag.sync")
+
+    def stop_watching(self):
+        pass
@@ -0,0 +1,417 @@
+"""
+Staged response pipeline.
+RAG -> LLM token stream -> streaming segmenter -> TTS worker -> WebSocket sender,
+connected by bounded asyncio queues so that sentence N+1 is generated while
+sentence N is synthesized and sentence N-1 is sent.
+"""
+import asyncio
+import concurrent.futures
+import re
+import threading
+import time
+
+from services.llm import STREAM_ERROR_TOKEN, Conversation
+from services.metrics import Metrics
+from services.prompt import PromptBuilder
+from services.segmenter import StreamingSegmenter
+from services.viseme_mapper import VisemeTrack
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class InterruptStats:
+    def __init__(self):
+        """
+        What barge-in saves. Work a cancelled response never did is estimated
+        against the average completed response.
+        """
+        self.completed = 0
+        self.interrupted = 0
+        self.aborted_llm_streams = 0
+        self.dropped_sentences = 0
+        self.tokens_saved = 0.0
+        self.sentences_saved = 0.0
+        self._tokens = 0
+        self._sentences = 0
+        self._lock = threading.Lock()
+
+    def complete(self, response):
+        with self._lock:
+            self.completed += 1
+            self._tokens += response["tokens"]
+            self._sentences += response["synthesized"]
+
+    def interrupt(self, response):
+        with self._lock:
+            self.interrupted += 1
+            # Segmented but never synthesized
+            self.dropped_sentences += response["sentences"] - response["synthesized"]
+            if not self.completed:
+                return
+            if not response["cached"] and not response["stream_done"]:
+                self.aborted_llm_streams += 1
+                self.tokens_saved += max(0.0, self._tokens / self.completed - response["tokens"])
+            self.sentences_saved += max(0.0, self._sentences / self.completed - response["synthesized"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "interrupted": self.interrupted,
+                "aborted_llm_streams": self.aborted_llm_streams,
+                "dropped_sentences": self.dropped_sentences,
+                "est_llm_tokens_saved": round(self.tokens_saved),
+                "est_tts_sentences_saved": round(self.sentences_saved, 1),
+            }
+
+
+class ResponsePipeline:
+    def __init__(self, rag_service, llm_service, tts_service, viseme_mapper, executors, queue_size=4,
+                 tts_cache=None, reuse_answers=False, prompt_builder=None, segmenter_policy=None,
+                 visemes_from_tts=False, metrics=None):
+        """
+        Blocking work runs on the shared ModelExecutors pools.
+        tts_cache (a services.tts_cache.TTSCache) is optional; hits skip synthesis entirely.
+        With reuse_answers, answers to repeated questions come from the
+        RAG semantic cache and skip retrieval and the LLM.
+        prompt_builder (a services.prompt.PromptBuilder) lays out the LLM prompt.
+        segmenter_policy (a services.segmenter.SegmenterPolicy) sets TTS chunk sizes.
+        With visemes_from_tts, lip sync follows the phonemes Kokoro actually
+        rendered, timed to each piece's audio, instead of a separate G2P pass.
+        queue_size bounds how many sentences (and synthesized sentences) may be
+        buffered between stages before the upstream stage waits.
+        metrics (a services.metrics.Metrics) records per-stage latencies.
+        """
+        self.rag_service = rag_service
+        self.llm_service = llm_service
+        self.tts_service = tts_service
+        self.viseme_mapper = viseme_mapper
+        self.executors = executors
+        self.queue_size = queue_size
+        self.tts_cache = tts_cache
+        self.reuse_answers = reuse_answers
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.segmenter_policy = segmenter_policy
+        self.visemes_from_tts = visemes_from_tts and hasattr(tts_service, "synthesize_pieces")
+        self.interrupt_stats = InterruptStats()
+        self.metrics = metrics or Metrics(enabled=False)
+        # (token, sentence, audio) queues of the responses in flight
+        self._stage_queues = set()
+
+    async def run(self, channel, text, conversation=None, context=None, session=None, started=None):
+        """
+        Answers `text` over a protocol.ClientChannel. Returns the full response text.
+        conversation (an llm.Conversation) carries the session's earlier turns.
+        context skips retrieval (e.g. committed speculative retrieval).
+        session labels the turn's metrics; started (time.perf_counter()) is
+        when the question ended, for time-to-first-audio (defaults to now).
+        Cancelling the call (barge-in) closes the LLM stream and drops pending TTS work.
+        """
+        response = {"text": "", "tokens": 0, "sentences": 0, "synthesized": 0, "cached": False, "stream_done": False,
+                    "session": self.metrics.session_label(session), "started": started or time.perf_counter()}
+        try:
+            return await self._answer(channel, text, conversation, context, response)
+        except asyncio.CancelledError:
+            self.interrupt_stats.interrupt(response)
+            print(f"✋ Response interrupted after {response['tokens']} tokens, "
+                  f"{response['synthesized']}/{response['sentences']} sentences synthesized")
+            raise
+
+    async def _answer(self, channel, text, conversation, context, response):
+        if conversation is None:
+            conversation = Conversation(max_turns=0)
+        cached_answer = None
+        if self.reuse_answers:
+            cached_answer = await self.executors.run("rag", self.rag_service.lookup_answer, text)
+
+        if cached_answer:
+            response["cached"] = True
+            print(f"[TIMING] Semantic cache hit, reusing answer")
+        else:
+            # 1. RAG: Retrieve Context
+            if context is None:
+                t1 = time.time()
+                context = await self.executors.run("rag", self.rag_service.query, text)
+                print(f"[TIMING] RAG (Retrieval): {time.time() - t1:.2f}s")
+                self.metrics.retrieval_seconds.observe(
+                    time.time() - t1, session=response["session"], backend=self._backend(self.rag_service)
+                )
+
+            user_message = self.prompt_builder.user_message(context, text)
+            print(f"[TIMING] Starting LLM & TTS Pipeline...")
+
+        # Signal start of response
+        await channel.send_json({
+            "type": "audio_start",
+            "text": "...", # Text will be updated as we get it
+            "sampleRate": self.tts_service.sample_rate,
+            "format": channel.audio_format
+        })
+        await channel.begin_audio(self.tts_service.sample_rate)
+
+        t_llm_start = time.time()
+        token_queue = asyncio.Queue(maxsize=self.queue_size * 16)
+        sentence_queue = asyncio.Queue(maxsize=self.queue_size)
+        audio_queue = asyncio.Queue(maxsize=self.queue_size * 4)
+        queues = (token_queue, sentence_queue, audio_queue)
+        self._stage_queues.add(queues)
+
+        if cached_answer:
+            source = self._replay_stage(cached_answer, token_queue)
+        else:
+            source = self._llm_stage(conversation, user_message, token_queue, response)
+
+        tasks = [
+            asyncio.create_task(source),
+            asyncio.create_task(self._segment_stage(token_queue, sentence_queue, response)),
+            asyncio.create_task(self._tts_stage(sentence_queue, audio_queue, response)),
+            asyncio.create_task(self._send_stage(channel, audio_queue, response)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self._stage_queues.discard(queues)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        # Update UI & End
+        await channel.send_json({"type": "audio_response", "text": response["text"]})
+        await channel.send_json({"type": "audio_end"})
+        print(f"[TIMING] Total Response Cycle: {time.time() - t_llm_start:.2f}s")
+        self.metrics.turn_seconds.observe(
+            time.perf_counter() - response["started"], session=response["session"], backend=self._answer_backend(response)
+        )
+        self.interrupt_stats.complete(response)
+
+        if self.reuse_answers and not cached_answer and response["text"].strip() != STREAM_ERROR_TOKEN:
+            await self.executors.run("rag", self.rag_service.store_answer, text, response["text"])
+        return response["text"]
+
+    async def _llm_stage(self, conversation, user_message, token_queue, response):
+        """Streams LLM tokens into token_queue."""
+        t0 = time.perf_counter()
+        first = None
+        tokens = 0
+        async for token in self.llm_service.stream_turn(
+            conversation, self.prompt_builder.system_prompt(), user_message
+        ):
+            if first is None:
+                first = time.perf_counter()
+            tokens += 1
+            await token_queue.put(token)
+        if first is not None:
+            # Decode time includes waits on a full token queue, as the client sees it
+            labels = {"session": response["session"], "backend": self.llm_service.model}
+            self.metrics.llm_ttft_seconds.observe(first - t0, **labels)
+            decode_seconds = time.perf_counter() - first
+            if tokens > 1 and decode_seconds > 0:
+                self.metrics.llm_tokens_per_second.observe((tokens - 1) / decode_seconds, **labels)
+        await token_queue.put(_DONE)
+
+    async def _replay_stage(self, answer, token_queue):
+        """Feeds a cached answer through the segmenter word by word."""
+        for token in re.findall(r"\s*\S+", answer):
+            await token_queue.put(token)
+        await token_queue.put(_DONE)
+
+    async def _segment_stage(self, token_queue, sentence_queue, response):
+        """Groups tokens into speakable chunks as soon as the segmenter cuts one."""
+        segmenter = StreamingSegmenter(self.segmenter_policy)
+        while True:
+            token = await token_queue.get()
+            if token is _DONE:
+                break
+            response["text"] += token
+            response["tokens"] += 1
+            for chunk in segmenter.feed(token):
+                response["sentences"] += 1
+                await sentence_queue.put(chunk)
+        response["stream_done"] = True
+
+        # Final cleanup
+        for chunk in segmenter.flush():
+            response["sentences"] += 1
+            await sentence_queue.put(chunk)
+        await sentence_queue.put(_DONE)
+
+    async def _tts_stage(self, sentence_queue, audio_queue, response):
+        """
+        Maps visemes for each sentence, then streams its PCM clause by clause
+        so the first clause can be sent while the rest is still rendering.
+        Cached sentences are sent straight from the cache.
+        """
+        while True:
+            sentence = await sentence_queue.get()
+            if sentence is _DONE:
+                break
+
+            key = None
+            if self.tts_cache:
+                key = self.tts_cache.make_key(
+                    sentence, self.tts_service.voice, self.tts_service.speed, self.tts_service.model_version
+                )
+                cached = await asyncio.to_thread(self.tts_cache.get, key)
+                if cached:
+                    pcm, visemes = cached
+                    await audio_queue.put(("visemes", VisemeTrack.from_cached(visemes)))
+                    await audio_queue.put(("audio", pcm))
+                    response["synthesized"] += 1
+                    continue
+
+            await self._pump_blocking_iterator(
+                lambda: self._render_sentence(sentence, key, response["session"]),
+                audio_queue,
+                "tts",
+            )
+            response["synthesized"] += 1
+        await audio_queue.put(_DONE)
+
+    def _render_sentence(self, sentence, cache_key=None, session=""):
+        """Yields ("visemes", VisemeTrack) then ("audio", pcm) pieces, caching the result."""
+        if self.visemes_from_tts:
+            yield from self._render_sentence_with_phonemes(sentence, cache_key, session)
+            return
+
+        track = self.viseme_mapper.text_track(sentence)
+        yield ("visemes", track)
+
+        pieces = []
+        compute = [0.0]
+        for pcm in _timed(self.tts_service.synthesize_stream_raw(
+            sentence, voice=self.tts_service.voice, speed=self.tts_service.speed, stream=True
+        ), compute):
+            pieces.append(pcm)
+            yield ("audio", pcm)
+
+        self._observe_rtf(compute[0], pieces, session)
+        if cache_key and pieces:
+            self.tts_cache.put(cache_key, b"".join(pieces), track.to_columns())
+
+    def _render_sentence_with_phonemes(self, sentence, cache_key=None, session=""):
+        """
+        One phonemization per piece: the phonemes Kokoro synthesized also give
+        that piece's visemes, stretched over its real sample count. Each piece's
+        track is sent just before its audio; the cache keeps the whole sentence.
+        """
+        pieces, sentence_track = [], VisemeTrack()
+        compute = [0.0]
+        for pcm, clause, phonemes in _timed(self.tts_service.synthesize_pieces(
+            sentence, voice=self.tts_service.voice, speed=self.tts_service.speed
+        ), compute):
+            duration = len(pcm) / 2 / self.tts_service.sample_rate
+            if phonemes is None:
+                track = self.viseme_mapper.text_track(clause, duration)
+            else:
+                track = self.viseme_mapper.phoneme_track(phonemes, duration)
+            yield ("visemes", track)
+            yield ("audio", pcm)
+            pieces.append(pcm)
+            sentence_track.extend(track)
+
+        self._observe_rtf(compute[0], pieces, session)
+        if cache_key and pieces:
+            self.tts_cache.put(cache_key, b"".join(pieces), sentence_track.to_columns())
+
+    async def _send_stage(self, channel, audio_queue, response):
+        """
+        Sends visemes and audio to the client in order. Viseme tracks are timed
+        from the start of their own audio; offset (seconds of response audio
+        already sent) places them on the client's playback clock.
+        """
+        sample_rate = self.tts_service.sample_rate
+        elapsed = 0.0
+        first_audio = True
+        while True:
+            item = await audio_queue.get()
+            if item is _DONE:
+                break
+            kind, payload = item
+            if kind == "visemes":
+                await channel.send_visemes(payload, elapsed)
+            else:
+                await channel.send_audio(payload, sample_rate)
+                if first_audio:
+                    first_audio = False
+                    self.metrics.first_audio_seconds.observe(
+                        time.perf_counter() - response["started"],
+                        session=response["session"], backend=self._answer_backend(response),
+                    )
+                elapsed += len(payload) / 2 / sample_rate
+
+    def queue_depths(self):
+        """Items waiting between stages, summed over the responses in flight."""
+        depths = {"token": 0, "sentence": 0, "audio": 0}
+        for token_queue, sentence_queue, audio_queue in list(self._stage_queues):
+            depths["token"] += token_queue.qsize()
+            depths["sentence"] += sentence_queue.qsize()
+            depths["audio"] += audio_queue.qsize()
+        return depths
+
+    def _observe_rtf(self, compute_seconds, pieces, session):
+        audio_seconds = sum(len(pcm) for pcm in pieces) / 2 / self.tts_service.sample_rate
+        if audio_seconds > 0:
+            self.metrics.tts_rtf.observe(
+                compute_seconds / audio_seconds, session=session, backend=self._backend(self.tts_service)
+            )
+
+    def _answer_backend(self, response):
+        return "answer_cache" if response["cached"] else self.llm_service.model
+
+    @staticmethod
+    def _backend(service):
+        return getattr(service, "backend", type(service).__name__)
+
+    async def _pump_blocking_iterator(self, make_iterator, out_queue, kind):
+        """
+        Drains a blocking iterator on the `kind` executor into an asyncio queue.
+        The thread waits while the queue is full and stops if the stage is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+
+        def pump():
+            iterator = make_iterator()
+            try:
+                for item in iterator:
+                    future = asyncio.run_coroutine_threadsafe(out_queue.put(item), loop)
+                    while True:
+                        try:
+                            future.result(timeout=0.1)
+                            break
+                        except concurrent.futures.TimeoutError:
+                            if stop.is_set():
+                                future.cancel()
+                                return
+                    if stop.is_set():
+                        return
+            finally:
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+
+        try:
+            await self.executors.run(kind, pump)
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+
+
+def _timed(iterable, seconds):
+    """Yields from iterable, adding the time spent producing items to seconds[0]."""
+    iterator = iter(iterable)
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds[0] += time.perf_counter() - t0
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
@@ -0,0 +1,76 @@
+"""
+Prompt layout for the LLM.
+Inference backends reuse cached work only for an identical token prefix, so
+every prompt starts with the same static system prompt (persona and rules).
+The retrieved context and the question come after it, in the user turn.
+Nothing request-specific may go into SYSTEM_PROMPT.
+"""
+import threading
+
+SYSTEM_PROMPT = (
+    "You are Este, the friendly AI student companion for USTP.\n"
+    "Speak naturally and casually. Keep answers SHORT (max 1-3 sentences).\n"
+    "Answer using the context given with each question. If the context does not "
+    "cover it, say you are not sure."
+)
+
+# Requests that skip at least this share of the static prefix count as hits
+HIT_FRACTION = 0.5
+
+
+class PromptBuilder:
+    def __init__(self, system_prompt=SYSTEM_PROMPT):
+        self._system_prompt = system_prompt
+
+    def system_prompt(self):
+        """The static prefix, identical (byte for byte) for every request."""
+        return self._system_prompt
+
+    def user_message(self, context, question):
+        return f"Context:\n{context}\n\nQuestion: {question}"
+
+
+class PrefixCacheStats:
+    def __init__(self):
+        """
+        Estimates how often the backend reused its cached prompt prefix.
+        Ollama reports prompt_eval_count, the tokens it actually had to
+        prefill. The cold warmup request calibrates characters per token, and
+        a later request is a hit when it evaluated clearly fewer tokens than
+        its prompt holds.
+        """
+        self.prefix_tokens = 0
+        self.chars_per_token = 4.0
+        self.requests = 0
+        self.hits = 0
+        self.reused_tokens = 0
+        self.first_token_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def calibrate(self, prefix_chars, prefix_tokens):
+        """Records the cold prefill of the static prefix (the warmup request)."""
+        if prefix_tokens > 0:
+            with self._lock:
+                self.prefix_tokens = prefix_tokens
+                self.chars_per_token = prefix_chars / prefix_tokens
+
+    def record(self, prompt_chars, evaluated_tokens, first_token_seconds):
+        estimated = prompt_chars / self.chars_per_token
+        reused = max(0.0, estimated - evaluated_tokens)
+        with self._lock:
+            self.requests += 1
+            self.reused_tokens += reused
+            self.first_token_seconds += first_token_seconds
+            if self.prefix_tokens and reused >= HIT_FRACTION * self.prefix_tokens:
+                self.hits += 1
+
+    def stats(self):
+        with self._lock:
+            n = self.requests
+            return {
+                "prefix_tokens": self.prefix_tokens,
+                "prefix_cache_hits": self.hits,
+                "prefix_cache_hit_rate": self.hits / n if n else 0.0,
+                "avg_reused_tokens": self.reused_tokens / n if n else 0.0,
+                "avg_first_token_ms": 1000 * self.first_token_seconds / n if n else 0.0,
+            }
@@ -0,0 +1,235 @@
+"""
+WebSocket wire protocol.
+Control and viseme messages are JSON. Clients that send a `hello` message
+asking for `"audio_transport": "binary"` receive audio as binary frames:
+
+    offset  size  field
+    0       2     magic b"EA"
+    2       1     protocol version
+    3       1     audio format (see AUDIO_FORMATS)
+    4       4     sequence number (uint32, little-endian, per connection)
+    8       4     sample rate (uint32, little-endian)
+    12      ...   audio payload
+
+Binary clients may also ask for `"audio_format": "pcm16"`: each response then
+starts with one frame holding a streaming WAV header, followed by raw int16
+PCM frames as Kokoro renders them. Everyone else gets self-contained WAV chunks.
+
+Clients that never say hello keep getting base64 `audio_chunk` JSON messages.
+
+Viseme tracks default to JSON `viseme_data` messages (a dict per event). A
+hello with `"viseme_format": "columnar"` gets the viseme name table once, in
+the hello_ack, and then one compact track per sentence. Binary clients get a
+viseme frame:
+
+    offset  size  field
+    0       2     magic b"EV"
+    2       1     protocol version
+    3       1     reserved (0)
+    4       4     event count n (uint32, little-endian)
+    8       4     offset in ms of the response audio it starts at (uint32)
+    12      2n    durations in ms (uint16[n]); starts are their running sum
+    12+2n   n     viseme ids (uint8[n], indexes into the table)
+
+JSON clients get the same columns as a `viseme_track` message.
+
+Every recorded clip gets a `final_transcript` with what was heard; one
+shorter than two characters (silence, noise) gets no answer.
+
+When a request can't be served (e.g. speech recognition failed to load),
+the server sends `{"type": "error", "code": ..., "message": ...}` and keeps
+the connection open for whatever still works.
+
+A `cancel` message, new audio or a new text_query interrupts the answer in
+flight: the server stops generating it and sends `flush`, after which the
+client should drop any audio it has queued.
+
+The hello may also describe what the client uploads: `"input_format"` is
+"webm" (any container, the default) or headerless mono "pcm16" / "float32"
+at `"input_sample_rate"` Hz. Raw uploads skip container decoding entirely.
+Sample rates (there and in `stt_start`) must be whole numbers between 8 and
+192 kHz; anything else falls back to 16 kHz with an `error` event.
+"""
+import base64
+import struct
+import sys
+from array import array
+
+from services.audio import RAW_INPUT_FORMATS, STT_SAMPLE_RATE, pcm16_to_wav, wav_header
+from services.viseme_mapper import VISUAL_TARGETS, VisemeTrack
+
+PROTOCOL_VERSION = 1
+AUDIO_FRAME_MAGIC = b"EA"
+AUDIO_HEADER = struct.Struct("<2sBBII")
+VISEME_FRAME_MAGIC = b"EV"
+VISEME_HEADER = struct.Struct("<2sBBII")
+
+AUDIO_FORMAT_WAV = 0
+AUDIO_FORMAT_PCM16 = 1
+AUDIO_FORMAT_FLOAT32 = 2
+
+AUDIO_FORMATS = {
+    "wav": AUDIO_FORMAT_WAV,
+    "pcm16": AUDIO_FORMAT_PCM16,
+    "float32": AUDIO_FORMAT_FLOAT32,
+}
+
+INPUT_FORMATS = ("webm",) + tuple(RAW_INPUT_FORMATS)
+VISEME_FORMATS = ("json", "columnar")
+# Accepted client sample rates for raw uploads and streams (Hz)
+MIN_INPUT_SAMPLE_RATE = 8000
+MAX_INPUT_SAMPLE_RATE = 192000
+
+
+def parse_sample_rate(value, default=STT_SAMPLE_RATE):
+    """
+    Validates a client-supplied sample rate. Returns (rate, error); on a bad
+    value rate is default and error says why.
+    """
+    if value is None:
+        return default, None
+    try:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise TypeError
+        rate = float(value)
+        if not rate.is_integer():
+            raise ValueError
+        rate = int(rate)
+    except (TypeError, ValueError):
+        return default, f"Invalid sample rate {value!r}, using {default} Hz"
+    if not MIN_INPUT_SAMPLE_RATE <= rate <= MAX_INPUT_SAMPLE_RATE:
+        return default, (f"Sample rate {rate} Hz is outside {MIN_INPUT_SAMPLE_RATE}-{MAX_INPUT_SAMPLE_RATE} Hz, "
+                         f"using {default} Hz")
+    return rate, None
+
+
+def pack_audio_frame(seq, sample_rate, audio_format, payload):
+    """
+    Prefixes payload (bytes, bytearray, memoryview or a contiguous numpy
+    buffer) with the audio header. The payload is copied exactly once, into
+    the outgoing frame.
+    """
+    header = AUDIO_HEADER.pack(AUDIO_FRAME_MAGIC, PROTOCOL_VERSION, audio_format, seq & 0xFFFFFFFF, sample_rate)
+    return b"".join((header, memoryview(payload).cast("B")))
+
+
+def unpack_audio_frame(frame):
+    """Returns (seq, sample_rate, audio_format, payload memoryview)."""
+    magic, version, audio_format, seq, sample_rate = AUDIO_HEADER.unpack_from(frame)
+    if magic != AUDIO_FRAME_MAGIC:
+        raise ValueError("Not an audio frame")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    return seq, sample_rate, audio_format, memoryview(frame)[AUDIO_HEADER.size:]
+
+
+def pack_viseme_frame(track, offset_ms):
+    """Packs a viseme_mapper.VisemeTrack into a binary viseme frame."""
+    header = VISEME_HEADER.pack(VISEME_FRAME_MAGIC, PROTOCOL_VERSION, 0, len(track), offset_ms)
+    durations = track.durations
+    if sys.byteorder == "big":
+        durations = array("H", durations)
+        durations.byteswap()
+    return b"".join((header, durations.tobytes(), track.ids))
+
+
+def unpack_viseme_frame(frame):
+    """Returns (offset_ms, VisemeTrack)."""
+    magic, version, _, count, offset_ms = VISEME_HEADER.unpack_from(frame)
+    if magic != VISEME_FRAME_MAGIC:
+        raise ValueError("Not a viseme frame")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    start = VISEME_HEADER.size
+    if len(frame) != start + 3 * count:
+        raise ValueError(f"Viseme frame of {len(frame)} bytes can't hold {count} events")
+    durations = array("H")
+    durations.frombytes(frame[start:start + 2 * count])
+    if sys.byteorder == "big":
+        durations.byteswap()
+    return offset_ms, VisemeTrack(frame[start + 2 * count:], durations)
+
+
+class ClientChannel:
+    def __init__(self, websocket):
+        """
+        Per-connection sender. Speaks the legacy JSON protocol until the client
+        negotiates binary audio frames.
+        """
+        self.websocket = websocket
+        self.binary_audio = False
+        self.audio_format = "wav"
+        self.input_format = "webm"
+        self.input_sample_rate = STT_SAMPLE_RATE
+        self.viseme_format = "json"
+        self.seq = 0
+        # Problems with the last hello, to report as error events
+        self.errors = []
+
+    def negotiate(self, hello):
+        """Applies a client `hello` message and returns the server's reply."""
+        self.binary_audio = hello.get("audio_transport") == "binary"
+        # Headerless PCM only makes sense with binary frames
+        self.audio_format = "pcm16" if self.binary_audio and hello.get("audio_format") == "pcm16" else "wav"
+        input_format = hello.get("input_format", "webm")
+        self.input_format = input_format if input_format in INPUT_FORMATS else "webm"
+        self.input_sample_rate, error = parse_sample_rate(hello.get("input_sample_rate"))
+        self.errors = [error] if error else []
+        self.viseme_format = "columnar" if hello.get("viseme_format") == "columnar" else "json"
+        ack = {
+            "type": "hello_ack",
+            "protocol": PROTOCOL_VERSION,
+            "audio_transport": "binary" if self.binary_audio else "json",
+            "audio_format": self.audio_format,
+            "audio_formats": AUDIO_FORMATS,
+            "input_format": self.input_format,
+            "input_sample_rate": self.input_sample_rate,
+            "input_formats": INPUT_FORMATS,
+            "viseme_format": self.viseme_format,
+        }
+        if self.viseme_format == "columnar":
+            ack["viseme_table"] = VISUAL_TARGETS
+        return ack
+
+    async def send_json(self, data):
+        await self.websocket.send_json(data)
+
+    async def send_visemes(self, track, offset):
+        """
+        Sends a viseme_mapper.VisemeTrack in the negotiated format. offset is
+        the seconds of response audio already sent, where the track starts.
+        """
+        if self.viseme_format == "json":
+            await self.websocket.send_json({"type": "viseme_data", "visemes": track.to_dicts(), "offset": round(offset, 3)})
+            return
+
+        offset_ms = round(offset * 1000)
+        if self.binary_audio:
+            await self.websocket.send_bytes(pack_viseme_frame(track, offset_ms))
+        else:
+            await self.websocket.send_json({"type": "viseme_track", "offset": offset_ms, **track.to_columns()})
+
+    async def begin_audio(self, sample_rate):
+        """Starts a response's audio. PCM streams get their WAV header here, once."""
+        if self.audio_format == "pcm16":
+            await self._send_frame(wav_header(sample_rate), sample_rate, AUDIO_FORMAT_WAV)
+
+    async def send_audio(self, pcm, sample_rate):
+        """Sends one piece of int16 PCM in the negotiated format."""
+        if self.audio_format == "pcm16":
+            await self._send_frame(pcm, sample_rate, AUDIO_FORMAT_PCM16)
+            return
+
+        wav = pcm16_to_wav(pcm, sample_rate)
+        if self.binary_audio:
+            await self._send_frame(wav, sample_rate, AUDIO_FORMAT_WAV)
+        else:
+            await self.websocket.send_json({
+                "type": "audio_chunk",
+                "audio": base64.b64encode(wav).decode('utf-8')
+            })
+            self.seq += 1
+
+    async def _send_frame(self, payload, sample_rate, audio_format):
+        await self.websocket.send_bytes(pack_audio_frame(self.seq, sample_rate, audio_format, payload))
+        self.seq += 1
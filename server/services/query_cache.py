@@ -0,0 +1,185 @@
+"""
+Caches in front of RAGService.query.
+EmbeddingCache maps a normalized question to its embedding, so a repeated
+question skips the Ollama embedding round-trip. SemanticCache matches new
+questions against recent ones by cosine similarity and reuses the retrieved
+context; full LLM answers are optionally reused, but only for the same
+question (after normalize_query), since a near match can still ask something
+else ("When does the library open?" vs "close?").
+Both are bounded in size and expire entries after a TTL.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def normalize_query(text):
+    """Lowercases, drops punctuation and collapses whitespace."""
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question):
+        key = normalize_query(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, question, embedding):
+        key = normalize_query(question)
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+class SemanticCache:
+    def __init__(self, threshold=0.97, max_entries=256, ttl=600.0):
+        """
+        threshold is the minimum cosine similarity between two questions'
+        embeddings for one to reuse the other's results.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # id -> {"question", "key", "context", "answer", "created"}
+        self._vectors = OrderedDict()  # id -> unit embedding
+        self._matrix = None
+        self._ids = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.answer_hits = 0
+        self.misses = 0
+
+    def lookup(self, embedding):
+        """
+        Returns the closest live entry (a dict with question, context, answer)
+        if it is within the threshold, else None.
+        """
+        query = _unit(embedding)
+        with self._lock:
+            self._expire()
+            entry = self._closest(query)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry)
+
+    def lookup_answer(self, question):
+        """Returns the cached answer to the same question, or None."""
+        with self._lock:
+            self._expire()
+            entry = self._same_question(normalize_query(question))
+            if entry is None or not entry["answer"]:
+                self.misses += 1
+                return None
+            self.answer_hits += 1
+            return entry["answer"]
+
+    def put(self, embedding, question, context):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "question": question, "key": normalize_query(question), "context": context,
+                "answer": None, "created": time.monotonic(),
+            }
+            self._vectors[entry_id] = _unit(embedding)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                del self._vectors[oldest]
+            self._matrix = None
+
+    def set_answer(self, question, answer):
+        """Attaches an LLM answer to the entry for this exact question, if any."""
+        with self._lock:
+            entry = self._same_question(normalize_query(question))
+            if entry is not None:
+                entry["answer"] = answer
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.answer_hits + self.misses
+            return {
+                "hits": self.hits,
+                "answer_hits": self.answer_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.answer_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def _closest(self, query):
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._ids = list(self._vectors.keys())
+            self._matrix = np.stack([self._vectors[i] for i in self._ids])
+        scores = self._matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self._entries[self._ids[best]]
+
+    def _same_question(self, key):
+        for entry in reversed(self._entries.values()):
+            if entry["key"] == key:
+                return entry
+        return None
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [i for i, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for entry_id in expired:
+            del self._entries[entry_id]
+            del self._vectors[entry_id]
+        if expired:
+            self._matrix = None
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
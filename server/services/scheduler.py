@@ -0,0 +1,132 @@
+"""
+Executors and per-session scheduling.
+All blocking model work (Whisper, RAG, Kokoro) runs on dedicated thread
+pools so the event loop keeps serving every kiosk, and each kiosk's turns run
+in order on their own background task. Ollama is streamed with async httpx
+and needs no pool.
+"""
+import asyncio
+import itertools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+class ModelExecutors:
+    def __init__(self, stt_workers=1, rag_workers=2, tts_workers=1):
+        """
+        One bounded thread pool per kind of work. Jobs queue FIFO per pool, so
+        with more kiosks than workers each kiosk's latency grows by the work
+        queued ahead of it instead of one kiosk holding the server.
+        """
+        self.pools = {
+            "stt": ThreadPoolExecutor(max_workers=stt_workers, thread_name_prefix="este-stt"),
+            "rag": ThreadPoolExecutor(max_workers=rag_workers, thread_name_prefix="este-rag"),
+            "tts": ThreadPoolExecutor(max_workers=tts_workers, thread_name_prefix="este-tts"),
+        }
+        self.workers = {
+            "stt": stt_workers, "rag": rag_workers, "tts": tts_workers,
+        }
+        self.busy = dict.fromkeys(self.pools, 0)
+        self.queued = dict.fromkeys(self.pools, 0)
+        self._lock = threading.Lock()
+
+    async def run(self, kind, fn, *args):
+        """Runs fn(*args) on the `kind` pool and awaits its result."""
+        with self._lock:
+            self.queued[kind] += 1
+        future = self.pools[kind].submit(self._tracked, kind, fn, args)
+        future.add_done_callback(partial(self._unqueue_cancelled, kind))
+        return await asyncio.wrap_future(future)
+
+    def _unqueue_cancelled(self, kind, future):
+        # A job cancelled before it started never reaches _tracked
+        if future.cancelled():
+            with self._lock:
+                self.queued[kind] -= 1
+
+    def _tracked(self, kind, fn, args):
+        with self._lock:
+            self.queued[kind] -= 1
+            self.busy[kind] += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.busy[kind] -= 1
+
+    def stats(self):
+        """Per pool: worker count, jobs running and jobs waiting for a worker."""
+        with self._lock:
+            return {
+                kind: {"workers": self.workers[kind], "busy": self.busy[kind], "queued": self.queued[kind]}
+                for kind in self.pools
+            }
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class SessionScheduler:
+    _ids = itertools.count(1)
+
+    def __init__(self, max_pending=4):
+        """
+        Serializes the turns of one kiosk session. The WebSocket receive loop
+        only enqueues turns, so it never waits on model work.
+        """
+        self.session_id = next(self._ids)
+        self.inbox = asyncio.Queue(maxsize=max_pending)
+        self._worker = None
+        self._current = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, make_turn):
+        """Queues a turn. make_turn is a zero-argument coroutine function."""
+        await self.inbox.put(make_turn)
+
+    async def interrupt(self):
+        """
+        Barge-in: drops queued turns and cancels the running one, waiting until
+        it has unwound. Returns the number of turns cancelled or dropped.
+        """
+        dropped = 0
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+            dropped += 1
+        turn = self._current
+        if turn and not turn.done():
+            turn.cancel()
+            await asyncio.wait([turn])
+            dropped += 1
+        return dropped
+
+    async def _run(self):
+        while True:
+            make_turn = await self.inbox.get()
+            self._current = asyncio.create_task(make_turn())
+            try:
+                # wait() rather than await, so a cancelled turn does not stop the worker
+                await asyncio.wait([self._current])
+            except asyncio.CancelledError:
+                self._current.cancel()
+                raise
+            turn, self._current = self._current, None
+            if turn.cancelled():
+                print(f"✋ Session {self.session_id} turn interrupted")
+            elif turn.exception():
+                e = turn.exception()
+                print(f"❌ Session {self.session_id} turn failed: {e}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+
+    async def close(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,104 @@
+"""
+Streaming sentence segmenter for the LLM -> TTS handoff.
+Tokens go in and speakable chunks come out. The first chunk of a response is
+cut early, at the first clause boundary past a few words, to get audio out
+fast. Later chunks are longer, whole sentences where possible, because Kokoro
+synthesizes longer text more efficiently. Periods in abbreviations
+("Dr.", "U.S.") and numbers ("3.5") do not end a sentence.
+"""
+import re
+from dataclasses import dataclass
+
+# A sentence end only counts once the following whitespace has arrived, which
+# also keeps "3.5" together
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*(?=\s)|\n")
+CLAUSE_END = re.compile(r"[,;:—](?=\s)|\s[-–](?=\s)")
+LAST_WORD = re.compile(r"(\S+)$")
+
+ABBREVIATIONS = frozenset(
+    "mr mrs ms dr prof sr jr st mt vs etc inc ltd co corp dept univ bldg rm no nos fig approx "
+    "ave blvd rd jan feb mar apr jun jul aug sep sept oct nov dec mon tue wed thu fri sat sun "
+    "a.m p.m e.g i.e u.s u.k".split()
+)
+
+
+@dataclass
+class SegmenterPolicy:
+    """
+    Chunk sizes in characters. The first chunk is cut at the first clause or
+    sentence boundary past first_min_chars, or forced at first_max_chars.
+    Later chunks end at a sentence boundary past min_chars. A sentence running
+    past max_chars is cut at its last clause boundary, or at a space.
+    """
+    first_min_chars: int = 16
+    first_max_chars: int = 80
+    min_chars: int = 60
+    max_chars: int = 240
+
+
+class StreamingSegmenter:
+    def __init__(self, policy=None):
+        self.policy = policy or SegmenterPolicy()
+        self.buffer = ""
+        self.chunks = 0
+
+    def feed(self, token):
+        """Adds a token; returns the chunks it completed (often none)."""
+        self.buffer += token
+        out = []
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                return out
+            chunk = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            if chunk:
+                self.chunks += 1
+                out.append(chunk)
+
+    def flush(self):
+        """Returns whatever is left once the token stream ends."""
+        chunk = self.buffer.strip()
+        self.buffer = ""
+        if not chunk:
+            return []
+        self.chunks += 1
+        return [chunk]
+
+    def _next_cut(self):
+        text = self.buffer
+        first = self.chunks == 0
+        min_chars = self.policy.first_min_chars if first else self.policy.min_chars
+        max_chars = self.policy.first_max_chars if first else self.policy.max_chars
+
+        for end, newline in self._sentence_ends(text):
+            # Lists and paragraphs: a newline always ends a chunk
+            if end >= min_chars or ((first or newline) and len(text[:end].strip()) > 3):
+                return end
+
+        if first:
+            for match in CLAUSE_END.finditer(text):
+                if match.end() >= min_chars:
+                    return match.end()
+
+        if len(text) > max_chars:
+            clauses = [m.end() for m in CLAUSE_END.finditer(text, 0, max_chars) if m.end() >= min_chars]
+            if clauses:
+                return clauses[-1]
+            space = text.rfind(" ", min_chars, max_chars)
+            return space if space > 0 else max_chars
+        return None
+
+    def _sentence_ends(self, text):
+        for match in SENTENCE_END.finditer(text):
+            if text[match.start()] == "." and self._is_abbreviation(text[:match.start()]):
+                continue
+            yield match.end(), match.group() == "\n"
+
+    def _is_abbreviation(self, before):
+        word = LAST_WORD.search(before)
+        if not word:
+            return False
+        word = word.group(1).lstrip("\"'([").lower()
+        # Single initials ("J. Smith") and dotted forms ("U.S", "a.m")
+        return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()) or bool(re.fullmatch(r"(\w\.)+\w", word))
@@ -0,0 +1,144 @@
+"""
+Speculative retrieval from partial transcripts.
+While the user is still speaking, once two partial transcripts in a row agree
+the Speculator runs RAG on that guess. It can also prefill the LLM with the
+resulting prompt. When the final transcript arrives, the speculative context
+is committed if the final text is close enough to the guess and discarded
+otherwise, so retrieval and most of the prefill hide behind the user's speech.
+"""
+import asyncio
+import difflib
+import threading
+import time
+
+from services.query_cache import normalize_query
+
+
+def similarity(a, b):
+    """Edit similarity (0..1) of two transcripts after normalization."""
+    return difflib.SequenceMatcher(None, normalize_query(a), normalize_query(b)).ratio()
+
+
+class SpeculationStats:
+    def __init__(self):
+        """Counters shared by every session's Speculator."""
+        self.started = 0
+        self.committed = 0
+        self.discarded = 0
+        self.prefills = 0
+        self.wasted_prefills = 0
+        self.wasted_rag_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def stats(self):
+        with self._lock:
+            finished = self.committed + self.discarded
+            return {
+                "started": self.started,
+                "committed": self.committed,
+                "discarded": self.discarded,
+                "hit_rate": self.committed / finished if finished else 0.0,
+                "prefills": self.prefills,
+                "wasted_prefills": self.wasted_prefills,
+                "wasted_rag_seconds": round(self.wasted_rag_seconds, 3),
+            }
+
+
+class Speculator:
+    def __init__(self, rag_service, llm_service, executors, prompt_builder, stats, threshold=0.85, prefill=True):
+        """
+        One per session. threshold is the minimum similarity between the
+        speculative guess and the final transcript for the work to be kept
+        (it also decides when two partials "agree").
+        """
+        self.rag_service = rag_service
+        self.llm_service = llm_service
+        self.executors = executors
+        self.prompt_builder = prompt_builder
+        self.stats = stats
+        self.threshold = threshold
+        self.prefill = prefill
+        self._last_partial = ""
+        self._guess = None
+        self._task = None
+        self._prefill_task = None
+        self._rag_seconds = 0.0
+
+    def on_partial(self, text, conversation=None):
+        """Feeds a partial transcript; may start speculating on it."""
+        stable = self._last_partial and similarity(text, self._last_partial) >= self.threshold
+        self._last_partial = text
+        if not stable:
+            return
+        if self._guess is not None and similarity(text, self._guess) >= self.threshold:
+            return
+        self.cancel()
+        self._guess = text
+        self.stats.add(started=1)
+        self._task = asyncio.create_task(self._retrieve(text, conversation))
+
+    async def take(self, final_text):
+        """
+        Returns the speculative context if it matches final_text, else None.
+        A matching retrieval still in flight is awaited rather than repeated.
+        """
+        guess, task = self._guess, self._task
+        self._last_partial = ""
+        if guess is None:
+            return None
+        if similarity(final_text, guess) < self.threshold:
+            self.cancel()
+            return None
+
+        self._guess = self._task = None
+        try:
+            context = await task
+        except asyncio.CancelledError:
+            self.stats.add(discarded=1)
+            if asyncio.current_task().cancelling():
+                # The turn itself was interrupted (barge-in), not just the retrieval
+                task.cancel()
+                raise
+            return None
+        except Exception:
+            self.stats.add(discarded=1)
+            return None
+        finally:
+            # A committed prefill keeps running; it is not wasted
+            self._prefill_task = None
+            self._rag_seconds = 0.0
+        self.stats.add(committed=1)
+        print(f"⚡ Speculation hit: reusing retrieval for '{guess}'")
+        return context
+
+    def cancel(self):
+        """Drops any speculative work, counting it as wasted."""
+        if self._guess is None:
+            return
+        if self._task and not self._task.done():
+            self._task.cancel()
+        wasted_prefill = 1 if self._prefill_task else 0
+        if self._prefill_task and not self._prefill_task.done():
+            self._prefill_task.cancel()
+        self.stats.add(discarded=1, wasted_prefills=wasted_prefill, wasted_rag_seconds=self._rag_seconds)
+        self._guess = self._task = self._prefill_task = None
+        self._rag_seconds = 0.0
+
+    async def _retrieve(self, text, conversation):
+        t0 = time.perf_counter()
+        context = await self.executors.run("rag", self.rag_service.query, text)
+        self._rag_seconds = time.perf_counter() - t0
+        if self.prefill and conversation is not None:
+            # The final question will differ a little, but the system prompt,
+            # history and context ahead of it are already in Ollama's cache
+            messages = conversation.messages(
+                self.prompt_builder.system_prompt(), self.prompt_builder.user_message(context, text)
+            )
+            self.stats.add(prefills=1)
+            self._prefill_task = asyncio.create_task(self.llm_service.prefill(messages))
+        return context
@@ -0,0 +1,95 @@
+"""
+Parallel service startup.
+Loading Whisper, Kokoro, the knowledge base and warming the LLM are mostly
+independent, so each one is a stage that runs in its own thread as soon as
+the stages it depends on are done. The app starts serving immediately;
+/ready reports which stages are up and how long each took.
+"""
+import asyncio
+import time
+import traceback
+
+
+class Stage:
+    def __init__(self, name, fn, after=()):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.status = "pending"
+        self.seconds = None
+        self.error = None
+        self.done = None
+
+
+class Startup:
+    def __init__(self):
+        self.stages = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def add(self, name, fn, after=()):
+        """Registers fn (blocking, no arguments) to run once every stage in `after` is ready."""
+        self.stages[name] = Stage(name, fn, after)
+
+    async def run(self):
+        """Runs every stage, concurrently where dependencies allow."""
+        self.started_at = time.perf_counter()
+        for stage in self.stages.values():
+            stage.done = asyncio.Event()
+        await asyncio.gather(*(self._run_stage(stage) for stage in self.stages.values()))
+        self.finished_at = time.perf_counter()
+        timings = ", ".join(f"{s.name} {s.seconds:.1f}s" for s in self.stages.values() if s.seconds is not None)
+        print(f"✅ Startup finished in {self.finished_at - self.started_at:.1f}s ({timings})")
+
+    def ready(self, *names):
+        return all(self.stages[name].status == "ready" for name in names)
+
+    def failed(self, *names):
+        """True if any of the named stages failed or was skipped."""
+        return any(self.stages[name].status in ("failed", "skipped") for name in names)
+
+    async def wait(self, *names):
+        """Waits for the named stages; raises RuntimeError if one of them failed."""
+        for name in names:
+            stage = self.stages[name]
+            if stage.done is None:
+                raise RuntimeError(f"Startup has not begun (waiting for {name})")
+            await stage.done.wait()
+            if stage.status != "ready":
+                raise RuntimeError(f"{name} failed to start: {stage.error}")
+
+    def report(self):
+        now = self.finished_at or time.perf_counter()
+        return {
+            "elapsed_seconds": round(now - self.started_at, 3) if self.started_at else 0.0,
+            "stages": {
+                stage.name: {
+                    "status": stage.status,
+                    "seconds": round(stage.seconds, 3) if stage.seconds is not None else None,
+                    "error": stage.error,
+                }
+                for stage in self.stages.values()
+            },
+        }
+
+    async def _run_stage(self, stage):
+        try:
+            for name in stage.after:
+                await self.stages[name].done.wait()
+            failed = [name for name in stage.after if self.stages[name].status != "ready"]
+            if failed:
+                stage.status = "skipped"
+                stage.error = f"needs {', '.join(failed)}"
+                return
+            stage.status = "starting"
+            t0 = time.perf_counter()
+            await asyncio.to_thread(stage.fn)
+            stage.seconds = time.perf_counter() - t0
+            stage.status = "ready"
+        except Exception as e:
+            stage.status = "failed"
+            stage.error = f"{type(e).__name__}: {e}"
+            print(f"❌ Startup stage {stage.name} failed: {e}")
+            traceback.print_exc()
+        finally:
+            stage.done.set()
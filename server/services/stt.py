@@ -3,17 +3,44 @@ STT Service using faster-whisper.
 Optimized for speed - using CPU with int8 quantization.
 CPU is reliable and "tiny" model is fast enough (~1 second).
 """
-from faster_whisper import WhisperModel
 import tempfile
 import os
 
+from services.audio import RAW_INPUT_FORMATS, STT_SAMPLE_RATE, pcm_to_float, resample
+
+# Uploads shorter than this can't hold a question
+MIN_AUDIO_SECONDS = 0.3
+# Batched results above this no-speech probability are treated as silence
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def load_audio(audio_bytes, audio_format, sample_rate, decode):
+    """STTService.load_audio() with the container decoder passed in."""
+    if audio_format in RAW_INPUT_FORMATS:
+        audio = resample(pcm_to_float(audio_bytes, audio_format), sample_rate)
+    else:
+        audio = decode(audio_bytes)
+
+    duration = len(audio) / STT_SAMPLE_RATE
+    if duration < MIN_AUDIO_SECONDS:
+        print(f"⚠️ Audio too short ({duration:.2f}s)")
+        return None
+    print(f"🎤 Processing audio: {duration:.2f}s ({audio_format})")
+    return audio
+
+
 class STTService:
+    backend = "whisper"
+
     def __init__(self, model_size="tiny", device="cuda", compute_type="float16"):
         """
         Initialize Whisper model.
         Attempts to use GPU (cuda) first, verifies it with a warmup run.
         Falls back to CPU if unavailable or if warmup fails.
         """
+        # Imported here: faster_whisper pulls in ctranslate2 (see test_import_time.py)
+        from faster_whisper import WhisperModel
+
         print(f"🎤 Loading Whisper model: {model_size}...")
         self.model = None
 
@@ -58,39 +85,21 @@ class STTService:
             print(f"❌ Error loading Whisper on CPU: {e}")
             self.model = None
 
-    def transcribe(self, audio_bytes):
+    def transcribe(self, audio_bytes, audio_format="webm", sample_rate=STT_SAMPLE_RATE):
         """
-        Transcribes audio bytes to text.
-        Handles WebM/Opus format from browser.
+        Transcribes one upload to text.
+        audio_format is "webm" (any container the decoder understands, e.g.
+        WebM/Opus from the browser) or a raw format negotiated by the client.
         """
         if not self.model:
             print("❌ Whisper model not loaded")
             return ""
 
-        if len(audio_bytes) < 1000:
-            print(f"⚠️ Audio too short ({len(audio_bytes)} bytes)")
-            return ""
-
-        print(f"🎤 Processing audio: {len(audio_bytes)} bytes")
-
-        print(f"🎤 Processing audio: {len(audio_bytes)} bytes")
-        
         try:
-            import io
-            audio_buffer = io.BytesIO(audio_bytes)
-            
-            # Fast transcription settings
-            segments, info = self.model.transcribe(
-                audio_buffer,
-                beam_size=1,          # Fastest
-                language="en",        # Skip language detection
-                vad_filter=True,      # Remove silence
-            )
-            
-            # Collect results
-            texts = [segment.text for segment in segments]
-            result = " ".join(texts).strip()
-            
+            audio = self.load_audio(audio_bytes, audio_format, sample_rate)
+            if audio is None:
+                return ""
+            result = self.transcribe_array(audio, vad_filter=True)
             print(f"📝 Transcription: '{result}'")
             return result
             
@@ -100,6 +109,91 @@ class STTService:
             traceback.print_exc()
             return ""
 
+    def load_audio(self, audio_bytes, audio_format="webm", sample_rate=STT_SAMPLE_RATE):
+        """
+        Turns an upload into 16 kHz mono float32 samples, or None if it is too
+        short to hold speech. Raw PCM is viewed in place, with no container
+        decode and (for float32 at 16 kHz) no copy at all.
+        """
+        return load_audio(audio_bytes, audio_format, sample_rate, self.decode)
+
+    def decode(self, audio_bytes):
+        """Decodes a container upload (WebM/Opus, WAV...) to 16 kHz mono float32."""
+        import io
+        from faster_whisper import decode_audio
+        return decode_audio(io.BytesIO(audio_bytes), sampling_rate=STT_SAMPLE_RATE)
+
+    def transcribe_array(self, audio, vad_filter=False):
+        """
+        Transcribes 16 kHz mono float32 samples.
+        Streaming callers have already trimmed silence, so Whisper's VAD is
+        off by default. Segments Whisper thinks are silence are dropped either
+        way, as in the batched path.
+        """
+        if not self.model:
+            return ""
+        segments, info = self.model.transcribe(
+            audio,
+            beam_size=1,          # Fastest
+            language="en",        # Skip language detection
+            vad_filter=vad_filter,
+            condition_on_previous_text=False,
+        )
+        return " ".join(
+            segment.text for segment in segments if segment.no_speech_prob <= NO_SPEECH_THRESHOLD
+        ).strip()
+
+    def transcribe_batch(self, audios):
+        """
+        Transcribes several 16 kHz float32 utterances in one encoder/decoder pass.
+        Each clip is padded to Whisper's 30 s window anyway, so a batch costs
+        little more than a single clip. A batch of one takes the same path, so
+        whether a clip counts as silence doesn't depend on what it was batched
+        with. Falls back to one-by-one transcription with Whisper's VAD if the
+        batched path fails (e.g. a clip longer than 30 s).
+        """
+        if not self.model:
+            return [""] * len(audios)
+        try:
+            return self._generate_batch(audios)
+        except Exception as e:
+            print(f"⚠️ Batched transcription failed, running sequentially: {e}")
+        return [self.transcribe_array(audio, vad_filter=True) for audio in audios]
+
+    def _generate_batch(self, audios):
+        import numpy as np
+        import ctranslate2
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+
+        model = self.model
+        extractor = model.feature_extractor
+        if any(len(audio) > extractor.n_samples for audio in audios):
+            raise ValueError("clip longer than the 30 s window")
+
+        features = np.stack([pad_or_trim(extractor(audio), extractor.nb_max_frames) for audio in audios])
+        encoder_output = model.model.encode(ctranslate2.StorageView.from_array(np.ascontiguousarray(features)))
+
+        tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language="en")
+        prompt = list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+        results = model.model.generate(
+            encoder_output,
+            [prompt] * len(audios),
+            beam_size=1,
+            max_length=448,
+            return_no_speech_prob=True,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+        )
+        texts = []
+        for result in results:
+            # Stands in for vad_filter: drop clips Whisper thinks are silence
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+                texts.append("")
+            else:
+                texts.append(tokenizer.decode(result.sequences_ids[0]).strip())
+        return texts
+
 if __name__ == "__main__":
     stt = STTService()
     print("STT Service Ready")
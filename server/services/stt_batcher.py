@@ -0,0 +1,107 @@
+"""
+Cross-session micro-batching for Whisper.
+Every session hands its utterances to one STTBatcher. While the model is
+busy, new utterances queue up and go out together as the next batch; when it
+is idle, the first utterance waits at most max_wait for company. Results are
+fanned back to each caller's future.
+"""
+import asyncio
+import time
+import traceback
+
+
+class STTBatcher:
+    def __init__(self, stt_service, executors, max_batch=8, max_wait=0.03, workers=1):
+        """
+        max_batch caps the utterances per inference call; max_wait (seconds)
+        is the longest an utterance waits for others before it runs alone.
+        Batches run on the "stt" pool, at most `workers` in flight.
+        """
+        self.stt_service = stt_service
+        self.executors = executors
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers
+        self.pending = None
+        self._slots = None
+        self._worker = None
+        self._dispatches = set()
+        self._loop = None
+        self.batches = 0
+        self.utterances = 0
+
+    def start(self):
+        # The batcher is built by a startup stage on a worker thread, so its
+        # queue and worker are created on the event loop that first uses it
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.pending = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._worker = loop.create_task(self._run())
+
+    async def transcribe(self, audio):
+        """Transcribes a 16 kHz float32 clip as part of the next batch."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((audio, future))
+        return await future
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "utterances": self.utterances,
+            "avg_batch_size": self.utterances / self.batches if self.batches else 0.0,
+        }
+
+    async def close(self):
+        tasks = [task for task in (self._worker, *self._dispatches) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            batch = [await self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if self.pending.empty() and remaining > 0:
+                        batch.append(await asyncio.wait_for(self.pending.get(), remaining))
+                    else:
+                        batch.append(self.pending.get_nowait())
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+            # The loop only keeps weak references to tasks
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch):
+        # Callers that gave up (e.g. a cancelled partial transcript) are skipped
+        batch = [(audio, future) for audio, future in batch if not future.done()]
+        try:
+            if not batch:
+                return
+            self.batches += 1
+            self.utterances += len(batch)
+            texts = await self.executors.run(
+                "stt", self.stt_service.transcribe_batch, [audio for audio, _ in batch]
+            )
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            print(f"❌ STT batch error: {e}")
+            traceback.print_exc()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
@@ -0,0 +1,212 @@
+"""
+Streaming speech-to-text.
+While the user speaks the client sends raw mono PCM frames (int16 or float32). They go
+into a ring buffer, an energy VAD tracks speech and end-of-speech, and the
+buffered utterance is re-transcribed every partial_interval seconds to emit
+partial transcripts. At end of speech the final transcript only covers the
+trimmed utterance, so it is ready a few hundred milliseconds after the user
+stops talking.
+"""
+import asyncio
+import traceback
+
+import numpy as np
+
+from services.audio import STT_SAMPLE_RATE, pcm_to_float, resample
+
+VAD_FRAME_MS = 30
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        """Fixed-size float32 buffer holding the most recent `capacity` samples."""
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.end = 0       # total samples ever written
+        self.start = 0     # first sample still considered part of the utterance
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def full(self):
+        return len(self) >= self.capacity
+
+    def write(self, samples):
+        n = len(samples)
+        if n >= self.capacity:
+            samples = samples[-self.capacity:]
+            self.end += n - self.capacity
+            n = self.capacity
+        offset = self.end % self.capacity
+        first = min(n, self.capacity - offset)
+        self.data[offset:offset + first] = samples[:first]
+        self.data[:n - first] = samples[first:]
+        self.end += n
+        self.start = max(self.start, self.end - self.capacity)
+
+    def keep_last(self, n):
+        """Drops everything but the last n samples."""
+        self.start = max(self.start, self.end - n)
+
+    def read(self):
+        """Returns a contiguous copy of the buffered samples."""
+        length = len(self)
+        offset = self.start % self.capacity
+        if offset + length <= self.capacity:
+            return self.data[offset:offset + length].copy()
+        return np.concatenate((self.data[offset:], self.data[:offset + length - self.capacity]))
+
+    def clear(self):
+        self.start = self.end
+
+
+class EnergyVAD:
+    def __init__(self, sample_rate=STT_SAMPLE_RATE, min_threshold=0.01, noise_ratio=3.0,
+                 min_speech_ms=200, silence_ms=400):
+        """
+        Frame-level RMS detector with an adaptive noise floor. A frame is speech
+        when its RMS exceeds max(min_threshold, noise_ratio * noise floor).
+        """
+        self.frame_size = sample_rate * VAD_FRAME_MS // 1000
+        self.min_threshold = min_threshold
+        self.noise_ratio = noise_ratio
+        self.min_speech_frames = max(1, min_speech_ms // VAD_FRAME_MS)
+        self.silence_frames = max(1, silence_ms // VAD_FRAME_MS)
+        self.noise_floor = min_threshold / noise_ratio
+        self._pending = np.zeros(0, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.speech_frames = 0
+        self.trailing_silence = 0
+        self.in_speech = False
+
+    @property
+    def ended(self):
+        """True once enough speech was followed by enough silence."""
+        return self.in_speech and self.trailing_silence >= self.silence_frames
+
+    def process(self, samples):
+        """Feeds samples; returns True if speech has started (now or earlier)."""
+        samples = np.concatenate((self._pending, samples)) if len(self._pending) else samples
+        frames = len(samples) // self.frame_size
+        self._pending = samples[frames * self.frame_size:].copy()
+        if frames:
+            rms = np.sqrt(np.mean(samples[:frames * self.frame_size].reshape(frames, self.frame_size) ** 2, axis=1))
+            for level in rms:
+                threshold = max(self.min_threshold, self.noise_ratio * self.noise_floor)
+                if level > threshold:
+                    self.speech_frames += 1
+                    self.trailing_silence = 0
+                    if self.speech_frames >= self.min_speech_frames:
+                        self.in_speech = True
+                else:
+                    self.trailing_silence += 1
+                    if not self.in_speech:
+                        self.speech_frames = 0
+                        self.noise_floor = 0.95 * self.noise_floor + 0.05 * level
+        return self.in_speech
+
+
+class StreamingRecognizer:
+    def __init__(self, transcribe, send_json, on_final, sample_rate=STT_SAMPLE_RATE, audio_format="pcm16",
+                 partial_interval=0.6, silence_ms=400, max_seconds=30, preroll_ms=300, on_partial=None):
+        """
+        One per active utterance stream. transcribe(samples) is awaited for
+        partial and final passes (normally STTBatcher.transcribe).
+        send_json(event) emits partial and final transcript events;
+        on_final(text) is awaited with the final transcript once end of
+        speech is detected or finish() is called. on_partial(text), if given,
+        is called with each new partial transcript.
+        feed() and finish_soon() never wait for Whisper: partial and final
+        passes run as tasks, so the caller's receive loop stays responsive.
+        """
+        self.transcribe = transcribe
+        self.send_json = send_json
+        self.on_final = on_final
+        self.on_partial = on_partial
+        self.sample_rate = sample_rate
+        self.audio_format = audio_format
+        self.partial_samples = int(partial_interval * STT_SAMPLE_RATE)
+        self.preroll = STT_SAMPLE_RATE * preroll_ms // 1000
+        self.buffer = RingBuffer(STT_SAMPLE_RATE * max_seconds)
+        self.vad = EnergyVAD(silence_ms=silence_ms)
+        self.finished = False
+        self._last_partial_end = 0
+        self._last_partial_text = ""
+        self._partial_task = None
+        self._final_task = None
+
+    async def feed(self, data):
+        """Adds a PCM frame. Finishes the utterance (in the background) on end of speech."""
+        if self.finished or self._final_task:
+            return
+        samples = resample(pcm_to_float(data, self.audio_format), self.sample_rate)
+        self.buffer.write(samples)
+        if not self.vad.process(samples):
+            # Nothing said yet: keep only a short pre-roll before speech onset
+            self.buffer.keep_last(self.preroll)
+            return
+
+        if self.vad.ended or self.buffer.full:
+            self.finish_soon()
+            return
+
+        due = self.buffer.end - self._last_partial_end >= self.partial_samples
+        if due and (self._partial_task is None or self._partial_task.done()):
+            self._last_partial_end = self.buffer.end
+            self._partial_task = asyncio.create_task(self._emit_partial(self.buffer.read()))
+
+    async def finish(self):
+        """Transcribes the utterance and hands the final transcript on."""
+        if self.finished:
+            return
+        self.finished = True
+        if self._partial_task and not self._partial_task.done():
+            self._partial_task.cancel()
+
+        audio = self.buffer.read()
+        self.buffer.clear()
+        text = ""
+        if self.vad.in_speech and len(audio):
+            text = await self.transcribe(audio)
+        await self.send_json({"type": "final_transcript", "text": text})
+        if text and len(text.strip()) >= 2:
+            await self.on_final(text)
+
+    def finish_soon(self):
+        """Starts finish() as a task and returns it; later frames are ignored."""
+        if self._final_task is None:
+            self._final_task = asyncio.create_task(self._finish_logged())
+        return self._final_task
+
+    def cancel(self):
+        """Drops the utterance, stopping any partial or final pass in flight."""
+        self.finished = True
+        for task in (self._partial_task, self._final_task):
+            if task and not task.done():
+                task.cancel()
+
+    async def _finish_logged(self):
+        try:
+            await self.finish()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Final transcription error: {e}")
+            traceback.print_exc()
+
+    async def _emit_partial(self, audio):
+        try:
+            text = await self.transcribe(audio)
+            if text and text != self._last_partial_text and not self.finished:
+                self._last_partial_text = text
+                await self.send_json({"type": "partial_transcript", "text": text})
+                if self.on_partial:
+                    self.on_partial(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Partial transcription error: {e}")
+            traceback.print_exc()
@@ -15,6 +15,8 @@ except ImportError:
     print("⚠️ piper-tts not installed. Run: pip install piper-tts")
 
 class TTSService:
+    backend = "piper"
+
     def __init__(self):
         self.voice = None
         
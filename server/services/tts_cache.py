@@ -0,0 +1,134 @@
+"""
+TTS result cache.
+Kiosk answers repeat constantly, so synthesized sentences are cached by
+(normalized text, voice, speed, model version). A byte-bounded in-memory LRU
+sits in front of a sqlite blob store that survives restarts. Each entry holds
+the int16 PCM and the viseme track, so a hit needs no inference at all.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Collapses whitespace and unicode variants. Case is kept (it can change pronunciation)."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class TTSCache:
+    def __init__(self, path, max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tts_cache ("
+            " key TEXT PRIMARY KEY, pcm BLOB NOT NULL, visemes TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tts_cache_last_used ON tts_cache (last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(text, voice, speed, model_version):
+        raw = json.dumps([normalize_text(text), voice, float(speed), model_version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns (pcm, visemes) or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry
+
+            row = self._db.execute("SELECT pcm, visemes FROM tts_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE tts_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            entry = (bytes(row[0]), json.loads(row[1]))
+            self._remember(key, entry)
+            self.hits += 1
+            self.disk_hits += 1
+            return entry
+
+    def put(self, key, pcm, visemes):
+        entry = (bytes(pcm), visemes)
+        with self._lock:
+            self._remember(key, entry)
+            self._db.execute(
+                "INSERT OR REPLACE INTO tts_cache (key, pcm, visemes, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, entry[0], json.dumps(visemes), len(entry[0]), time.time()),
+            )
+            self._evict_disk()
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            disk_entries, disk_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tts_cache"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _remember(self, key, entry):
+        """Adds an entry to the memory tier, evicting least recently used ones."""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        size = len(entry[0])
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted[0])
+
+    def _evict_disk(self):
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tts_cache").fetchone()
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        freed = 0
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM tts_cache ORDER BY last_used"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany("DELETE FROM tts_cache WHERE key = ?", stale)
@@ -0,0 +1,235 @@
+"""
+Retrieval backends for RAGService.
+Both store chunks under content-hash ids and expose the same small API:
+ids(), add(ids, texts, metadatas), delete(ids), search(vector, k).
+
+- ChromaIndex: the LangChain Chroma store (sqlite + HNSW).
+- NumpyVectorIndex: a contiguous embedding matrix in a memory-mapped .npy,
+  scored with one matrix-vector product and argpartition top-k. Rows can be
+  stored as float32, float16 or int8 (per-row scale).
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+# Rows widened to float32 at a time when scoring float16/int8 indexes
+SCORE_BLOCK_ROWS = 65536
+
+
+class ChromaIndex:
+    name = "chroma"
+
+    def __init__(self, persist_directory, embeddings):
+        # Only loaded when this backend is selected
+        from langchain_community.vectorstores import Chroma
+        self.store = Chroma(
+            embedding_function=embeddings,
+            persist_directory=persist_directory
+        )
+
+    def ids(self):
+        return set(self.store.get(include=[])["ids"])
+
+    def add(self, ids, texts, metadatas):
+        self.store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids):
+        self.store.delete(ids=ids)
+
+    def search(self, vector, k):
+        return [doc.page_content for doc in self.store.similarity_search_by_vector(vector, k=k)]
+
+
+class NumpyVectorIndex:
+    name = "numpy"
+
+    DTYPES = ("float32", "float16", "int8")
+
+    def __init__(self, directory, embeddings=None, dtype="float32"):
+        """
+        directory holds embeddings.npy (rows), scales.npy (int8 only) and
+        chunks.json (ids, texts, metadatas in row order). embeddings is only
+        needed to embed chunks passed to add().
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype!r}, expected one of {self.DTYPES}")
+        self.directory = directory
+        self.embeddings = embeddings
+        self.dtype = dtype
+        self.matrix = None
+        self.scales = None
+        self.chunk_ids = []
+        self.texts = []
+        self.metadatas = []
+        # _lock guards the fields above, which searches snapshot; _write_lock
+        # serializes rewrites (the file watcher thread against the app)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def ids(self):
+        return set(self.chunk_ids)
+
+    def add(self, ids, texts, metadatas):
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        self.add_vectors(ids, texts, metadatas, vectors)
+
+    def add_vectors(self, ids, texts, metadatas, vectors):
+        """Appends pre-computed embeddings."""
+        with self._write_lock:
+            old = self._dense_rows()
+            vectors = _unit_rows(np.asarray(vectors, dtype=np.float32))
+            matrix = vectors if old is None else np.concatenate([old, vectors])
+            self._write(
+                matrix,
+                self.chunk_ids + list(ids),
+                self.texts + list(texts),
+                self.metadatas + [metadata or {} for metadata in metadatas],
+            )
+
+    def delete(self, ids):
+        doomed = set(ids)
+        with self._write_lock:
+            keep = [row for row, chunk_id in enumerate(self.chunk_ids) if chunk_id not in doomed]
+            old = self._dense_rows()
+            self._write(
+                old[keep] if old is not None else None,
+                [self.chunk_ids[row] for row in keep],
+                [self.texts[row] for row in keep],
+                [self.metadatas[row] for row in keep],
+            )
+
+    def search(self, vector, k):
+        """Returns the texts of the k chunks most similar to vector."""
+        return self.search_batch(np.asarray(vector, dtype=np.float32)[None, :], k)[0]
+
+    def search_batch(self, vectors, k):
+        """Top-k texts for each row of vectors, scored in one matrix product."""
+        matrix, scales, texts = self._snapshot()
+        scores = self._score(_unit_rows(np.asarray(vectors, dtype=np.float32)), matrix, scales)
+        return [[texts[row] for row in _top_k(row_scores, k)] for row_scores in scores]
+
+    def _snapshot(self):
+        """Matrix, scales and texts of one consistent version of the index."""
+        with self._lock:
+            return self.matrix, self.scales, self.texts
+
+    def _score(self, queries, matrix, scales):
+        if matrix is None or not len(matrix):
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        if self.dtype == "float32":
+            # Straight off the memory map, no copy
+            return queries @ matrix.T
+
+        # Compact rows are widened block by block to bound the extra memory
+        scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self.dtype == "int8":
+            # int8 rows hold round(row / scale * 127); undo the scale after the product
+            scores *= scales / 127.0
+        return scores
+
+    def _dense_rows(self):
+        """All rows as a float32 copy (used when rewriting the index)."""
+        return _dense(self.matrix, self.scales, self.dtype)
+
+    def _write(self, matrix, ids, texts, metadatas):
+        """
+        Saves a new version next to the current files, then swaps it in under
+        the lock. matrix must not be a view of the current memory map.
+        """
+        paths = self._paths()
+        if matrix is None or not len(matrix):
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        scales = None
+        if self.dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+            stored = np.round(matrix / scales[:, None] * 127.0).astype(np.int8)
+        else:
+            stored = matrix.astype(self.dtype)
+
+        replacements = [(_save_tmp(paths["matrix"], stored), paths["matrix"])]
+        if scales is not None:
+            replacements.append((_save_tmp(paths["scales"], scales), paths["scales"]))
+        tmp = paths["chunks"] + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "ids": ids, "texts": texts, "metadatas": metadatas}, f)
+        replacements.append((tmp, paths["chunks"]))
+        del matrix, stored
+
+        with self._lock:
+            # Windows can't replace a file that is still memory-mapped
+            self.matrix = self.scales = None
+            for tmp, path in replacements:
+                os.replace(tmp, path)
+            self._load()
+
+    def _load(self):
+        paths = self._paths()
+        if not os.path.exists(paths["chunks"]) or not os.path.exists(paths["matrix"]):
+            return
+        with open(paths["chunks"], encoding="utf-8") as f:
+            chunks = json.load(f)
+        self.chunk_ids, self.texts, self.metadatas = chunks["ids"], chunks["texts"], chunks["metadatas"]
+        if not self.chunk_ids:
+            self.matrix = self.scales = None
+            return
+
+        stored_dtype = chunks.get("dtype", "float32")
+        if stored_dtype != self.dtype:
+            # Stored with another precision (only at startup): rewrite at the requested one
+            print(f"    RAG: Converting numpy index from {stored_dtype} to {self.dtype}...")
+            scales = np.load(paths["scales"]) if stored_dtype == "int8" else None
+            rows = _dense(np.load(paths["matrix"]), scales, stored_dtype)
+            self._write(rows, self.chunk_ids, self.texts, self.metadatas)
+            return
+        self.matrix = np.load(paths["matrix"], mmap_mode="r")
+        self.scales = np.load(paths["scales"]) if stored_dtype == "int8" else None
+
+    def _paths(self):
+        return {
+            "matrix": os.path.join(self.directory, "embeddings.npy"),
+            "scales": os.path.join(self.directory, "scales.npy"),
+            "chunks": os.path.join(self.directory, "chunks.json"),
+        }
+
+
+def _dense(matrix, scales, dtype):
+    if matrix is None:
+        return None
+    # Always a copy, so nothing keeps the old memory map (and its file) open
+    rows = np.array(matrix, dtype=np.float32)
+    if dtype == "int8":
+        rows = rows * (scales[:, None] / 127.0)
+    return rows
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def _top_k(scores, k):
+    """Row indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])].tolist()
+
+
+def _save_tmp(path, array):
+    """Saves array next to path and returns the temporary file to os.replace."""
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    return tmp
@@ -0,0 +1,78 @@
+"""
+Precompiled word -> viseme lexicon.
+Built once from CMUdict into a compact binary file that is memory-mapped at
+startup. Looking a word up is a binary search over the mapped keys, with no
+G2P and no per-phoneme string work.
+
+File layout (little-endian):
+    header       4s magic b"EVLX", uint16 version, uint16 reserved, uint32 word count
+    key_offsets  uint32[count + 1], into the keys blob
+    val_offsets  uint32[count + 1], into the values blob
+    keys         UTF-8 words, sorted bytewise
+    values       uint8 viseme ids per word
+"""
+import mmap
+import os
+import struct
+
+LEXICON_MAGIC = b"EVLX"
+LEXICON_VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+
+
+def write_lexicon(path, entries):
+    """Writes {word: bytes of viseme ids} atomically to path."""
+    words = sorted((word.encode("utf-8"), ids) for word, ids in entries.items())
+    key_offsets, val_offsets = [0], [0]
+    for key, ids in words:
+        key_offsets.append(key_offsets[-1] + len(key))
+        val_offsets.append(val_offsets[-1] + len(ids))
+
+    count = len(words)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION, 0, count))
+        f.write(struct.pack(f"<{count + 1}I", *key_offsets))
+        f.write(struct.pack(f"<{count + 1}I", *val_offsets))
+        f.write(b"".join(key for key, _ in words))
+        f.write(b"".join(bytes(ids) for _, ids in words))
+    os.replace(tmp, path)
+
+
+class VisemeLexicon:
+    def __init__(self, path):
+        """Memory-maps a file written by write_lexicon()."""
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count = HEADER.unpack_from(self._map)
+        if magic != LEXICON_MAGIC or version != LEXICON_VERSION:
+            raise ValueError(f"{path} is not a version {LEXICON_VERSION} viseme lexicon")
+
+        self.count = count
+        view = memoryview(self._map)
+        offsets_size = 4 * (count + 1)
+        start = HEADER.size
+        self._key_offsets = view[start:start + offsets_size].cast("I")
+        self._val_offsets = view[start + offsets_size:start + 2 * offsets_size].cast("I")
+        self._keys = start + 2 * offsets_size
+        self._values = self._keys + self._key_offsets[count]
+
+    def __len__(self):
+        return self.count
+
+    def get(self, word):
+        """Returns the word's viseme ids as bytes, or None if it is not in the lexicon."""
+        key = word.encode("utf-8")
+        data, keys, key_offsets = self._map, self._keys, self._key_offsets
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = data[keys + key_offsets[mid]:keys + key_offsets[mid + 1]]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return data[self._values + self._val_offsets[mid]:self._values + self._val_offsets[mid + 1]]
+        return None
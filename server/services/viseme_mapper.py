@@ -1,5 +1,11 @@
-from g2p_en import G2p
-import json
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+
+from services.viseme_lexicon import VisemeLexicon, write_lexicon
 
 # Oculus Lip Sync Viseme Mapping
 # Mappings from ARPABET (g2p_en output) to Oculus Visemes
@@ -25,48 +31,274 @@ VISUAL_TARGETS = [
     "sil", "PP", "FF", "TH", "DD", "kk", "CH", "SS", "nn", "RR", "aa", "E", "ih", "oh", "ou"
 ]
 
+VISEME_IDS = {name: index for index, name in enumerate(VISUAL_TARGETS)}
+SIL = VISEME_IDS["sil"]
+
+# Every ARPABET symbol with each stress digit already applied, so mapping a
+# phoneme is one dict lookup instead of stripping digits per phoneme
+PHONEME_TO_VISEME_ID = {' ': SIL}
+for _phoneme, _viseme in ARPABET_TO_VISEME.items():
+    if _phoneme != ' ':
+        for _stress in ("", "0", "1", "2"):
+            PHONEME_TO_VISEME_ID[_phoneme + _stress] = VISEME_IDS[_viseme]
+
+# Kokoro phonemes are espeak-ng IPA. Affricates and diphthongs are matched as
+# one symbol before their single characters; stress and length marks carry no
+# mouth shape and are skipped
+IPA_TO_VISEME = {
+    'tʃ': 'CH', 'dʒ': 'CH', 'ʧ': 'CH', 'ʤ': 'CH', 'ʃ': 'CH', 'ʒ': 'CH',
+    'aɪ': 'aa', 'aʊ': 'oh', 'eɪ': 'E', 'oʊ': 'oh', 'ɔɪ': 'ou',
+    'p': 'PP', 'b': 'PP', 'm': 'PP',
+    'f': 'FF', 'v': 'FF',
+    'θ': 'TH', 'ð': 'TH',
+    't': 'DD', 'd': 'DD', 'n': 'DD', 'ŋ': 'DD', 'ɾ': 'DD', 'ʔ': 'DD',
+    'k': 'kk', 'g': 'kk', 'ɡ': 'kk', 'j': 'kk', 'h': 'kk', 'x': 'kk',
+    's': 'SS', 'z': 'SS',
+    'ɹ': 'RR', 'r': 'RR', 'l': 'RR', 'ɫ': 'RR', 'ɚ': 'RR', 'ɝ': 'RR', 'ɜ': 'RR',
+    'ɑ': 'aa', 'ɒ': 'aa', 'ɔ': 'aa', 'ʌ': 'aa', 'ə': 'aa', 'ɐ': 'aa', 'a': 'aa',
+    'æ': 'E', 'ɛ': 'E', 'e': 'E',
+    'ɪ': 'ih', 'i': 'ih', 'ᵻ': 'ih',
+    'o': 'oh', 'u': 'oh',
+    'ʊ': 'ou', 'w': 'ou',
+    # Diphthongs as Kokoro's own single-letter shorthand
+    'A': 'E', 'I': 'aa', 'O': 'oh', 'W': 'oh', 'Y': 'ou',
+}
+IPA_TO_VISEME_ID = {symbol: VISEME_IDS[viseme] for symbol, viseme in IPA_TO_VISEME.items()}
+IPA_SKIP = frozenset("ˈˌːˑ̩̃-")
+IPA_PAUSE = frozenset(".,!?;:—…")
+
+# Relative durations, scaled so a piece's visemes span exactly its audio
+VOWEL_WEIGHT = 1.0
+CONSONANT_WEIGHT = 0.7
+WORD_GAP_WEIGHT = 0.3
+PAUSE_WEIGHT = 1.5
+VOWEL_IDS = frozenset(VISEME_IDS[v] for v in ("aa", "E", "ih", "oh", "ou"))
+
+WORD_PATTERN = re.compile(r"[a-z']+|\d+(?:[.,]\d+)*")
+
+DEFAULT_LEXICON_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "viseme_lexicon.bin"
+)
+
+PHONEME_DURATION = 0.1 # Base duration in seconds
+SILENCE_DURATION = 0.05
+
+
+def phonemes_to_viseme_ids(phonemes):
+    """ARPABET phonemes (with or without stress digits) to viseme ids; unknown symbols are dropped."""
+    return bytes(PHONEME_TO_VISEME_ID[p] for p in phonemes if p in PHONEME_TO_VISEME_ID)
+
+
+def ipa_to_viseme_ids(phonemes):
+    """
+    Kokoro/espeak IPA to parallel columns: viseme ids (bytearray) and relative
+    weights (list). Word gaps and punctuation become silences; unknown symbols
+    are dropped.
+    """
+    ids, weights = bytearray(), []
+    i, n = 0, len(phonemes)
+    while i < n:
+        pair = phonemes[i:i + 2]
+        if pair in IPA_TO_VISEME_ID:
+            viseme_id = IPA_TO_VISEME_ID[pair]
+            i += 2
+        else:
+            char = phonemes[i]
+            i += 1
+            if char in IPA_SKIP:
+                continue
+            if char.isspace() or char in IPA_PAUSE:
+                weight = PAUSE_WEIGHT if char in IPA_PAUSE else WORD_GAP_WEIGHT
+                if ids and ids[-1] == SIL:
+                    weights[-1] = max(weights[-1], weight)
+                elif ids:
+                    ids.append(SIL)
+                    weights.append(weight)
+                continue
+            viseme_id = IPA_TO_VISEME_ID.get(char)
+            if viseme_id is None:
+                continue
+        ids.append(viseme_id)
+        weights.append(VOWEL_WEIGHT if viseme_id in VOWEL_IDS else CONSONANT_WEIGHT)
+    return ids, weights
+
+
+class VisemeTrack:
+    """
+    A viseme track as parallel columns: uint8 viseme ids (indexes into
+    VISUAL_TARGETS) and uint16 durations in milliseconds. Events are
+    back to back, so start times are the running sum of durations.
+    """
+    __slots__ = ("ids", "durations")
+
+    def __init__(self, ids=b"", durations=()):
+        self.ids = bytearray(ids)
+        self.durations = array("H", durations)
+
+    @classmethod
+    def from_weights(cls, ids, weights, duration=None):
+        """
+        Builds a track from relative weights (seconds unless duration is given,
+        in which case they are stretched to span exactly duration seconds).
+        Rounding is done on the running total, so it never drifts.
+        """
+        total = sum(weights)
+        scale = duration / total if duration and total else 1.0
+        durations = array("H")
+        elapsed = 0.0
+        end_ms = 0
+        for weight in weights:
+            elapsed += weight * scale
+            ms = min(round(elapsed * 1000) - end_ms, 0xFFFF)
+            durations.append(ms)
+            end_ms += ms
+        return cls(ids, durations)
+
+    @classmethod
+    def from_cached(cls, data):
+        """Reads to_columns() output, or a legacy list of viseme dicts."""
+        if isinstance(data, dict):
+            return cls(data["ids"], data["durations"])
+        return cls(
+            (VISEME_IDS.get(v["value"], SIL) for v in data),
+            (min(round(v["duration"] * 1000), 0xFFFF) for v in data),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, other):
+        self.ids += other.ids
+        self.durations.extend(other.durations)
+
+    def starts(self):
+        """Start time of each event in ms."""
+        return array("I", accumulate(self.durations, initial=0))[:-1] if self.ids else array("I")
+
+    def to_columns(self):
+        return {"ids": list(self.ids), "durations": self.durations.tolist()}
+
+    def to_dicts(self):
+        """The legacy JSON form: [{"value", "time", "duration"}] in seconds."""
+        return [
+            {"value": VISUAL_TARGETS[viseme_id], "time": start / 1000, "duration": ms / 1000}
+            for viseme_id, start, ms in zip(self.ids, self.starts(), self.durations)
+        ]
+
+
+def compile_lexicon(path):
+    """
+    Builds the lexicon file from CMUdict (the copy NLTK ships, which g2p_en
+    also uses). Returns the number of words.
+    """
+    import nltk
+    from nltk.corpus import cmudict
+    try:
+        pronunciations = cmudict.dict()
+    except LookupError:
+        nltk.download("cmudict", quiet=True)
+        pronunciations = cmudict.dict()
+
+    # First listed pronunciation; g2p_en only disambiguates a few homographs
+    entries = {word: phonemes_to_viseme_ids(prons[0]) for word, prons in pronunciations.items()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_lexicon(path, entries)
+    return len(entries)
+
+
 class VisemeMapper:
-    def __init__(self):
-        self.g2p = G2p()
+    def __init__(self, lexicon_path=DEFAULT_LEXICON_PATH, cache_size=4096, g2p=None):
+        """
+        Words are looked up in the precompiled CMUdict lexicon (built on first
+        start if missing). Anything else goes through g2p_en's neural model,
+        loaded on first use, and its result is kept in an LRU of cache_size words.
+        g2p (word -> ARPABET list) replaces the local model, e.g. with the
+        shared model host's.
+        """
+        self.lexicon = self._load_lexicon(lexicon_path)
+        self.g2p = g2p
+        self._g2p_lock = threading.Lock()
+        self.cache_size = cache_size
+        self._word_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.lexicon_hits = 0
+        self.cache_hits = 0
+        self.g2p_calls = 0
 
-    def map_text_to_visemes(self, text):
+    def map_text_to_visemes(self, text, duration=None):
         """
         Converts text to a list of viseme events.
-        Estimates timing based on phoneme count (crude approximation).
+        Estimates timing based on phoneme count (crude approximation); pass the
+        real audio duration to stretch the estimate over it.
         """
-        if not text:
-            return []
-
-        phonemes = self.g2p(text)
-        visemes = []
-        
-        # Filter out numbers/symbols if g2p leaves them, though g2p usually handles them.
-        # g2p output list like ['HH', 'AH', '0', 'L', 'OW', '1'] (numbers are stress)
-        
-        current_time = 0.0
-        duration_per_phoneme = 0.1 # Base duration in seconds
-
-        for p in phonemes:
-            # Remove stress digits
-            p_clean = ''.join([c for c in p if not c.isdigit()])
-            
-            if p_clean in ARPABET_TO_VISEME:
-                viseme = ARPABET_TO_VISEME[p_clean]
-                visemes.append({
-                    "value": viseme,
-                    "time": current_time,
-                    "duration": duration_per_phoneme 
-                })
-                current_time += duration_per_phoneme
-            elif p_clean == ' ':
-                visemes.append({
-                    "value": "sil",
-                    "time": current_time,
-                    "duration": 0.05
-                })
-                current_time += 0.05
-        
-        return visemes
+        return self.text_track(text, duration).to_dicts()
+
+    def text_track(self, text, duration=None):
+        """map_text_to_visemes() as a VisemeTrack."""
+        ids = bytearray()
+        for index, word in enumerate(WORD_PATTERN.findall(text.lower()) if text else ()):
+            if index:
+                ids.append(SIL)
+            ids += self.word_visemes(word)
+        weights = [SILENCE_DURATION if viseme_id == SIL else PHONEME_DURATION for viseme_id in ids]
+        return VisemeTrack.from_weights(ids, weights, duration)
+
+    def phoneme_track(self, phonemes, duration):
+        """
+        A VisemeTrack for the IPA phonemes Kokoro synthesized, spread over the
+        duration (seconds) of the audio it produced for them.
+        """
+        return VisemeTrack.from_weights(*ipa_to_viseme_ids(phonemes or ""), duration)
+
+    def word_visemes(self, word):
+        """Viseme ids (bytes) for one lowercase word."""
+        if self.lexicon is not None:
+            ids = self.lexicon.get(word)
+            if ids is not None:
+                self.lexicon_hits += 1
+                return ids
+
+        with self._cache_lock:
+            ids = self._word_cache.get(word)
+            if ids is not None:
+                self._word_cache.move_to_end(word)
+                self.cache_hits += 1
+                return ids
+
+        ids = phonemes_to_viseme_ids(self.phonemize(word))
+        with self._cache_lock:
+            self._word_cache[word] = ids
+            while len(self._word_cache) > self.cache_size:
+                self._word_cache.popitem(last=False)
+        return ids
+
+    def stats(self):
+        return {
+            "lexicon_words": len(self.lexicon) if self.lexicon is not None else 0,
+            "lexicon_hits": self.lexicon_hits,
+            "cache_hits": self.cache_hits,
+            "g2p_calls": self.g2p_calls,
+        }
+
+    def phonemize(self, word):
+        """ARPABET phonemes for one word from the G2P model."""
+        with self._g2p_lock:
+            if self.g2p is None:
+                from g2p_en import G2p
+                self.g2p = G2p()
+            self.g2p_calls += 1
+            return self.g2p(word)
+
+    @staticmethod
+    def _load_lexicon(path):
+        try:
+            if not os.path.exists(path):
+                print("👄 Compiling viseme lexicon from CMUdict...")
+                print(f"   {compile_lexicon(path)} words written to {path}")
+            return VisemeLexicon(path)
+        except Exception as e:
+            print(f"⚠️ Viseme lexicon unavailable, using G2P for every word: {e}")
+            return None
 
 if __name__ == "__main__":
     mapper = VisemeMapper()
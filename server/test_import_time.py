@@ -0,0 +1,93 @@
+"""
+Import-time budget.
+Imports each module in a fresh interpreter under `python -X importtime` and
+checks that none of the model backends (Whisper, Kokoro, LangChain, Chroma,
+g2p_en/NLTK) get pulled in, and that the import stays within its budget.
+Those load inside the services that use them, so health checks, tools and
+workers talking to a model host start fast.
+
+    python test_import_time.py           # table of import times
+    python -m pytest test_import_time.py
+"""
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Module -> cumulative import budget in milliseconds (best of RUNS)
+BUDGETS_MS = {
+    "main": 1500,
+    "serve": 1000,
+    "service_factory": 300,
+    "rag_service": 500,
+    "services.stt": 500,
+    "services.kokoro_tts": 500,
+    "services.viseme_mapper": 300,
+    "services.model_host": 500,
+}
+RUNS = 3
+
+# Top-level packages that must only load when a backend is actually used
+HEAVY_PACKAGES = {
+    "faster_whisper", "ctranslate2", "kokoro_onnx", "onnxruntime",
+    "huggingface_hub", "soundfile", "langchain", "langchain_community",
+    "langchain_core", "langchain_ollama", "langchain_text_splitters",
+    "chromadb", "g2p_en", "nltk", "torch", "piper",
+}
+
+
+def measure(module):
+    """Returns (cumulative_ms, imported_packages) for importing module in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVER_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that triggered them
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+        packages.add(name.strip().split(".")[0])
+    return total_us / 1000, packages
+
+
+def best_of(module, runs=RUNS):
+    results = [measure(module) for _ in range(runs)]
+    return min(ms for ms, _ in results), set().union(*(packages for _, packages in results))
+
+
+def check(module):
+    """Returns (import_ms, problems); problems is empty when the import is within budget."""
+    ms, packages = best_of(module)
+    problems = []
+    heavy = sorted(packages & HEAVY_PACKAGES)
+    if heavy:
+        problems.append(f"{module} imports {', '.join(heavy)}")
+    if ms > BUDGETS_MS[module]:
+        problems.append(f"{module} took {ms:.0f}ms to import (budget {BUDGETS_MS[module]}ms)")
+    return ms, problems
+
+
+def test_import_budgets():
+    problems = [problem for module in BUDGETS_MS for problem in check(module)[1]]
+    assert not problems, "\n".join(problems)
+
+
+if __name__ == "__main__":
+    failed = False
+    print(f"⏱️ Import times (best of {RUNS}):")
+    for module, budget in BUDGETS_MS.items():
+        ms, problems = check(module)
+        failed |= bool(problems)
+        print(f"   {'❌' if problems else '✅'} {module:<24} {ms:7.0f}ms / {budget}ms")
+        for problem in problems:
+            print(f"      {problem}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,142 @@
+"""
+Wire format round trips: binary audio frames (header fields, PCM16 and WAV
+payloads) and viseme frames (offset, id and duration columns), as packed by
+ClientChannel and read back by the unpack helpers a client would mirror.
+
+    python -m pytest test_protocol.py
+"""
+import asyncio
+import io
+import wave
+
+import numpy as np
+import pytest
+
+from services.audio import pcm16_to_wav
+from services.protocol import (
+    AUDIO_FORMAT_PCM16, AUDIO_FORMAT_WAV, AUDIO_HEADER, PROTOCOL_VERSION, VISEME_HEADER, ClientChannel,
+    pack_audio_frame, pack_viseme_frame, unpack_audio_frame, unpack_viseme_frame,
+)
+from services.viseme_mapper import VISUAL_TARGETS, VisemeTrack
+
+SAMPLE_RATE = 24000
+
+
+class RecordingSocket:
+    """Stands in for the WebSocket and keeps everything sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_bytes(self, data):
+        self.sent.append(bytes(data))
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def tone(samples=480):
+    t = np.arange(samples) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * 440 * t) * 12000).astype(np.int16)
+
+
+def read_wav(data):
+    with wave.open(io.BytesIO(bytes(data))) as wav:
+        return wav.getframerate(), wav.getnchannels(), wav.getsampwidth(), wav.readframes(wav.getnframes())
+
+
+def test_pcm16_frame_round_trip():
+    pcm = tone()
+    frame = pack_audio_frame(7, SAMPLE_RATE, AUDIO_FORMAT_PCM16, pcm)
+    assert frame[:2] == b"EA" and frame[2] == PROTOCOL_VERSION
+    assert len(frame) == AUDIO_HEADER.size + pcm.nbytes
+
+    seq, sample_rate, audio_format, payload = unpack_audio_frame(frame)
+    assert (seq, sample_rate, audio_format) == (7, SAMPLE_RATE, AUDIO_FORMAT_PCM16)
+    np.testing.assert_array_equal(np.frombuffer(payload, dtype="<i2"), pcm)
+
+
+def test_wav_frame_round_trip():
+    pcm = tone().tobytes()
+    seq, sample_rate, audio_format, payload = unpack_audio_frame(
+        pack_audio_frame(3, SAMPLE_RATE, AUDIO_FORMAT_WAV, pcm16_to_wav(pcm, SAMPLE_RATE))
+    )
+    assert (seq, sample_rate, audio_format) == (3, SAMPLE_RATE, AUDIO_FORMAT_WAV)
+    assert read_wav(payload) == (SAMPLE_RATE, 1, 2, pcm)
+
+
+def test_sequence_number_wraps():
+    seq, _, _, _ = unpack_audio_frame(pack_audio_frame(2 ** 32 + 5, SAMPLE_RATE, AUDIO_FORMAT_PCM16, b""))
+    assert seq == 5
+
+
+@pytest.mark.parametrize("frame, message", [
+    (b"XX" + pack_audio_frame(0, SAMPLE_RATE, AUDIO_FORMAT_PCM16, b"\0\0")[2:], "Not an audio frame"),
+    (b"EA\x09" + pack_audio_frame(0, SAMPLE_RATE, AUDIO_FORMAT_PCM16, b"\0\0")[3:], "Unsupported protocol version"),
+])
+def test_bad_audio_frames_are_rejected(frame, message):
+    with pytest.raises(ValueError, match=message):
+        unpack_audio_frame(frame)
+
+
+def test_pcm16_stream_starts_with_a_wav_header():
+    socket = RecordingSocket()
+    channel = ClientChannel(socket)
+    channel.negotiate({"audio_transport": "binary", "audio_format": "pcm16"})
+    pieces = [tone(240), tone(480)]
+
+    async def send():
+        await channel.begin_audio(SAMPLE_RATE)
+        for pcm in pieces:
+            await channel.send_audio(pcm, SAMPLE_RATE)
+
+    asyncio.run(send())
+    frames = [unpack_audio_frame(frame) for frame in socket.sent]
+    assert [(seq, audio_format) for seq, _, audio_format, _ in frames] == [
+        (0, AUDIO_FORMAT_WAV), (1, AUDIO_FORMAT_PCM16), (2, AUDIO_FORMAT_PCM16)
+    ]
+    assert all(sample_rate == SAMPLE_RATE for _, sample_rate, _, _ in frames)
+    # A player reads the header, then the PCM frames as the data chunk
+    stream = b"".join(bytes(payload) for _, _, _, payload in frames)
+    assert bytes(frames[0][3])[:4] == b"RIFF"
+    assert stream[44:] == b"".join(pcm.tobytes() for pcm in pieces)
+
+
+def test_viseme_frame_round_trip():
+    track = VisemeTrack.from_weights([1, 5, 0, 9], [0.05, 0.12, 0.08, 0.3], duration=0.6)
+    frame = pack_viseme_frame(track, 1500)
+    assert frame[:2] == b"EV" and len(frame) == VISEME_HEADER.size + 3 * len(track)
+
+    offset_ms, unpacked = unpack_viseme_frame(frame)
+    assert offset_ms == 1500
+    assert unpacked.to_columns() == track.to_columns()
+    assert list(unpacked.starts()) == list(track.starts())
+    assert sum(unpacked.durations) == 600
+    assert all(viseme_id < len(VISUAL_TARGETS) for viseme_id in unpacked.ids)
+
+
+def test_empty_viseme_frame_round_trip():
+    offset_ms, track = unpack_viseme_frame(pack_viseme_frame(VisemeTrack(), 0))
+    assert offset_ms == 0 and len(track) == 0
+
+
+def test_truncated_viseme_frame_is_rejected():
+    frame = pack_viseme_frame(VisemeTrack(b"\x01\x02", [100, 200]), 0)
+    with pytest.raises(ValueError, match="can't hold"):
+        unpack_viseme_frame(frame[:-1])
+
+
+def test_binary_and_json_viseme_columns_match():
+    track = VisemeTrack(b"\x00\x03\x07", [40, 0xFFFF, 120])
+    sent = {}
+    for transport in ("binary", "json"):
+        socket = RecordingSocket()
+        channel = ClientChannel(socket)
+        channel.negotiate({"audio_transport": transport, "viseme_format": "columnar"})
+        asyncio.run(channel.send_visemes(track, offset=2.25))
+        sent[transport] = socket.sent[0]
+
+    offset_ms, unpacked = unpack_viseme_frame(sent["binary"])
+    message = sent["json"]
+    assert message["type"] == "viseme_track"
+    assert (offset_ms, unpacked.to_columns()) == (message["offset"], {"ids": message["ids"], "durations": message["durations"]})
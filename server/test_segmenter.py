@@ -0,0 +1,82 @@
+"""
+StreamingSegmenter boundaries: abbreviations, decimals and dotted initials
+must not end a chunk, and flush() hands over whatever the stream left.
+Every case is fed both word by word and one character at a time, since LLM
+tokens can split "3.5" or "a.m." anywhere.
+
+    python -m pytest test_segmenter.py
+"""
+import re
+
+import pytest
+
+from services.segmenter import SegmenterPolicy, StreamingSegmenter
+
+TOKENIZERS = {
+    "words": lambda text: re.findall(r"\s*\S+", text),
+    "chars": list,
+}
+
+
+def segment(text, tokenize, policy=None):
+    """Returns (chunks emitted while feeding, chunks from flush)."""
+    segmenter = StreamingSegmenter(policy)
+    fed = []
+    for token in tokenize(text):
+        fed.extend(segmenter.feed(token))
+    return fed, segmenter.flush()
+
+
+@pytest.fixture(params=sorted(TOKENIZERS))
+def tokenize(request):
+    return TOKENIZERS[request.param]
+
+
+def test_abbreviations_do_not_end_a_sentence(tokenize):
+    fed, rest = segment(
+        "Hi there, welcome. Dr. Smith teaches at 9 a.m. in Rm. 204 every day of the week. Bye now.", tokenize
+    )
+    assert fed == ["Hi there, welcome.", "Dr. Smith teaches at 9 a.m. in Rm. 204 every day of the week."]
+    assert rest == ["Bye now."]
+
+
+def test_decimals_stay_together(tokenize):
+    fed, rest = segment("Printing costs 3.5 pesos per page. Color pages cost 7.25 pesos each.", tokenize)
+    assert fed == ["Printing costs 3.5 pesos per page."]
+    assert rest == ["Color pages cost 7.25 pesos each."]
+
+
+def test_dotted_abbreviation_inside_a_sentence(tokenize):
+    fed, rest = segment(
+        "She studied in the U.S. for two years before moving back home. Then she joined USTP.", tokenize
+    )
+    assert fed == ["She studied in the U.S. for two years before moving back home."]
+    assert rest == ["Then she joined USTP."]
+
+
+def test_dotted_abbreviation_at_a_sentence_end_loses_no_text(tokenize):
+    # "U.S." can't be told apart from a sentence end, so it never cuts there
+    text = "She moved to the U.S. Then she studied engineering there for four more years."
+    fed, rest = segment(text, tokenize)
+    assert not any(chunk.endswith("U.S.") for chunk in fed)
+    assert " ".join(fed + rest) == text
+
+
+def test_flush_returns_the_unfinished_sentence(tokenize):
+    fed, rest = segment("Hello. The library opens at", tokenize)
+    assert fed == ["Hello."]
+    assert rest == ["The library opens at"]
+
+
+def test_flush_of_empty_or_whitespace_stream():
+    assert segment("", list) == ([], [])
+    assert segment("  \n ", list) == ([], [])
+
+
+def test_overlong_sentence_is_cut_at_a_clause():
+    policy = SegmenterPolicy(first_min_chars=16, first_max_chars=80, min_chars=20, max_chars=60)
+    text = "Okay. " + "The east wing has labs, offices and classrooms, and the west wing has the library and a cafe"
+    fed, rest = segment(text, TOKENIZERS["words"], policy)
+    assert fed[0] == "Okay."
+    assert all(len(chunk) <= policy.max_chars for chunk in fed + rest)
+    assert " ".join(fed + rest) == text
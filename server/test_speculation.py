@@ -0,0 +1,89 @@
+"""
+Speculator.take() hands a finished or in-flight speculative retrieval to the
+turn, and must not swallow the cancellation of a turn interrupted while it
+waits (barge-in).
+
+    python -m pytest test_speculation.py
+"""
+import asyncio
+import time
+
+from services.scheduler import ModelExecutors, SessionScheduler
+from services.speculation import SpeculationStats, Speculator
+
+QUESTION = "where is the library"
+
+
+class SlowRAG:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def query(self, text):
+        time.sleep(self.seconds)
+        return f"context for {text}"
+
+
+def speculate(rag_seconds):
+    """A Speculator with a retrieval for QUESTION already in flight."""
+    executors = ModelExecutors()
+    stats = SpeculationStats()
+    speculator = Speculator(SlowRAG(rag_seconds), None, executors, None, stats, prefill=False)
+    speculator.on_partial(QUESTION)
+    speculator.on_partial(QUESTION)
+    return speculator, stats, executors
+
+
+def test_take_returns_the_matching_retrieval():
+    async def run():
+        speculator, stats, executors = speculate(0.05)
+        try:
+            return await speculator.take(QUESTION), stats.stats()
+        finally:
+            executors.shutdown()
+
+    context, stats = asyncio.run(run())
+    assert context == f"context for {QUESTION}"
+    assert (stats["committed"], stats["discarded"]) == (1, 0)
+
+
+def test_take_discards_a_different_question():
+    async def run():
+        speculator, stats, executors = speculate(0.05)
+        try:
+            return await speculator.take("what time does the cafeteria close"), stats.stats()
+        finally:
+            executors.shutdown()
+
+    context, stats = asyncio.run(run())
+    assert context is None
+    assert (stats["committed"], stats["discarded"]) == (0, 1)
+
+
+def test_interrupt_while_waiting_in_take_cancels_the_turn():
+    events = []
+
+    async def run():
+        speculator, stats, executors = speculate(0.3)
+        session = SessionScheduler()
+        session.start()
+
+        async def turn():
+            context = await speculator.take(QUESTION)
+            events.append(("answer started", context))
+            await asyncio.sleep(2.0)
+            events.append(("answer finished", context))
+
+        await session.submit(turn)
+        await asyncio.sleep(0.05)
+        t0 = time.perf_counter()
+        interrupted = await session.interrupt()
+        waited = time.perf_counter() - t0
+        session._worker.cancel()
+        executors.shutdown()
+        return interrupted, waited, stats.stats()
+
+    interrupted, waited, stats = asyncio.run(run())
+    assert interrupted == 1
+    assert waited < 0.5
+    assert events == []
+    assert (stats["committed"], stats["discarded"]) == (0, 1)